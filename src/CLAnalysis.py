@@ -1,17 +1,19 @@
 import CLProject as clp
 import math
 import numpy as np
-from scipy.signal import fftconvolve
 import tempfile
 from pathlib import Path
 import subprocess
 from scipy.io import wavfile
-import pandas as pd
-from qtpy.QtWidgets import QErrorMessage, QMessageBox
 import sys
-import requests
-from zipfile import ZipFile
+from zipfile import ZipFile, BadZipFile
 from scipy.fftpack import fft, ifft
+from scipy.fft import rfft, irfft, next_fast_len
+from scipy.sparse import csr_matrix
+from contextlib import contextmanager
+from threading import RLock
+import hashlib
+import json
 
 
 # module with helper functions for chirp analysis, mostly math stuff
@@ -51,6 +53,93 @@ def generate_stimulus():
         logchirp(clp.project['start_freq'], clp.project['stop_freq'], clp.project['chirp_length'], clp.project['sample_rate']),
         np.zeros(round(clp.project['post_sweep']*clp.project['sample_rate']))])
     # if this is updated at some point probably refactor and also update harmonic_chirp() in ImpulsiveDistortion.measure()
+    clp.caches['stimulus_artifacts'] = {}
+    clp.caches['stimulus_cache_contents'] = set()
+    clp.caches['stimulus_cache_key'] = stimulus_cache_key() # project parameters the stimulus was generated with, read_response() can change the sample rate afterwards (use_input_rate)
+
+# held while checking or updating the shared analysis caches, so measurements running at the same time on the analysis thread pool (see CLMeasurements.run_measurements) don't clear or update the same entries at once
+# only held for lookups and inserts, never while calculating an entry (see cache_entry())
+cache_lock = RLock()
+entry_locks = {} # locks of the cache entries that are being calculated, keyed by (id of the cache dict, entry key)
+
+def cache_entry(cache, key, calculate):
+    # get cache[key], calling calculate() to add it if it is missing
+    # a thread calculating an entry only holds the lock for that entry, so other entries (and other analysis contexts) are calculated at the same time, while threads needing the same entry wait for it instead of calculating it again
+    with cache_lock:
+        if key in cache:
+            return cache[key]
+        entry_lock = entry_locks.setdefault((id(cache), key), RLock())
+    with entry_lock:
+        with cache_lock:
+            if key in cache:
+                return cache[key]
+        value = calculate()
+        with cache_lock:
+            value = cache.setdefault(key, value)
+            entry_locks.pop((id(cache), key), None)
+    return value
+
+# arrays derived from the stimulus (stimulus spectrum, decimated stimulus, extended THD chirp spectra, etc.) that are reused across measurements and input files
+# keyed by artifact name, stimulus length, and sample rate, so artifacts for the full-rate and decimated stimulus can be held at the same time
+# cleared when the stimulus is regenerated. Can be saved to and loaded from a cache file next to the project file to skip regenerating everything on each command-line run
+# stored in the caches of the current analysis context (see CLProject.AnalysisContext)
+def get_stimulus_artifacts():
+    return clp.caches.setdefault('stimulus_artifacts', {})
+
+def get_stimulus_cache_contents():
+    return clp.caches.setdefault('stimulus_cache_contents', set()) # names of the artifacts in the cache file that was loaded or written for the current stimulus
+
+STIMULUS_CACHE_VERSION = 1 # increment if the cache file contents or artifact calculations change
+STIMULUS_CACHE_PARAMS = ['start_freq', 'stop_freq', 'chirp_length', 'pre_sweep', 'post_sweep', 'sample_rate'] # project parameters that determine the stimulus
+
+def stimulus_artifact(name, calculate):
+    # get a named array derived from the current stimulus, calling calculate() to generate it if it has not already been calculated (or loaded from a cache file)
+    stimulus_artifacts = get_stimulus_artifacts()
+    key = name + '_' + str(len(clp.signals['stimulus'])) + '_' + str(clp.project['sample_rate'])
+    return cache_entry(stimulus_artifacts, key, calculate) # measurements running concurrently wait for an artifact that is being calculated instead of calculating it again
+
+def stimulus_spectrum():
+    # FFT of the current stimulus, used as the deconvolution reference by most measurements
+    return stimulus_artifact('stimulus_fft', lambda: fft(clp.signals['stimulus']))
+
+def stimulus_cache_key():
+    # hash of the project parameters that determine the stimulus. A cache file is only used if its key matches the current project
+    return hashlib.sha1(json.dumps([STIMULUS_CACHE_VERSION] + [clp.project[param] for param in STIMULUS_CACHE_PARAMS]).encode()).hexdigest()
+
+def load_stimulus_cache(cache_path):
+    # load the stimulus and stimulus artifacts from a cache file written by save_stimulus_cache()
+    # returns False if the cache file doesn't exist, can't be read, or was generated with different project parameters. Stimulus needs to be generated normally in that case
+    stimulus_artifacts = get_stimulus_artifacts()
+    stimulus_cache_contents = get_stimulus_cache_contents()
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            if str(cache['cache_key']) != stimulus_cache_key():
+                return False
+            clp.signals['stimulus'] = cache['stimulus']
+            clp.caches['stimulus_cache_key'] = str(cache['cache_key'])
+            stimulus_artifacts.clear()
+            stimulus_artifacts.update({name: cache[name] for name in cache.files if name not in ['cache_key', 'stimulus']})
+            stimulus_cache_contents.clear()
+            stimulus_cache_contents.update(['stimulus'] + list(stimulus_artifacts))
+    except (OSError, ValueError, KeyError, BadZipFile):
+        return False
+    return True
+
+def save_stimulus_cache(cache_path):
+    # write the current stimulus and all stimulus artifacts calculated so far to a cache file (numpy .npz format)
+    # the cache file is keyed on the project parameters the stimulus was generated or loaded with, not the current ones, so it matches load_stimulus_cache() on the next run
+    # skipped if the cache file already contains everything
+    stimulus_artifacts = get_stimulus_artifacts()
+    stimulus_cache_contents = get_stimulus_cache_contents()
+    if stimulus_cache_contents == set(['stimulus'] + list(stimulus_artifacts)):
+        return
+    try:
+        with open(cache_path, 'wb') as cache_file:
+            np.savez(cache_file, cache_key=clp.caches.get('stimulus_cache_key', stimulus_cache_key()), stimulus=clp.signals['stimulus'], **stimulus_artifacts)
+        stimulus_cache_contents.clear()
+        stimulus_cache_contents.update(['stimulus'] + list(stimulus_artifacts))
+    except OSError as ex:
+        print('could not write stimulus cache file: ' + str(ex))
 
 def generate_output_stimulus():
     # generate a multi-channel stimulus signal using the project output parameters
@@ -81,6 +170,7 @@ def generate_stimulus_file(out_path):
     except PermissionError as ex:
         print(ex)
         if clp.gui_mode:
+            from qtpy.QtWidgets import QErrorMessage # Qt is only imported in GUI mode
             error_box = QErrorMessage()
             error_box.showMessage('Error writing stimulus file \n' + str(ex))
             error_box.exec()
@@ -89,40 +179,332 @@ def read_response():
     # get the desired channel from the input signal, locate the chirp in the signal, and trim/pad to time align with the reference stimulus
     # assumes input signal is already captured/loaded into clp.signals['raw_response'] and clp.signals['stimulus'] has been generated
     
-    # get only the desired channel
-    if clp.signals['raw_response'].ndim > 1: # multiple channels in input file
-        response = clp.signals['raw_response'][:,clp.project['input']['channel']-1]
-    else:
-        response = clp.signals['raw_response']
+    # use the project sample rate for analysis if requested
+    if clp.project['sample_rate'] != clp.IO['input']['sample_rate'] and clp.project['use_input_rate']:
+        clp.project['sample_rate'] = clp.IO['input']['sample_rate'] # this should handle CLI settings, GUI should always update itself so sample rate display matches input rate
 
-    # resample input if necessary
-    if clp.project['sample_rate'] != clp.IO['input']['sample_rate']:
-        if clp.project['use_input_rate']:
-            clp.project['sample_rate'] = clp.IO['input']['sample_rate'] # this should handle CLI settings, GUI should always update itself so sample rate display matches input rate
-        else:
-            response = resample(response, clp.IO['input']['sample_rate'], clp.project['sample_rate'])
+    # get only the desired channel, resampled if necessary
+    response = input_channel(clp.project['input']['channel'])
         
     # determine the position of the captured chirp in the response signal
     response_delay = find_offset(response, clp.signals['stimulus'])
     clp.IO['input']['delay'] = response_delay
     
-    # pad the response if the beginning or end of the chirp is cut off or there isn't enough silence for pre/post sweep (or there is a severe mismatch between stimulus and response). Throw a warning?
-    start_padding = max(0, -response_delay) # response_delay should be negative if beginning is cut off
-    response_delay = response_delay + start_padding
-    end_padding = max(0, len(clp.signals['stimulus']) - (len(response) - response_delay))
-    response = np.concatenate([np.zeros(start_padding),
-                               response,
-                               np.zeros(end_padding)])
-    
     # trim the raw response to just the segment aligned with the stimulus
-    clp.signals['response'] = response[response_delay:response_delay + len(clp.signals['stimulus'])] # get only the part of the raw response signal where the chirp was detected
+    # padded if the beginning or end of the chirp is cut off or there isn't enough silence for pre/post sweep (or there is a severe mismatch between stimulus and response). Throw a warning?
+    clp.signals['response'] = signal_window(response, response_delay, len(clp.signals['stimulus'])) # get only the part of the raw response signal where the chirp was detected
     
     # if there is enough silence in the response recording preceeding the chirp, use that portion for noise floor estimation
     if response_delay > len(clp.signals['stimulus']):
-        clp.signals['noise'] = response[response_delay-len(clp.signals['stimulus']):response_delay]
+        clp.signals['noise'] = signal_window(response, response_delay-len(clp.signals['stimulus']), len(clp.signals['stimulus']))
     else:
         clp.signals['noise'] = []
 
+def signal_window(signal, start, length):
+    # get a segment of a signal starting at sample index start, zero padding any portion that falls outside of the signal
+    # returns a read-only view into the original signal (no copy) if the segment is fully inside the signal, only allocates a new array if padding is needed
+    if start >= 0 and start + length <= len(signal):
+        window = signal[start:start + length]
+        window.flags.writeable = False
+        return window
+    window = np.zeros(length)
+    signal_start = max(0, start)
+    signal_stop = min(len(signal), start + length)
+    if signal_stop > signal_start:
+        window[signal_start - start:signal_stop - start] = signal[signal_start:signal_stop]
+    return window
+
+# memoized input channels shared by read_response() and any measurements that use additional input channels (loopback references, timing references, etc.)
+# only valid for the raw input, stimulus, sample rates, and chirp position they were calculated with. Cleared automatically whenever any of them change
+# stored in the caches of the current analysis context (see CLProject.AnalysisContext)
+def get_channel_cache():
+    return clp.caches.setdefault('channels', {'input_source': None, 'aligned_source': None, 'input': {}, 'aligned': {}, 'offset': {}})
+
+def check_channel_cache():
+    # clear cached channels if the raw input signal or sample rates changed since they were calculated
+    # aligned channels and offsets are also cleared if the stimulus or the detected chirp position changed
+    channel_cache = get_channel_cache()
+    input_source = channel_cache['input_source']
+    if input_source is None or input_source[0] is not clp.signals['raw_response'] or input_source[1:] != (clp.project['sample_rate'], clp.IO['input']['sample_rate']):
+        channel_cache['input'].clear()
+        channel_cache['input_source'] = (clp.signals['raw_response'], clp.project['sample_rate'], clp.IO['input']['sample_rate'])
+        channel_cache['aligned_source'] = None
+    aligned_source = channel_cache['aligned_source']
+    if aligned_source is None or aligned_source[0] is not clp.signals['stimulus'] or aligned_source[1] != clp.IO['input']['delay']:
+        channel_cache['aligned'].clear()
+        channel_cache['offset'].clear()
+        channel_cache['aligned_source'] = (clp.signals['stimulus'], clp.IO['input']['delay'])
+
+def input_channel(channel):
+    # get a full channel from the raw input signal, resampled to the project sample rate if necessary. Channels are numbered from 1
+    channel_cache = get_channel_cache()
+    with cache_lock:
+        check_channel_cache()
+    def calc_input_channel():
+        if clp.signals['raw_response'].ndim > 1: # multiple channels in input file
+            signal = clp.signals['raw_response'][:,channel-1]
+        else:
+            signal = clp.signals['raw_response']
+        if clp.project['sample_rate'] != clp.IO['input']['sample_rate'] and clp.IO['input']['sample_rate'] != 0:
+            signal = resample(signal, clp.IO['input']['sample_rate'], clp.project['sample_rate'])
+        return signal
+    return cache_entry(channel_cache['input'], channel, calc_input_channel)
+
+def aligned_channel(channel, offset=0):
+    # get an input channel trimmed/padded to the stimulus length at the chirp position found by read_response(), plus an optional offset in samples
+    # channel 0 is the stimulus itself
+    channel_cache = get_channel_cache()
+    if channel == 0:
+        return clp.signals['stimulus']
+    with cache_lock:
+        check_channel_cache()
+    return cache_entry(channel_cache['aligned'], (channel, offset), lambda: signal_window(input_channel(channel), clp.IO['input']['delay'] + offset, len(clp.signals['stimulus'])))
+
+def channel_offset(channel, reference_channel=0):
+    # get the offset in samples of an aligned input channel relative to another aligned input channel, or relative to the stimulus if reference_channel is 0
+    channel_cache = get_channel_cache()
+    with cache_lock:
+        check_channel_cache()
+    return cache_entry(channel_cache['offset'], (channel, reference_channel), lambda: find_offset(aligned_channel(channel), aligned_channel(reference_channel)))
+
+def analysis_signals():
+    # stack the response and noise sample into a single 2D array so measurements can run deconvolution, windowing, and FFTs on both in one batched pass
+    # row 0 is always the response, row 1 is the noise sample if one is available
+    if any(clp.signals['noise']):
+        return np.vstack([clp.signals['response'], clp.signals['noise']])
+    return np.atleast_2d(clp.signals['response'])
+
+# intermediate signals shared by measurements within a single analysis (raw impulse response, gated impulse responses, harmonic spectra, filtered responses, etc.)
+# each measurement declares the intermediates its measure() uses with CLMeasurement.intermediates(). plan_intermediates() counts the consumers of each intermediate,
+# each intermediate is calculated the first time it is needed, and it is released as soon as its last consumer is finished so memory use stays bounded
+# intermediates are identified by a tuple key starting with the intermediate type, e.g. ('raw_ir',) or ('gated_ir', window_start, fade_in, window_end, fade_out)
+# intermediates requested outside of a planned analysis (e.g. a single measurement updated from the GUI) are calculated without being stored
+# held in the caches of the current analysis context (see CLProject.AnalysisContext)
+
+# intermediates calculated from other intermediates, as a function of the intermediate key. Measurement modules add their own intermediate types
+intermediate_dependencies = {
+    'raw_ir': lambda key: [('raw_fr',)],
+}
+
+def get_intermediate_dependencies(key):
+    if key[0] in intermediate_dependencies:
+        return intermediate_dependencies[key[0]](key)
+    return []
+
+def plan_intermediates(consumers):
+    # set up a new analysis plan. consumers is a list with the intermediate keys declared by each measurement
+    # each intermediate is consumed once by each measurement that declares it, and once by each intermediate calculated from it
+    counts = {}
+    def add_consumer(key):
+        counts[key] = counts.get(key, 0) + 1
+        if counts[key] == 1: # first consumer, the intermediate will be calculated (once) and will consume its own dependencies
+            for dependency in get_intermediate_dependencies(key):
+                add_consumer(dependency)
+    for keys in consumers:
+        for key in set(keys):
+            add_consumer(key)
+    clp.caches['intermediates'] = {'consumers': counts, 'values': {}, 'calculated': set(), 'locks': {}}
+
+def end_intermediates():
+    # drop any intermediates left over after the analysis is finished
+    clp.caches.pop('intermediates', None)
+
+def release_intermediates(keys):
+    # called when a consumer is finished with the given intermediates. Intermediates without any remaining consumers are dropped
+    plan = clp.caches.get('intermediates')
+    if plan is None:
+        return
+    with cache_lock:
+        for key in set(keys):
+            if plan['consumers'].get(key, 0) == 0:
+                continue
+            plan['consumers'][key] -= 1
+            if plan['consumers'][key] == 0:
+                plan['values'].pop(key, None)
+                if key not in plan['calculated']:
+                    # never needed by any consumer, so it won't consume its own dependencies either
+                    release_intermediates(get_intermediate_dependencies(key))
+
+# the most recently used intermediates are also kept between analyses, so re-running a single measurement after a parameter change, or re-running measurements after a project change that doesn't affect the analysis signals (calibration, decimation of an unchanged response, etc.), doesn't recalculate them
+# retained intermediates are cleared whenever the analysis signals or sample rate change
+RETAINED_INTERMEDIATES_BYTES = 256e6 # max total size of the arrays kept between analyses
+
+def get_retained_intermediates():
+    source = (clp.signals['stimulus'], clp.signals['response'], clp.signals['noise'], clp.project['sample_rate'])
+    retained = clp.caches.setdefault('retained_intermediates', {'source': None, 'values': {}})
+    if retained['source'] is None or any(a is not b for a, b in zip(retained['source'][:3], source[:3])) or retained['source'][3] != source[3]:
+        retained['source'] = source
+        retained['values'].clear()
+    return retained['values']
+
+def retain_intermediate(key, value):
+    retained = get_retained_intermediates()
+    retained.pop(key, None)
+    if value.nbytes > RETAINED_INTERMEDIATES_BYTES: # too big to keep
+        return
+    retained[key] = value
+    while sum(value.nbytes for value in retained.values()) > RETAINED_INTERMEDIATES_BYTES:
+        retained.pop(next(iter(retained))) # drop least recently used intermediate
+
+def calculate_intermediate(key, calculate):
+    # get a retained intermediate, or calculate it and retain it for later analyses. Returned arrays are read-only
+    with cache_lock:
+        retained = get_retained_intermediates()
+        if key in retained:
+            value = retained[key]
+            retain_intermediate(key, value) # move to most recently used
+            return value
+    value = calculate()
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    with cache_lock:
+        retain_intermediate(key, value)
+    return value
+
+def analysis_intermediate(key, calculate):
+    # get an intermediate of the current analysis, calling calculate() to generate it the first time it is needed
+    # returned arrays are read-only, since they are shared between measurements
+    plan = clp.caches.get('intermediates')
+    with cache_lock:
+        if plan is None or plan['consumers'].get(key, 0) == 0:
+            return calculate_intermediate(key, calculate) # not part of the analysis plan
+        node_lock = plan['locks'].setdefault(key, RLock())
+    with node_lock: # other measurements needing the same intermediate wait for it to be calculated instead of calculating it again
+        if key not in plan['calculated']:
+            value = calculate_intermediate(key, calculate)
+            with cache_lock:
+                plan['calculated'].add(key)
+                if plan['consumers'].get(key, 0) > 0:
+                    plan['values'][key] = value
+            release_intermediates(get_intermediate_dependencies(key))
+            return value
+        with cache_lock:
+            if key in plan['values']:
+                return plan['values'][key]
+    return calculate_intermediate(key, calculate) # already released by all of its declared consumers
+
+def raw_frequency_response():
+    # complex frequency response of the analysis signals (see analysis_signals()) relative to the stimulus, one row per signal
+    return analysis_intermediate(('raw_fr',), lambda: fft(analysis_signals()) / stimulus_spectrum())
+
+def raw_impulse_response():
+    # complex impulse response of the analysis signals, one row per signal
+    return analysis_intermediate(('raw_ir',), lambda: ifft(raw_frequency_response()))
+
+def decimation_factor(quality='full', measurements=None):
+    # find the largest integer decimation factor that keeps the highest analyzed frequency below 80% of the decimated Nyquist frequency
+    # the highest analyzed frequency is the highest chirp or output frequency of any measurement, times the highest harmonic it analyzes (see CLMeasurement.calc_max_analysis_freq())
+    # 80% keeps everything within the flat passband of the default scipy decimate() FIR filter
+    # returns 1 (no decimation) if automatic decimation is disabled for the project or any measurement needs the full analysis bandwidth
+    # preview quality analyses are always decimated as far as the measurements being previewed allow (measurements defaults to all project measurements)
+    if quality == 'full' and not clp.project.get('auto_decimate', False):
+        return 1
+    if measurements is None:
+        measurements = clp.measurements
+    max_freq = max([clp.project['start_freq'], clp.project['stop_freq']] + [measurement.calc_max_analysis_freq() for measurement in measurements])
+    return max(1, int((clp.project['sample_rate']/2) * 0.8 / max_freq))
+
+@contextmanager
+def read_only_signals():
+    # temporarily mark the analysis signals as read-only, so a measurement can't modify a signal that other measurements are reading at the same time
+    # usage:
+    #   with read_only_signals():
+    #       measurement.measure()
+    # arrays that are already read-only (e.g. the views from read_only_views()) are left alone
+    signals = list({id(signal): signal for signal in clp.signals.values() if isinstance(signal, np.ndarray) and signal.flags.writeable}.values()) # the same array can be stored under more than one name
+    for signal in signals:
+        signal.flags.writeable = False
+    try:
+        yield
+    finally:
+        for signal in signals:
+            signal.flags.writeable = True
+
+def read_only_views(signals, views):
+    # read-only views of the arrays in a signals dict, for an analysis context that shares its signal arrays with other contexts running at the same time (see CLMeasurements.channel_context())
+    # read_only_signals() has nothing to flip in a context with read-only views, so concurrent contexts never change the writeable flags of the shared arrays
+    # views is a dict kept in the context's caches, so the same array gets the same view in each analysis and caches keyed on signal identity stay valid
+    read_only = {}
+    for name, signal in signals.items():
+        if isinstance(signal, np.ndarray) and signal.flags.writeable:
+            if name not in views or views[name][0] is not signal:
+                view = signal.view()
+                view.flags.writeable = False
+                views[name] = (signal, view)
+            signal = views[name][1]
+        read_only[name] = signal
+    return read_only
+
+NO_NOISE = np.zeros(0) # noise sample swapped in for preview analyses. Always the same array, so caches keyed on the noise signal stay valid
+
+@contextmanager
+def decimated_analysis(quality='full', measurements=None):
+    # temporarily swap in decimated stimulus, response, and noise signals and the reduced sample rate while running measurements
+    # full-rate signals and sample rate are restored when measurements are finished, so plotting and anything reading the project parameters is unaffected
+    # preview quality analyses also skip the noise sample (see decimation_factor() for quality and measurements)
+    # usage:
+    #   with decimated_analysis():
+    #       measurement.measure()
+    factor = decimation_factor(quality, measurements)
+    if factor == 1 and quality == 'full':
+        yield factor
+        return
+    from scipy.signal import decimate # scipy.signal takes most of a second to import, only load it when signals are actually decimated
+
+    full_sample_rate = clp.project['sample_rate']
+    full_signals = {'stimulus': clp.signals['stimulus'], 'response': clp.signals['response'], 'noise': clp.signals['noise']}
+    try:
+        if quality == 'preview':
+            clp.signals['noise'] = NO_NOISE
+        if factor > 1:
+            # decimate stimulus, response, and noise using the same zero-phase anti-aliasing filter, so the filter response cancels out when the response is deconvolved
+            # decimated stimulus only depends on the project, so it is reused across input files
+            decimated_stimulus = stimulus_artifact('decimated_stimulus_x' + str(factor), lambda: decimate(clp.signals['stimulus'], factor, ftype='fir', zero_phase=True))
+            # decimated response and noise are reused until the response is re-read, so re-running measurements keeps the same decimated signals (and their retained intermediates)
+            decimated_cache = clp.caches.get('decimated_signals')
+            if decimated_cache is None or decimated_cache['source'][0] is not clp.signals['response'] or decimated_cache['source'][1] is not clp.signals['noise'] or decimated_cache['source'][2] != factor:
+                if any(clp.signals['noise']):
+                    decimated = decimate(np.vstack([clp.signals['response'], clp.signals['noise']]), factor, ftype='fir', zero_phase=True)
+                else:
+                    decimated = decimate(np.atleast_2d(clp.signals['response']), factor, ftype='fir', zero_phase=True)
+                decimated_cache = {'source': (clp.signals['response'], clp.signals['noise'], factor), 'signals': list(decimated)} # rows stored as separate arrays, so the same array objects are swapped in every time
+                clp.caches['decimated_signals'] = decimated_cache
+            decimated = decimated_cache['signals']
+            if any(clp.signals['noise']):
+                clp.signals['noise'] = decimated[1]
+            clp.signals['stimulus'] = decimated_stimulus
+            clp.signals['response'] = decimated[0]
+            clp.project['sample_rate'] = full_sample_rate / factor
+
+        yield factor
+    finally:
+        clp.project['sample_rate'] = full_sample_rate
+        clp.signals.update(full_signals)
+
+# parts of the analysis that have to be redone when a project parameter changes, so the GUI only redoes what a change affects
+# 'stimulus': regenerate the stimulus, re-read the response, and re-run measurements
+# 'response': re-read (resample, align, trim) the response from the raw input and re-run measurements
+# 'measurements': re-run measurements on the current stimulus and response. Intermediates that only depend on the signals are reused (see analysis_intermediate())
+# measurement parameters only affect their own measurement (see CLMeasurement.remeasure())
+ANALYSIS_STAGES = ['stimulus', 'response', 'measurements']
+PROJECT_KEY_STAGES = {
+    'start_freq': 'stimulus',
+    'stop_freq': 'stimulus',
+    'chirp_length': 'stimulus',
+    'pre_sweep': 'stimulus',
+    'post_sweep': 'stimulus',
+    'sample_rate': 'stimulus',
+    'use_input_rate': 'stimulus',
+    'input': 'response', # input file, channel, etc.
+    'auto_decimate': 'measurements',
+    'FS_per_Pa': 'measurements',
+    'FS_per_V': 'measurements',
+}
+
+def analysis_stage(key):
+    # first stage of the analysis affected by a change to clp.project[key]. Unknown keys redo the whole analysis
+    return PROJECT_KEY_STAGES.get(key, 'stimulus')
+
 def read_audio_file(audio_file, sample_rate=0):
     # convert the input file to a friendly 32-bit floating point format temporary wav file, then reads the file into a numpy array with scipy
     # if a sample rate is given, also resample the input file to the specified rate
@@ -254,7 +636,9 @@ def find_file(filename):
 def find_offset(input_sig, find_sig):
     # for two 1D input arrays where a signal similar to find_sig is expected to be somewhere in input_sig, find the position of find_sig in input_sig and return the index of the start of find_sig
     # implemented using cross correlation through fft convolution
-    correlation = fftconvolve(input_sig, find_sig[::-1]) # reverse 1 signal for *cross* correlation
+    correlation_length = len(input_sig) + len(find_sig) - 1
+    fft_length = next_fast_len(correlation_length, True)
+    correlation = irfft(rfft(input_sig, fft_length) * rfft(find_sig[::-1], fft_length), fft_length)[:correlation_length] # reverse 1 signal for *cross* correlation
     return np.argmax(np.abs(correlation)) - len(find_sig) # cross correlation peaks at point where signals align, offset by reversed signal
 
 def save_xlsx(measurements, out_path):
@@ -275,12 +659,83 @@ def freq_points(start_freq, stop_freq, num_points, spacing='log', round_to_whole
         out_points = np.unique(np.round(out_points))
     return out_points
 
+INTERPOLATION_CACHE_SIZE = 16 # max number of interpolation operators kept by interpolation_operator()
+
+def grid_key(x):
+    # hash of every point of a grid, so grids that only differ in a few points never share an operator. Hashing is much cheaper than building the operator
+    x = np.ascontiguousarray(x, dtype=float)
+    return (len(x), hashlib.sha1(x.tobytes()).hexdigest())
+
+def interpolation_operator(x_input, x_output, linear=True):
+    # build a sparse (len(x_output) x len(x_input)) matrix that linearly interpolates from x_input to x_output (same result as np.interp, including holding end values outside of x_input)
+    # operators are cached by input grid, output grid, and spacing, so repeated measurements on the same FFT bin and output frequency grids skip the searchsorted/log calculations
+    # the most recently used operators are kept in the caches of the current analysis context (see CLProject.AnalysisContext)
+    key = (grid_key(x_input), grid_key(x_output), linear)
+    with cache_lock:
+        interpolation_cache = clp.caches.setdefault('interpolation', {})
+        operator = interpolation_cache.pop(key, None)
+        if operator is not None:
+            interpolation_cache[key] = operator # move to most recently used
+            return operator
+
+    if not linear:
+        x_input = np.log(x_input)
+        x_output = np.log(x_output)
+
+    # find the input points on either side of each output point and the weight given to the upper point
+    lower = np.clip(np.searchsorted(x_input, x_output, 'right') - 1, 0, len(x_input) - 2)
+    weight = np.clip((x_output - x_input[lower]) / (x_input[lower+1] - x_input[lower]), 0, 1)
+
+    rows = np.arange(len(x_output))
+    operator = csr_matrix((np.concatenate([1 - weight, weight]), (np.concatenate([rows, rows]), np.concatenate([lower, lower+1]))), shape=(len(x_output), len(x_input)))
+    operator.eliminate_zeros() # drop zero weights so inf/nan values adjacent to an exactly matching point don't leak into the output
+
+    with cache_lock:
+        interpolation_cache = clp.caches.setdefault('interpolation', {})
+        interpolation_cache.pop(key, None)
+        interpolation_cache[key] = operator
+        while len(interpolation_cache) > INTERPOLATION_CACHE_SIZE:
+            interpolation_cache.pop(next(iter(interpolation_cache))) # drop least recently used operator
+    return operator
+
 def interpolate(x_input, y_input, x_output, linear=True):
-    if linear:
+    # y_input can be a single curve or a 2D array with one curve per row (e.g. stacked response and noise from analysis_signals())
+    # uses a cached sparse interpolation operator, so repeated calls with the same grids are only a sparse matrix-vector product per row
+    if np.ndim(x_output) == 0 or len(x_input) < 2: # single output point or input point, not worth building an operator
+        if not linear:
+            x_input = np.log(x_input)
+            x_output = np.log(x_output)
+        if np.ndim(y_input) > 1:
+            return np.array([np.interp(x_output, x_input, y) for y in y_input])
         return np.interp(x_output, x_input, y_input)
-    else:
-        return np.interp(np.log(x_output), np.log(x_input), y_input)
+    operator = interpolation_operator(x_input, x_output, linear)
+    if np.ndim(y_input) > 1:
+        return np.array([operator @ y for y in y_input]) # one product per row, sparse products with a transposed 2D array force a full copy of the input
+    return operator @ y_input
     
+def hann(length):
+    # symmetric Hann window, same as scipy.signal.windows.hann(). Defined here so the measurements don't need to import scipy.signal, which takes most of a second
+    if length < 2:
+        return np.ones(max(length, 0))
+    return 0.5 - 0.5*np.cos(2*np.pi*np.arange(length)/(length-1))
+
+DIRECT_DFT_MAX_SIZE = 2**22 # max number of elements in a DFT matrix used by spectrum_at_freqs() (64MB of complex values)
+
+def direct_dft_is_faster(segment_length, num_freqs, fft_length):
+    # evaluating a short windowed segment directly at the output frequencies is cheaper than a full-length FFT plus interpolation when the segment is short relative to the full signal
+    return segment_length * num_freqs <= min(DIRECT_DFT_MAX_SIZE, fft_length * np.log2(fft_length))
+
+def spectrum_at_freqs(segment, freqs, sample_rate):
+    # evaluate the spectrum of a windowed signal segment (or 2D array of segments, one per row) directly at the given frequency points, instead of calculating every FFT bin and interpolating
+    # uses a chirp-z transform (zoom FFT) for linearly spaced frequencies and a DFT matrix for log-spaced or otherwise sparse frequencies
+    # output is complex, with phase referenced to the first sample of the segment, and scaled to match an unnormalized FFT of the zero-padded segment
+    freqs = np.atleast_1d(freqs)
+    if len(freqs) > 2 and np.allclose(np.diff(freqs), freqs[1] - freqs[0]):
+        from scipy.signal import zoom_fft # scipy.signal is slow to import, only load it for linearly spaced frequencies
+        return zoom_fft(segment, [freqs[0], freqs[-1]], m=len(freqs), fs=sample_rate, endpoint=True)
+    dft_matrix = np.exp(-2j * np.pi * np.outer(np.arange(segment.shape[-1]), freqs) / sample_rate)
+    return segment @ dft_matrix
+
 def FS_to_unit(input_FS, output_unit): # todo: extend to also calculate dB, %, etc?
     match output_unit:
         case 'FS':
@@ -358,6 +813,7 @@ def check_sox():
             if not Path(clp.sox_path).exists():
                 # no local copy has been downloaded, prompt the user to download
                 if clp.gui_mode:
+                    from qtpy.QtWidgets import QMessageBox # Qt is only imported in GUI mode
                     message_box = QMessageBox()
                     message_box.setWindowTitle('Download SoX?')
                     message_box.setText('Chirplab requires SoX for audio processing. Would you like to download SoX?')
@@ -371,6 +827,7 @@ def check_sox():
 
                 if download:
                     try:
+                        import requests # only needed to download SoX, not imported otherwise
                         print('Downloading SoX from ' + clp.sox_dl_url + '...')
                         with tempfile.TemporaryFile() as sox_temp:
                             content = requests.get(clp.sox_dl_url, stream=True).content
@@ -0,0 +1,192 @@
+import CLProject as clp
+from CLMeasurements import run_measurements, channel_context, run_channel_measurements
+from qtpy.QtCore import Signal, Slot, QObject, QTimer
+from threading import Thread, Event
+from copy import deepcopy
+from contextlib import contextmanager
+
+# runs measurements for the GUI on a background thread, so the window stays responsive during long analyses
+# every submit() starts a new job generation. A newer generation supersedes any job that is still running: the running job is cancelled (measurements that haven't started yet are skipped),
+# its results are dropped, and a new job is started with everything that is still pending. Only the results of the newest job are applied to the measurements and plotted
+# jobs don't start until control returns to the Qt event loop, so all of the submits from one parameter change (update_tab() cascades, undo/redo replays, etc.) are coalesced into a single job
+# for long signals, measurements on built tabs are first run at preview quality (see run_measurements()) and plotted while the full quality analysis runs
+# when the all-channels overlay is enabled (clp.project['plot_all_channels']), the other input channels are analyzed in one batch after the selected channel and stored in measurement.channel_outputs
+# measurements are marked stale when they are submitted. Once the submitted measurements are done, any measurements that are still stale (e.g. on hidden tabs) are refreshed in a background job
+class AnalysisWorker(QObject):
+    # job results have to go through a signal to get from the worker thread back to the Qt thread
+    job_finished = Signal(object)
+    job_preview = Signal(object)
+    busy_changed = Signal(bool) # True while measurements are pending, used for the progress indicator in the main window
+
+    def __init__(self):
+        super().__init__()
+        self.generation = 0 # incremented for each submit()
+        self.pending = [] # GUI measurement objects waiting for new results
+        self.job = None # job currently running on the worker thread
+        self.caches = {} # analysis caches for worker jobs, kept between jobs so unchanged intermediates are reused (see CLAnalysis.analysis_intermediate())
+        self.channel_source = None # raw input signal of the most recent overlay results
+        self.channel_caches = {} # input channel caches and signal views of the other channels for the all-channels overlay, so each channel is only extracted/resampled once per input signal
+        self.busy = False
+        self.debounce_depth = 0 # >0 while inside debounced()
+        self.job_finished.connect(self.finish_job)
+        self.job_preview.connect(self.show_preview)
+
+        # single shot timer used to start a job once the current event loop turn (or debounce delay) is over
+        self.start_timer = QTimer()
+        self.start_timer.setSingleShot(True)
+        self.start_timer.timeout.connect(self.start_pending)
+
+    def submit(self, measurements=None):
+        # request new results for the given measurements (all project measurements if None), using the current project and signals
+        if measurements is None:
+            measurements = clp.measurements
+        for measurement in measurements:
+            measurement.stale = True
+            if measurement not in self.pending:
+                self.pending.append(measurement)
+        self.generation += 1
+
+        if not self.busy:
+            self.busy = True
+            self.busy_changed.emit(True)
+        if self.job is not None:
+            self.job['cancel'].set() # results of the running job will be dropped, skip any measurements it hasn't started yet
+
+        if self.debounce_depth:
+            self.start_timer.start(clp.ANALYSIS_DEBOUNCE_MS) # restarts the delay if already waiting
+        elif not self.start_timer.isActive():
+            self.start_timer.start(0)
+
+    def refresh(self, measurement):
+        # get new results for a stale measurement, e.g. when its tab is shown. Does nothing if the measurement is up to date or new results are already on the way
+        if measurement.stale and measurement not in self.pending:
+            self.submit([measurement])
+
+    @contextmanager
+    def debounced(self):
+        # submits inside this block wait for clp.ANALYSIS_DEBOUNCE_MS without any further submits before starting a job
+        self.debounce_depth += 1
+        try:
+            yield
+        finally:
+            self.debounce_depth -= 1
+
+    def start_pending(self):
+        if self.job is None:
+            self.start_job()
+        # otherwise finish_job() starts a new job once the cancelled job stops
+
+    def start_job(self):
+        # snapshot the project, signals, and measurement parameters into a separate analysis context, so the GUI can keep changing them while the job runs
+        # signal arrays are not modified in place by chirplab, so they are shared instead of copied
+        context = clp.AnalysisContext(deepcopy(clp.project), clp.project_file)
+        context.signals = dict(clp.signals)
+        context.IO = deepcopy(clp.IO)
+        context.caches = self.caches
+        measurements = clp.measurements # clp.measurements refers to the context's measurement list inside analysis_context()
+        with clp.analysis_context(context):
+            # all project measurements are copied so the decimation factor is the same as a full analysis, but only the pending measurements are run
+            copies = {measurement: type(measurement)(measurement.params['name'], deepcopy(measurement.params)) for measurement in measurements}
+        context.measurements = list(copies.values())
+
+        targets = [(measurement, copies[measurement]) for measurement in self.pending if measurement in copies] # pairs of GUI measurement and worker copy
+        if clp.project.get('plot_all_channels') and clp.IO['input']['length_samples']:
+            channels = [channel for channel in range(1, clp.IO['input']['channels']+1) if channel != clp.project['input']['channel']]
+        else:
+            channels = []
+        self.job = {'generation': self.generation,
+                    'context': context,
+                    'targets': targets,
+                    'preview_targets': [(measurement, worker_copy) for measurement, worker_copy in targets if measurement.tab is not None] if len(clp.signals['stimulus']) > clp.PREVIEW_MIN_SAMPLES else [], # hidden tabs don't need a preview
+                    'preview_outputs': [],
+                    'channels': channels, # other input channels to analyze for the overlay
+                    'overlay_targets': [(measurement, worker_copy) for measurement, worker_copy in targets if measurement.channel_overlay] if channels else [],
+                    'channel_outputs': [], # {channel: outputs} for each overlay target
+                    'cancel': Event(),
+                    'error': None}
+        Thread(target=clp.run_in_context, args=(context, self.run_job, self.job), daemon=True).start() # the job context is passed explicitly, threads don't inherit the current context
+
+    def run_job(self, job):
+        # runs on the worker thread
+        try:
+            if job['preview_targets']:
+                run_measurements(job['context'], measurements=[worker_copy for measurement, worker_copy in job['preview_targets']], cancel=job['cancel'], quality='preview')
+                job['preview_outputs'] = [measurement_outputs(worker_copy) for measurement, worker_copy in job['preview_targets']] # the full analysis replaces the worker copy outputs
+                self.job_preview.emit(job)
+            run_measurements(job['context'], measurements=[worker_copy for measurement, worker_copy in job['targets']], cancel=job['cancel'])
+            if job['overlay_targets']:
+                self.run_channels(job)
+        except Exception as e:
+            job['error'] = e
+        self.job_finished.emit(job)
+
+    def run_channels(self, job):
+        # runs on the worker thread. Analyze the other input channels with the same parameters as the job, all channels in one batch
+        with clp.analysis_context(job['context']):
+            contexts = {}
+            for channel in job['channels']:
+                contexts[channel] = channel_context(channel, dict(self.channel_caches.get(channel, {})))
+                self.channel_caches[channel] = {name: contexts[channel].caches[name] for name in ['channels', 'signal_views']}
+        indexes = [job['context'].measurements.index(worker_copy) for measurement, worker_copy in job['overlay_targets']] # channel contexts have their own measurement copies, in the same order
+        run_channel_measurements(contexts, measurements=indexes, cancel=job['cancel'])
+        job['channel_outputs'] = [{channel: measurement_outputs(context.measurements[index]) for channel, context in contexts.items()} for index in indexes]
+
+    @Slot(object)
+    def show_preview(self, job):
+        # runs on the Qt thread. Measurements stay stale until the full quality results are ready
+        if job['generation'] != self.generation:
+            return
+        for (measurement, worker_copy), outputs in zip(job['preview_targets'], job['preview_outputs']):
+            if measurement in clp.measurements:
+                apply_outputs(measurement, outputs)
+
+    @Slot(object)
+    def finish_job(self, job):
+        # runs on the Qt thread
+        self.job = None
+        if job['generation'] != self.generation:
+            # superseded by a newer submit(), drop results and start over with everything still pending
+            if not self.start_timer.isActive(): # if the timer is still running it will start the new job
+                self.start_job()
+            return
+
+        self.pending = []
+        if job['error'] is not None:
+            self.busy = False
+            self.busy_changed.emit(False)
+            raise job['error']
+
+        if job['overlay_targets']:
+            self.channel_source = job['context'].signals['raw_response']
+        channel_outputs = dict(zip([measurement for measurement, worker_copy in job['overlay_targets']], job['channel_outputs']))
+        for measurement, worker_copy in job['targets']:
+            if measurement not in clp.measurements: # removed while the job was running
+                continue
+            measurement.stale = False
+            outputs = measurement_outputs(worker_copy)
+            measurement.channel_outputs = channel_outputs.get(measurement, {})
+            if measurement.channel_outputs:
+                measurement.channel_outputs[job['context'].project['input']['channel']] = outputs # kept so the selected channel can be switched without re-measuring (see ChirpTab.show_channel())
+            apply_outputs(measurement, outputs)
+
+        # refresh the rest of the stale measurements in the background
+        stale = [measurement for measurement in clp.measurements if measurement.stale]
+        if stale:
+            self.submit(stale)
+        else:
+            self.busy = False
+            self.busy_changed.emit(False)
+
+def measurement_outputs(measurement):
+    # output data of a measurement (out_freqs, out_points, out_noise, out_ir, etc.)
+    return {name: value for name, value in vars(measurement).items() if name.startswith('out_')}
+
+def apply_outputs(measurement, outputs):
+    # copy output data over to a GUI measurement and plot it if its tab has been built
+    for name, value in outputs.items():
+        setattr(measurement, name, value)
+    if measurement.tab is not None:
+        measurement.plot()
+        measurement.format_graph()
+
+analysis_worker = AnalysisWorker()
@@ -1,7 +1,7 @@
 import CLProject as clp
 from qtpy.QtWidgets import QWidget, QHBoxLayout, QVBoxLayout, QLabel, QLineEdit, QComboBox, QDoubleSpinBox, QAbstractSpinBox, QPushButton, QFileDialog, QCheckBox
 import numpy as np
-from CLGui import undo_stack
+from CLGui import undo_stack, analysis_worker
 
 # collection of combination classes for displaying and entering configuration parameters
 # typically a label on the left, text box or similar element in the middle, and sometimes a unit label or dropdown on the right
@@ -114,7 +114,8 @@ class CLParamNum(QWidget):
             self.spin_box.setValue(self.value)
             self.spin_box.blockSignals(False)
             if self.update_callback is not None:
-                self.update_callback(self.value)
+                with analysis_worker.debounced(): # wait for the user to stop scrolling/clicking arrows before rerunning measurements
+                    self.update_callback(self.value)
             undo_stack.push(self.undo_redo, self.last_value, self.undo_redo, self.value)
             self.last_value = self.value
         self.spin_box.valueChanged.connect(valueChanged)
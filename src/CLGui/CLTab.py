@@ -1,7 +1,7 @@
 from qtpy.QtWidgets import QSplitter, QVBoxLayout, QScrollArea, QFrame, QWidget, QApplication
 from qtpy import QtCore
 import pyqtgraph as pg
-from CLGui import EngAxisItem
+from CLGui import EngAxisItem, EnvelopeCurve, thin_pen
 
 # main recurring gui structure of chirplab. A configuration panel on the left, with a graph area on the right
 class CLTab(QSplitter): # base widget is a splitter
@@ -26,6 +26,7 @@ class CLTab(QSplitter): # base widget is a splitter
         self.graph = pg.PlotWidget(axisItems={'bottom':EngAxisItem('bottom')})
         self.graph.showGrid(True, True, 0.25)
         self.graph.legend = self.graph.addLegend(brush=pg.mkBrush(255,255,255,192))
+        self.curves = {} # persistent plot items, see set_curve()
         graph_layout = QVBoxLayout()
         graph_layout.addWidget(self.graph)
         graph_area = QWidget()
@@ -39,6 +40,32 @@ class CLTab(QSplitter): # base widget is a splitter
         panel_width = 235 # todo: reasonable initial value on my machine. Panel size/scaling will need a lot of work #DPI
         self.setSizes([panel_width, self.window().width()-panel_width])
 
+    def set_curve(self, key, x, y, name=None, pen=None, envelope=False):
+        # plot a curve on the graph, or update the data of the curve already plotted with the same key
+        # curves are kept between plot updates instead of clearing the graph and creating new plot items, so the legend is only rebuilt when the set of curves changes
+        # envelope=True plots long time-domain signals as an EnvelopeCurve
+        curve = self.curves.get(key)
+        if curve is None or curve.name() != name or isinstance(curve, EnvelopeCurve) != envelope:
+            self.remove_curve(key)
+            if envelope:
+                curve = EnvelopeCurve(x, y, name=name, pen=pen)
+            else:
+                curve = pg.PlotDataItem(x, y, name=name, pen=thin_pen(pen, len(x)))
+            self.graph.addItem(curve)
+            self.curves[key] = curve
+        elif envelope:
+            curve.full_pen = pen
+            curve.set_envelope_data(x, y)
+        else:
+            curve.setData(x, y)
+            curve.setPen(thin_pen(pen, len(x)))
+
+    def remove_curve(self, key):
+        # remove a curve added with set_curve(), if it is on the graph
+        curve = self.curves.pop(key, None)
+        if curve is not None:
+            self.graph.removeItem(curve)
+
 
 class ScrollHandler(QtCore.QObject):
     def __init__(self, scroll_panel):
@@ -72,10 +72,8 @@ class CalibrationDialog(QDialog):
                 if not len(self.samples):
                     return
                 
-                tab.graph.clear()
-
                 times = np.arange(len(self.samples)) / self.file_info['sample_rate']
-                tab.graph.plot(times, self.samples, pen=noise_pen)
+                tab.set_curve('samples', times, self.samples, pen=noise_pen)
 
                 start_sample = round(skip.value * self.file_info['sample_rate'])
                 end_sample = min(start_sample + round(length.value * self.file_info['sample_rate']), len(self.samples)-1)
@@ -93,7 +91,7 @@ class CalibrationDialog(QDialog):
                     filt = Biquad(b, a)
                     measure_samples = filt.process(measure_samples)
 
-                tab.graph.plot(times[start_sample:end_sample], measure_samples[start_sample:end_sample], pen=measure_pen)
+                tab.set_curve('measure', times[start_sample:end_sample], measure_samples[start_sample:end_sample], pen=measure_pen)
 
                 # measure signal
                 rms = np.sqrt(np.mean(measure_samples[start_sample:end_sample]**2))
@@ -128,8 +126,7 @@ class CalibrationDialog(QDialog):
 
                 times = np.arange(len(self.samples)) / clp.project['input']['sample_rate']
 
-                tab.graph.clear()
-                tab.graph.plot(times, self.samples, pen=noise_pen)
+                tab.set_curve('samples', times, self.samples, pen=noise_pen) # updated in place, runs for every input frame
 
                 start_sample = round(length.value * 0.1 * clp.project['input']['sample_rate'])
                 end_sample = min(round(length.value * 1.1 * clp.project['input']['sample_rate']), len(self.samples)-1)
@@ -149,7 +146,7 @@ class CalibrationDialog(QDialog):
                     self.filt.b = [1,0,0]
                     self.filt.a = [1,0,0]
 
-                tab.graph.plot(times[start_sample:end_sample], self.measure_samples[start_sample:end_sample], pen=measure_pen)
+                tab.set_curve('measure', times[start_sample:end_sample], self.measure_samples[start_sample:end_sample], pen=measure_pen)
 
                 # measure signal
                 rms = np.sqrt(np.mean(self.measure_samples[start_sample:end_sample]**2))
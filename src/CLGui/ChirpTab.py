@@ -1,6 +1,6 @@
 import CLProject as clp
-from CLGui import CLTab, CLParameter, CLParamNum, CLParamDropdown, CLParamFile, CLParamCheckBox, QCollapsible, QHSeparator, CalibrationDialog, undo_stack
-from CLAnalysis import generate_stimulus, read_audio_file, read_response, generate_output_stimulus, generate_stimulus_file, audio_file_info, write_audio_file
+from CLGui import CLTab, CLParameter, CLParamNum, CLParamDropdown, CLParamFile, CLParamCheckBox, QCollapsible, QHSeparator, CalibrationDialog, undo_stack, analysis_worker, apply_outputs
+from CLAnalysis import generate_stimulus, read_audio_file, read_response, generate_output_stimulus, generate_stimulus_file, audio_file_info, write_audio_file, analysis_stage
 import numpy as np
 from qtpy.QtWidgets import QPushButton, QAbstractSpinBox, QFileDialog, QComboBox, QFrame, QVBoxLayout
 from qtpy.QtCore import Signal, Slot, QObject
@@ -59,6 +59,16 @@ class ChirpTab(CLTab):
         self.analyze()
         
         
+    def update_project(self, key):
+        # redo only the parts of the analysis affected by a change to clp.project[key] (see CLAnalysis.PROJECT_KEY_STAGES)
+        match analysis_stage(key):
+            case 'stimulus':
+                self.update_stimulus()
+            case 'response':
+                self.analyze()
+            case 'measurements':
+                self.update_measurements()
+        
     def analyze(self):
         # first, verify input file is valid
         #self.update_input_file()
@@ -73,17 +83,44 @@ class ChirpTab(CLTab):
         # update chirp tab graph
         self.plot()
 
-        # update measurements
+        self.update_measurements()
+
+    def update_measurements(self):
+        # re-run all measurements on the current stimulus and response (at a reduced sample rate if automatic decimation is enabled)
+        # measurements run on the background analysis worker, which updates their graphs when the results are ready
+        # the measurement on the visible tab runs first, the others are marked stale and refreshed afterwards
+        for measurement in clp.measurements:
+            measurement.stale = True
+            if measurement.tab is not None:
+                measurement.update_tab()
+        analysis_worker.submit([measurement for measurement in clp.measurements if measurement.tab is not None and measurement.tab.isVisible()])
+
+    def show_channel(self):
+        # switch the measurements to the selected input channel without re-measuring, if every channel was already analyzed for the all-channels overlay (see clp.project['plot_all_channels'])
+        # the overlay curves are just re-plotted with the new channel highlighted. Measurements that don't overlay channels (e.g. Waterfall) are re-run
+        # returns False if the overlay results aren't available, in which case nothing is changed and the measurements need to be re-run
+        channel = clp.project['input']['channel']
+        if not clp.project.get('plot_all_channels') or not clp.IO['input']['length_samples'] or analysis_worker.channel_source is not clp.signals['raw_response']:
+            return False
+        if any(measurement.channel_overlay and (measurement.stale or channel not in measurement.channel_outputs) for measurement in clp.measurements):
+            return False
+
+        read_response()
+        self.plot()
+        rerun = []
         for measurement in clp.measurements:
-            measurement.update_tab()
-            measurement.measure()
-            measurement.plot()
-            measurement.format_graph()
+            if measurement.channel_overlay:
+                apply_outputs(measurement, measurement.channel_outputs[channel])
+            else:
+                measurement.stale = True
+                if measurement.tab is not None and measurement.tab.isVisible():
+                    rerun.append(measurement)
+        if rerun:
+            analysis_worker.submit(rerun)
+        return True
     
     # plot stimulus, response, and noise
     def plot(self):
-        self.graph.clear()
-        
         if self.chirp_params.chirp_length.units.currentIndex() == 0: #times in seconds
             times = np.arange(len(clp.signals['stimulus']))/clp.project['sample_rate'] - clp.project['pre_sweep']
             self.graph.setLabel('bottom', 'Time (seconds)')
@@ -91,15 +128,18 @@ class ChirpTab(CLTab):
             times = np.arange(len(clp.signals['stimulus'])) - round(clp.project['pre_sweep']*clp.project['sample_rate'])
             self.graph.setLabel('bottom', 'Time (samples)')
         
+        # signals can be millions of samples long, plot them as envelopes with about one min/max pair per pixel (see CLGui.EnvelopeCurve)
         signal_pen = pg.mkPen(color=clp.PLOT_COLORS[0])#, width = clp.PLOT_PEN_WIDTH)
-        self.graph.plot(times, clp.signals['stimulus'], name='stimulus', pen=signal_pen)
+        self.set_curve('stimulus', times, clp.signals['stimulus'], 'stimulus', signal_pen, envelope=True)
         
         response_pen = pg.mkPen(color=clp.PLOT_COLORS[1])#, width = clp.PLOT_PEN_WIDTH)
-        self.graph.plot(times, clp.signals['response'], name='response', pen=response_pen)
+        self.set_curve('response', times, clp.signals['response'], 'response', response_pen, envelope=True)
         
         if any(clp.signals['noise']):
             noise_pen = pg.mkPen(color=clp.NOISE_COLOR)#, width = clp.PLOT_PEN_WIDTH)
-            self.graph.plot(times, clp.signals['noise'], name='noise sample', pen=noise_pen)
+            self.set_curve('noise', times, clp.signals['noise'], 'noise sample', noise_pen, envelope=True)
+        else:
+            self.remove_curve('noise')
 
 
 class ChirpParameters(QCollapsible):
@@ -248,6 +288,15 @@ class ChirpParameters(QCollapsible):
                 self.post_sweep.set_numtype('int')
         self.post_sweep.units_update_callback = update_post_sweep_units
 
+        # automatic decimation checkbox
+        self.auto_decimate = CLParamCheckBox('Decimate analysis to chirp bandwidth')
+        self.auto_decimate.setChecked(clp.project.get('auto_decimate', False))
+        self.analysis_params.addWidget(self.auto_decimate)
+        def update_auto_decimate(checked):
+            clp.project['auto_decimate'] = bool(checked)
+            chirp_tab.update_project('auto_decimate')
+        self.auto_decimate.update_callback = update_auto_decimate
+
 
 class OutputParameters(QCollapsible):
     def __init__(self, chirp_tab):
@@ -552,7 +601,7 @@ class DeviceOutput(QFrame): # much of this code is duplicated from FileOutput, b
         self.refresh.clicked.connect(refresh_devices)
 
         # Host API dropdown
-        self.api = CLParamDropdown('Host API', DeviceIO.HOST_APIS)
+        self.api = CLParamDropdown('Host API', DeviceIO.get_host_apis())
         if 'api' in clp.project['output']:
             api_index = self.api.dropdown.findText(clp.project['output']['api'])
         else:
@@ -876,7 +925,7 @@ class InputParameters(QCollapsible):
         self.cal_params.addWidget(self.FS_per_Pa)
         def update_FS_per_Pa(new_val):
             clp.project['FS_per_Pa'] = new_val
-            chirp_tab.analyze()
+            chirp_tab.update_project('FS_per_Pa')
         self.FS_per_Pa.update_callback = update_FS_per_Pa
         
         self.FS_per_V = CLParamNum('Electrical', clp.project['FS_per_V'], 'FS/V', numtype='float') # todo: set reasonable minimum
@@ -884,7 +933,7 @@ class InputParameters(QCollapsible):
         self.cal_params.addWidget(self.FS_per_V)
         def update_FS_per_V(new_val):
             clp.project['FS_per_V'] = new_val
-            chirp_tab.analyze()
+            chirp_tab.update_project('FS_per_V')
         self.FS_per_V.update_callback = update_FS_per_V
 
         self.cal_button = QPushButton('Calibrate...')
@@ -896,7 +945,7 @@ class InputParameters(QCollapsible):
             undo_stack.paused = True
             if cal_dialog.exec():
                 if (self.FS_per_Pa.value != last_FS_per_Pa) or (self.FS_per_V.value != last_FS_per_V):
-                    chirp_tab.analyze()
+                    chirp_tab.update_project('FS_per_Pa')
                     undo_stack.paused = False
                     undo_stack.push(undo_cal_dialog, [last_FS_per_Pa, last_FS_per_V], undo_cal_dialog, [self.FS_per_Pa.value, self.FS_per_V.value])
             undo_stack.paused = False
@@ -905,7 +954,7 @@ class InputParameters(QCollapsible):
         def undo_cal_dialog(cal_values):
             self.FS_per_Pa.set_value(cal_values[0])
             self.FS_per_V.set_value(cal_values[1])
-            chirp_tab.analyze()
+            chirp_tab.update_project('FS_per_Pa')
 
 
         self.expand()
@@ -1014,6 +1063,7 @@ class FileInput(QFrame):
         layout.addWidget(self.channel)
         def update_channel(index):
             clp.project['input']['channel'] = index + 1
+            chirp_tab.show_channel() # switches right away if all channels are overlaid, otherwise the new channel is used the next time the file is analyzed
         self.channel.update_callback = update_channel
         
         # prepopulate input file info
@@ -1050,7 +1100,7 @@ class DeviceInput(QFrame):
         self.refresh.clicked.connect(refresh_devices)
 
         # Host API dropdown
-        self.api = CLParamDropdown('Host API', DeviceIO.HOST_APIS)
+        self.api = CLParamDropdown('Host API', DeviceIO.get_host_apis())
         if 'api' in clp.project['input']:
             api_index = self.api.dropdown.findText(clp.project['input']['api'])
         else:
@@ -1207,7 +1257,7 @@ class DeviceInput(QFrame):
                 self.channel.dropdown.setCurrentIndex(index)
             clp.project['input']['channel'] = index+1
             
-            if clp.IO['input']['length_samples']:
+            if clp.IO['input']['length_samples'] and not chirp_tab.show_channel():
                 chirp_tab.analyze()
         self.channel.update_callback = update_channel
         update_channel(channel=clp.project['input']['channel'])
@@ -0,0 +1,100 @@
+import numpy as np
+import pyqtgraph as pg
+from CLGui import thin_pen
+
+# plot curve for long, evenly spaced time-domain signals (stimulus/response waveforms, impulse responses)
+# plotting millions of points makes panning and zooming sluggish, so the curve only draws about one min/max pair per screen pixel
+# min/max pairs are taken from a pyramid of progressively coarser envelopes, built once when the data is set. Each view change just slices the level that matches the
+# current zoom, which keeps peaks visible at any zoom level (unlike plain decimation). Zooming in far enough plots the raw samples
+# usually plotted with CLTab.set_curve(key, times, samples, name, pen, envelope=True)
+ENVELOPE_FACTOR = 4 # number of bins combined into each bin of the next pyramid level
+ENVELOPE_MIN_BINS = 1024 # stop building coarser levels once a level has fewer bins than this
+DEFAULT_PLOT_WIDTH = 2000 # pixel width to assume before the curve is added to a graph
+
+def min_max_pyramid(y):
+    # list of (mins, maxs) envelopes. Level k has bins of ENVELOPE_FACTOR**(k+1) samples
+    pyramid = []
+    mins = maxs = np.asarray(y)
+    while len(mins) > ENVELOPE_MIN_BINS:
+        padded_length = -(-len(mins)//ENVELOPE_FACTOR) * ENVELOPE_FACTOR # pad the last bin with the last value
+        mins = np.pad(mins, (0, padded_length - len(mins)), mode='edge').reshape(-1, ENVELOPE_FACTOR).min(axis=1)
+        maxs = np.pad(maxs, (0, padded_length - len(maxs)), mode='edge').reshape(-1, ENVELOPE_FACTOR).max(axis=1)
+        pyramid.append((mins, maxs))
+    return pyramid
+
+
+class EnvelopeCurve(pg.PlotDataItem):
+    def __init__(self, x, y, **kwargs):
+        super().__init__(**kwargs)
+        self.full_pen = kwargs.get('pen') # pen used when few enough points are plotted, see thin_pen()
+        self.set_envelope_data(x, y)
+
+    def set_envelope_data(self, x, y):
+        # x must be evenly spaced and increasing
+        y = np.asarray(y)
+        if getattr(self, 'full_y', None) is not y: # the pyramid only depends on y, keep it if the same signal is plotted again (e.g. stimulus after re-reading the response)
+            self.pyramid = min_max_pyramid(y)
+        self.full_x = np.asarray(x)
+        self.full_y = y
+        if len(self.full_x) > 1:
+            self.x_step = self.full_x[1] - self.full_x[0]
+        else:
+            self.x_step = 1
+        self.rendered = None # (pyramid level, first sample, last sample) of the data currently plotted
+        self.update_envelope()
+
+    def viewRangeChanged(self, *args):
+        super().viewRangeChanged(*args)
+        self.update_envelope()
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        # auto-range to the full signal, not just the part that is currently plotted
+        if not len(self.full_y):
+            return (None, None)
+        if ax == 0:
+            return (self.full_x[0], self.full_x[-1])
+        if self.pyramid:
+            return (np.nanmin(self.pyramid[-1][0]), np.nanmax(self.pyramid[-1][1]))
+        return (np.nanmin(self.full_y), np.nanmax(self.full_y))
+
+    def update_envelope(self):
+        num_samples = len(self.full_y)
+        view = self.getViewBox()
+        if view is None or view.width() < 1:
+            view_start, view_end = 0, num_samples
+            plot_width = DEFAULT_PLOT_WIDTH
+        else:
+            x_min, x_max = view.viewRange()[0]
+            view_start = int(np.clip(np.floor((x_min - self.full_x[0]) / self.x_step), 0, num_samples)) if num_samples else 0
+            view_end = int(np.clip(np.ceil((x_max - self.full_x[0]) / self.x_step) + 1, 0, num_samples)) if num_samples else 0
+            plot_width = view.width()
+
+        # coarsest level that still has at least one bin per pixel
+        samples_per_pixel = (view_end - view_start) / plot_width
+        level = 0
+        while level < len(self.pyramid) and ENVELOPE_FACTOR**(level+1) <= samples_per_pixel:
+            level += 1
+
+        if self.rendered is not None and self.rendered[0] == level and self.rendered[1] <= view_start and self.rendered[2] >= view_end:
+            return # current view is already covered
+
+        # plot an extra view width on either side, so small pans don't need to re-plot
+        view_length = view_end - view_start
+        render_start = max(view_start - view_length, 0)
+        render_end = min(view_end + view_length, num_samples)
+        if level == 0:
+            plot_x = self.full_x[render_start:render_end]
+            plot_y = self.full_y[render_start:render_end]
+        else:
+            bin_size = ENVELOPE_FACTOR**level
+            mins, maxs = self.pyramid[level-1]
+            first_bin = render_start // bin_size
+            last_bin = min(-(-render_end // bin_size), len(mins))
+            bin_centers = self.full_x[0] + self.x_step * (np.arange(first_bin, last_bin) * bin_size + (bin_size-1)/2)
+            plot_x = np.repeat(bin_centers, 2)
+            plot_y = np.column_stack((mins[first_bin:last_bin], maxs[first_bin:last_bin])).ravel() # alternate min and max within each pixel
+            render_start = first_bin * bin_size
+            render_end = min(last_bin * bin_size, num_samples)
+        self.setPen(thin_pen(self.full_pen, len(plot_x)))
+        self.setData(plot_x, plot_y)
+        self.rendered = (level, render_start, render_end)
@@ -1,7 +1,7 @@
 import CLProject as clp
-from qtpy.QtWidgets import QMainWindow, QTabWidget, QTabBar, QGridLayout, QWidget, QApplication, QFileDialog, QErrorMessage, QMessageBox, QDialog, QDialogButtonBox, QVBoxLayout, QProxyStyle, QStyle, QLabel, QSizePolicy
+from qtpy.QtWidgets import QMainWindow, QTabWidget, QTabBar, QGridLayout, QWidget, QApplication, QFileDialog, QErrorMessage, QMessageBox, QDialog, QDialogButtonBox, QVBoxLayout, QProxyStyle, QStyle, QLabel, QSizePolicy, QProgressBar
 from qtpy.QtGui import QAction, QIcon, QPalette, QKeySequence, QPixmap
-from CLGui import ChirpTab, CLParamDropdown, CLParameter, QHSeparator, undo_stack
+from CLGui import ChirpTab, CLParamDropdown, CLParameter, QHSeparator, undo_stack, analysis_worker
 from CLMeasurements import init_measurements, is_valid_measurement_name
 from CLAnalysis import generate_stimulus
 from pathlib import Path
@@ -33,6 +33,7 @@ class MainWindow(QMainWindow):
                 self.tabs.setCurrentIndex(self.tabs.prev_tab) # change back to tab that was showing before the click
                 add_measurement_dialog()
         self.tabs.currentChanged.connect(tab_changed)
+        self.tabs.currentChanged.connect(self.show_measurement_tab)
         self.tabs.last_tab_clicked = 0
         self.tabs.prev_tab = 0
         def tabs_clicked(index):
@@ -45,6 +46,19 @@ class MainWindow(QMainWindow):
             # don't check for add measurement tab, handle in tab_changed
         self.tabs.tabBarClicked.connect(tabs_clicked)
         
+        # busy indicator in the status bar while measurements are running on the background analysis worker
+        self.analysis_label = QLabel('Analyzing...')
+        self.analysis_progress = QProgressBar()
+        self.analysis_progress.setRange(0, 0) # no range, progress bar just shows activity
+        self.analysis_progress.setMaximumWidth(150)
+        self.statusBar().addPermanentWidget(self.analysis_label)
+        self.statusBar().addPermanentWidget(self.analysis_progress)
+        def update_analysis_busy(busy):
+            self.analysis_label.setVisible(busy)
+            self.analysis_progress.setVisible(busy)
+        analysis_worker.busy_changed.connect(update_analysis_busy)
+        update_analysis_busy(False)
+        
         
         def load_project():
             # fully load (or reload) the current clp.project
@@ -203,8 +217,7 @@ class MainWindow(QMainWindow):
             clp.measurements.append(measurement)
             clp.project['measurements'].append(measurement.params)
             measurement.format_graph()
-            measurement.measure()
-            measurement.plot()
+            measurement.remeasure()
             self.tabs.insertTab(self.tabs.count()-1, measurement.tab, measurement.params['name']) # would be nice to put back in its original place when redoing adding measurement, but requires keeping track of tab movement in undo stack
             self.tabs.setCurrentIndex(self.tabs.count()-2)
             remove_measurement_action.setEnabled(True)
@@ -353,9 +366,24 @@ class MainWindow(QMainWindow):
             clp.project['plot_noise'] = checked
             #self.chirp_tab.plot() # still plot the noise sample if it is present
             for measurement in clp.measurements:
-                measurement.plot()
+                if measurement.tab is not None:
+                    measurement.plot()
         plot_noise.triggered.connect(update_plot_noise)
 
+        plot_all_channels = QAction('Overlay &All Input Channels', self)
+        plot_all_channels.setCheckable(True)
+        plot_all_channels.setChecked(clp.project.get('plot_all_channels', False)) # not included in older project files
+        measurement_menu.addAction(plot_all_channels)
+        def update_plot_all_channels(checked):
+            clp.project['plot_all_channels'] = checked
+            if checked:
+                self.chirp_tab.update_measurements() # analyze the other channels. Results for the selected channel are reused from the result cache
+            else:
+                for measurement in clp.measurements:
+                    if measurement.tab is not None:
+                        measurement.plot()
+        plot_all_channels.triggered.connect(update_plot_all_channels)
+
         save_noise = QAction('&Include Noise Floor in Data Output', self)
         save_noise.setCheckable(True)
         save_noise.setChecked(clp.project['save_noise'])
@@ -450,10 +478,9 @@ class MainWindow(QMainWindow):
         self.tabs.addTab(self.chirp_tab,'Chirp Stimulus/Response')
         
         # add measurement tabs to main window
+        # building all of the measurement tabs is slow for large projects, so start with placeholders and build each tab the first time it is shown (see show_measurement_tab())
         for measurement in clp.measurements:
-            measurement.init_tab()
-            measurement.format_graph()
-            self.tabs.addTab(measurement.tab, measurement.params['name'])
+            self.tabs.addTab(QWidget(), measurement.params['name'])
         
         # last tab - add measurement button (individual measurement tabs to be inserted at index -2)
         self.tabs.addTab(QWidget(), ' + ')
@@ -461,6 +488,27 @@ class MainWindow(QMainWindow):
         self.tabs.blockSignals(False)
         undo_stack.paused = False
         
+    def show_measurement_tab(self, index):
+        # build the measurement tab if this is the first time it is shown, and refresh the measurement if its results are stale
+        if index < 1 or index >= self.tabs.count()-1: # chirp tab or add measurement tab
+            return
+        measurement = clp.measurements[index-1]
+        if measurement.tab is None:
+            self.tabs.blockSignals(True)
+            undo_stack.paused = True
+            placeholder = self.tabs.widget(index)
+            measurement.init_tab()
+            measurement.format_graph()
+            self.tabs.removeTab(index)
+            self.tabs.insertTab(index, measurement.tab, measurement.params['name'])
+            self.tabs.setCurrentIndex(index)
+            placeholder.deleteLater()
+            if not measurement.stale:
+                measurement.plot()
+            self.tabs.blockSignals(False)
+            undo_stack.paused = False
+        analysis_worker.refresh(measurement)
+        
     def is_project_changed(self):
         # checks the current clp.project against the most recent saved or loaded project
         return clp.project != self.last_saved_project
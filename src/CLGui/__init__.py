@@ -33,8 +33,18 @@ class QHSeparator(QFrame):
         self.setFrameShape(QFrame.HLine)
 
 
+def thin_pen(pen, num_points):
+    # drop wide pens to 1 pixel for curves with a lot of points (see clp.THIN_PEN_POINTS)
+    pen = pg.mkPen(pen) # copies QPens, so the original pen keeps its width
+    if num_points > clp.THIN_PEN_POINTS and pen.widthF() > 1:
+        pen.setWidth(1)
+    return pen
+
+
 
 from CLGui.Undo import undo_stack
+from CLGui.EnvelopeCurve import EnvelopeCurve
+from CLGui.AnalysisWorker import analysis_worker, apply_outputs
 from CLGui.CLTab import CLTab
 from CLGui.CLParameter import CLParameter, CLParamNum, CLParamDropdown, CLParamFile, FreqPointsParams, CLParamCheckBox
 from CLGui.QCollapsible.QCollapsible import QCollapsible
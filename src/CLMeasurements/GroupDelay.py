@@ -1,16 +1,13 @@
 import CLProject as clp
-from CLAnalysis import freq_points, interpolate, resample, find_offset
-from CLGui import CLParamDropdown, FreqPointsParams
-from scipy.fftpack import fft, ifft, fftfreq
-from scipy.signal.windows import hann
+from CLAnalysis import interpolate, resample, find_offset
+from scipy.fftpack import fft, ifft
 import numpy as np
-from CLMeasurements import CLMeasurement, PhaseResponse
-from scipy.stats import linregress
-from qtpy.QtWidgets import QCheckBox
+from CLMeasurements import CLMeasurement
+from CLMeasurements.PhaseResponse import calc_bin_phase
 from copy import deepcopy
 
 # good resource about phase and group delay: http://cjs-labs.com/sitebuildercontent/sitebuilderfiles/GroupDelay.pdf
-# UI and parameters are mostly a copy of PhaseResponse, calculation calls PhaseResponse
+# UI and parameters are mostly a copy of PhaseResponse, calculation uses the bin-resolution phase shared with PhaseResponse measurements
 
 class GroupDelay(CLMeasurement):
     measurement_type_name = 'Group Delay'
@@ -46,47 +43,19 @@ class GroupDelay(CLMeasurement):
             self.params['output']['min_freq'] = self.calc_auto_min_freq()
         if self.params['output']['max_auto']:
             self.params['output']['max_freq'] = self.calc_auto_max_freq()
-
-        self.phase_response = PhaseResponse('phase')
-        self.phase_response.params['mode'] = self.params['mode']
-        self.phase_response.params['excess_method'] = self.params['excess_method']
-        self.phase_response.params['ref_channel'] = self.params['ref_channel']
-
-        self.phase_response.params['unwrap'] = True # unwrapping and absolute phase don't actually impact group delay
-        self.phase_response.params['auto_invert'] = False
-
-        # linear spacing with high frequency resolution helps keep unwrapping accurate up to higher frequencies
-        # min, max, and num_points are updated before running phase response measurement
-        self.phase_response.params['output'] = {'unit': 'degrees',
-                                                'min_freq': 1,
-                                                'min_auto': False,
-                                                'max_freq': 24000,
-                                                'max_auto': False,
-                                                'spacing': 'linear', 
-                                                'num_points': 24000,
-                                                'round_points': False}
             
             
-    def measure(self):
-        # get phase using phase response measurement
-        phase_freqs = fftfreq(len(clp.signals['stimulus']), 1/clp.project['sample_rate'])
-        phase_freqs = phase_freqs[1:round(len(phase_freqs)/2)]
-        self.phase_response.params['output']['min_freq'] = phase_freqs[0]
-        self.phase_response.params['output']['max_freq'] = phase_freqs[-1]
-        self.phase_response.params['output']['num_points'] = len(phase_freqs)
-        self.phase_response.measure()
-        phase = self.phase_response.out_points
+    def measure(self, quality='full'):
+        # get unwrapped phase at FFT bin resolution (shared with phase response measurements using the same settings)
+        # unwrapping and absolute phase don't impact group delay, so no need to re-wrap or invert
+        phase_freqs, phase = calc_bin_phase(self.params['mode'], self.params['excess_method'], self.params['ref_channel'])
 
         # convert phase to group delay
         delay = -(np.roll(phase,-1)-np.roll(phase,1))/(360*phase_freqs[1])
         delay *= 1000 # convert seconds to ms
 
         # generate array of output frequency points
-        self.out_freqs = freq_points(self.params['output']['min_freq'], 
-                                     self.params['output']['max_freq'],
-                                     self.params['output']['num_points'],
-                                     self.params['output']['spacing'],
-                                     self.params['output']['round_points'])
+        self.out_freqs = self.output_freqs(quality)
         
         # interpolate output points
         self.out_points = interpolate(phase_freqs, delay, self.out_freqs, self.params['output']['spacing']=='linear')
@@ -94,6 +63,8 @@ class GroupDelay(CLMeasurement):
         
         
     def init_tab(self):
+        from CLGui import CLParamDropdown, FreqPointsParams
+        
         super().init_tab()
 
         # timing mode dropdown
@@ -106,11 +77,9 @@ class GroupDelay(CLMeasurement):
                 self.params['mode'] = 'relative'
             else:
                 self.params['mode'] = 'excess'
-            self.phase_response.params['mode'] = self.params['mode']
             self.excess_method.dropdown.setEnabled(not index)
             self.ref_channel.dropdown.setEnabled(bool(index))
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.mode.update_callback = update_mode
 
         # excess phase calculation method dropdown
@@ -128,9 +97,7 @@ class GroupDelay(CLMeasurement):
                 self.params['excess_method'] = 'linear_phase'
             if index==2:
                 self.params['excess_method'] = 'cross_correlation'
-            self.phase_response.params['excess_method'] = self.params['excess_method']
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.excess_method.update_callback = update_excess_method
 
         # relative phase reference channel dropdown
@@ -139,7 +106,6 @@ class GroupDelay(CLMeasurement):
         self.param_section.addWidget(self.ref_channel)
         def update_ref_channel(index): # todo: still some corner cases that need to be worked out
             self.params['ref_channel'] = int(self.ref_channel.dropdown.currentText())
-            self.phase_response.params['ref_channel'] = self.params['ref_channel']
             
             if self.params['ref_channel'] == clp.project['input']['channel']:
                 self.ref_channel.dropdown.setStyleSheet('QComboBox { background-color: orange; }')
@@ -147,8 +113,7 @@ class GroupDelay(CLMeasurement):
                 self.ref_channel.dropdown.setStyleSheet('')
 
             if self.params['mode'] == 'relative':
-                self.measure()
-                self.plot()
+                self.remeasure()
         self.ref_channel.update_callback = update_ref_channel
         def update_num_channels(num_channels):
             channel_list = [str(chan) for chan in range(1, num_channels+1)]
@@ -177,16 +142,14 @@ class GroupDelay(CLMeasurement):
         self.output_section.addWidget(self.output_unit)
         def update_output_unit(index):
             self.params['output']['unit'] = self.OUTPUT_UNITS[index]
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_unit.update_callback = update_output_unit
         
         self.output_points = FreqPointsParams(self.params['output'])
         self.output_section.addWidget(self.output_points)
         def update_output_points():
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_points.update_callback = update_output_points
         self.output_points.calc_min_auto = self.calc_auto_min_freq
@@ -197,6 +160,18 @@ class GroupDelay(CLMeasurement):
         self.update_num_channels(clp.IO['input']['channels'])
         self.output_points.update_min_max()
         
+    def intermediates(self):
+        # uses the same phase calculation as PhaseResponse
+        if self.params['mode'] == 'excess':
+            return [('raw_ir',)]
+        return []
+
+    def calc_max_harmonic(self):
+        # relative mode reads the reference channel directly from the raw input at the full analysis sample rate
+        if self.params['mode'] == 'relative':
+            return np.inf
+        return 1
+
     def calc_auto_min_freq(self):
         return clp.project['start_freq']
     
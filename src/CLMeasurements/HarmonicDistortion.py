@@ -1,8 +1,6 @@
 import CLProject as clp
-from CLAnalysis import logchirp, chirp_freq_to_time, freq_points, interpolate, FS_to_unit
-from CLGui import CLParamNum, CLParamDropdown, FreqPointsParams
+from CLAnalysis import logchirp, chirp_freq_to_time, interpolate, FS_to_unit, analysis_signals, stimulus_artifact, analysis_intermediate, intermediate_dependencies, hann
 from scipy.fftpack import fft, ifft, fftfreq
-from scipy.signal.windows import hann
 import numpy as np
 from CLMeasurements import CLMeasurement, FrequencyResponse
 
@@ -43,27 +41,20 @@ class HarmonicDistortion(CLMeasurement):
             self.params['output']['max_freq'] = self.calc_auto_max_freq()
 
             
-    def measure(self):
-        thd_freqs, thd = self.calc_thd(clp.signals['response'])
+    def measure(self, quality='full'):
+        # response and noise sample (if present) are analyzed together as rows of a single array
+        thd_freqs, thd = self.calc_thd()
 
         # generate array of output frequency points
-        self.out_freqs = freq_points(self.params['output']['min_freq'], 
-                                     self.params['output']['max_freq'],
-                                     self.params['output']['num_points'],
-                                     self.params['output']['spacing'],
-                                     self.params['output']['round_points'])
+        self.out_freqs = self.output_freqs(quality)
         
         
         # interpolate output points
-        self.out_points = interpolate(thd_freqs, thd, self.out_freqs, self.params['output']['spacing']=='linear')
+        out_points = interpolate(thd_freqs, thd, self.out_freqs, self.params['output']['spacing']=='linear')
         
         # assume most output units will want a fundamental frequency response reference
-        ref_fr = FrequencyResponse('fr')
-        ref_fr.params['output'] = self.params['output'].copy()
-        ref_fr.params['output']['unit'] = 'FS'
-        ref_fr.params['output']['min_auto'] = False # shouldn't actually have any impact, but set in case of future updates
-        ref_fr.params['output']['max_auto'] = False
-        ref_fr.measure()
+        ref_fr = self.reference_fr()
+        ref_fr.measure(quality)
         
         # convert output to desired units
         def convert_output_units(fs_points):
@@ -76,75 +67,29 @@ class HarmonicDistortion(CLMeasurement):
                     return 100 * fs_points / (ref_fr.out_points + fs_points)
                 case _:
                     return FS_to_unit(fs_points, self.params['output']['unit'])
-        self.out_points = convert_output_units(self.out_points)
+        out_points = convert_output_units(out_points)
+        self.out_points = out_points[0]
         
-        
-        # check for noise sample and calculate noise floor
-        if any(clp.signals['noise']):
-            fr_freqs, noise_floor = self.calc_thd(clp.signals['noise'])
-            self.out_noise = interpolate(fr_freqs, noise_floor, self.out_freqs, self.params['output']['spacing']=='linear')
-            self.out_noise = convert_output_units(self.out_noise)
+        # second row is the measurement noise floor if a noise sample was available
+        if len(out_points) > 1:
+            self.out_noise = out_points[1]
         else:
             self.out_noise = np.zeros(0)
         
         
-    def calc_thd(self, input_signal):
-        # geneate a reference chirp that extends to Nyquist. Otherwise, only analysis of chirps that extend up to or very near Nyquist will be accurate
-        thd_chirp_length = chirp_freq_to_time(clp.project['start_freq'], clp.project['stop_freq'], clp.project['chirp_length'], clp.project['sample_rate']/2)
-        stimulus = np.concatenate([
-            np.zeros(round(clp.project['pre_sweep']*clp.project['sample_rate'])),
-            logchirp(clp.project['start_freq'], clp.project['sample_rate']/2, thd_chirp_length, clp.project['sample_rate'])])
-        
-        # pad stimulus or response to be the same length
-        if len(stimulus) < len(input_signal):
-            stimulus = np.concatenate([stimulus, np.zeros(len(input_signal) - len(stimulus))])
-        else:
-            input_signal = np.concatenate([input_signal, np.zeros(len(stimulus) - len(input_signal))])
-        
-        # calculate raw complex frequency response and IR
-        fr = fft(input_signal) / fft(stimulus)
-        ir = ifft(fr)
-        
+    # calculate the total harmonic distortion of the response signal and noise sample (one row per signal, see CLAnalysis.analysis_signals())
+    # individual harmonic spectra are shared with other harmonic distortion measurements using the same harmonic windows
+    def calc_thd(self):
         # generate array of center frequencies of fft bins
-        fr_freqs = fftfreq(len(stimulus), 1/clp.project['sample_rate'])
-        fr_freqs = fr_freqs[1:int(len(fr_freqs)/2)-1] # trim to positive frequencies
+        fr_freqs = harmonic_fr_freqs()
         
         # initialize blank total harmonic power spectrum
         total_harmonic_power = np.zeros(len(fr_freqs))
         
         # loop through harmonics
         for harmonic in range(self.params['start_harmonic'], self.params['stop_harmonic']+1):
-            # generate harmonic window
-            harmonic_time = harmonic_impulse_time(clp.project['chirp_length'], clp.project['start_freq'], clp.project['stop_freq'], harmonic)
-            prev_harmonic_time = harmonic_impulse_time(clp.project['chirp_length'], clp.project['start_freq'], clp.project['stop_freq'], harmonic+1) # next harmonic *number*, previous in terms of *arrival time*. Used to calculate window_start
-            next_harmonic_time = harmonic_impulse_time(clp.project['chirp_length'], clp.project['start_freq'], clp.project['stop_freq'], harmonic-1)
-        
-            fade_in = round(self.params['fade_in']*(harmonic_time-prev_harmonic_time)*clp.project['sample_rate'])
-            window_start = round(self.params['window_start']*(harmonic_time-prev_harmonic_time)*clp.project['sample_rate'])
-            fade_out = round(self.params['fade_out']*(next_harmonic_time-harmonic_time)*clp.project['sample_rate'])
-            window_end = round(self.params['window_end']*(next_harmonic_time-harmonic_time)*clp.project['sample_rate'])
-            
-            harmonic_window = np.zeros(len(ir))
-            harmonic_window[:fade_in] = hann(fade_in*2)[:fade_in]
-            harmonic_window[fade_in:window_start+window_end-fade_out] = np.ones(window_start-fade_in+window_end-fade_out)
-            harmonic_window[window_start+window_end-fade_out:window_start+window_end] = hann(fade_out*2)[fade_out:]
-            harmonic_window = np.roll(harmonic_window, round(harmonic_time*clp.project['sample_rate'])-window_start)
-            
-            # apply harmonic window to IR
-            harmonic_ir = ir * harmonic_window
-            
-            # get harmonic spectrum
-            harmonic_spectrum = fft(harmonic_ir)
-            harmonic_spectrum = harmonic_spectrum[1:int(len(harmonic_spectrum)/2)-1]
-
-            # take magnitude of complex spectrum
-            harmonic_spectrum = np.abs(harmonic_spectrum)
-
-            # apply frequncy scaling/interpolation
-            harmonic_spectrum = np.interp(fr_freqs, fr_freqs/harmonic, harmonic_spectrum)
-
             # add single harmonic power to total harmonic power
-            total_harmonic_power = total_harmonic_power + np.square(harmonic_spectrum)
+            total_harmonic_power = total_harmonic_power + np.square(harmonic_spectrum(harmonic, *self.harmonic_window_samples(harmonic)))
         
         
         # take square root of harmonic power to complete power sum
@@ -152,9 +97,35 @@ class HarmonicDistortion(CLMeasurement):
         
         return fr_freqs, total_harmonic_power
     
+    def harmonic_window_samples(self, harmonic):
+        # harmonic impulse window parameters converted to whole samples (fade_in, window_start, fade_out, window_end)
+        harmonic_time = harmonic_impulse_time(clp.project['chirp_length'], clp.project['start_freq'], clp.project['stop_freq'], harmonic)
+        prev_harmonic_time = harmonic_impulse_time(clp.project['chirp_length'], clp.project['start_freq'], clp.project['stop_freq'], harmonic+1) # next harmonic *number*, previous in terms of *arrival time*. Used to calculate window_start
+        next_harmonic_time = harmonic_impulse_time(clp.project['chirp_length'], clp.project['start_freq'], clp.project['stop_freq'], harmonic-1)
     
+        fade_in = round(self.params['fade_in']*(harmonic_time-prev_harmonic_time)*clp.project['sample_rate'])
+        window_start = round(self.params['window_start']*(harmonic_time-prev_harmonic_time)*clp.project['sample_rate'])
+        fade_out = round(self.params['fade_out']*(next_harmonic_time-harmonic_time)*clp.project['sample_rate'])
+        window_end = round(self.params['window_end']*(next_harmonic_time-harmonic_time)*clp.project['sample_rate'])
+        return fade_in, window_start, fade_out, window_end
+
+    def reference_fr(self):
+        # fundamental frequency response at the output points, used as the reference for relative output units
+        ref_fr = FrequencyResponse('fr')
+        ref_fr.params['output'] = self.params['output'].copy()
+        ref_fr.params['output']['unit'] = 'FS'
+        ref_fr.params['output']['min_auto'] = False # shouldn't actually have any impact, but set in case of future updates
+        ref_fr.params['output']['max_auto'] = False
+        return ref_fr
+
+    def intermediates(self):
+        fft_length = harmonic_fft_length()
+        harmonic_spectra = [('harmonic_spectrum', fft_length, harmonic) + self.harmonic_window_samples(harmonic) for harmonic in range(self.params['start_harmonic'], self.params['stop_harmonic']+1)]
+        return harmonic_spectra + self.reference_fr().intermediates()
         
     def init_tab(self):
+        from CLGui import CLParamNum, CLParamDropdown, FreqPointsParams
+        
         super().init_tab()
 
         self.start_harmonic = CLParamNum('Lowest harmonic', self.params['start_harmonic'], '', 2, 40, 'int')
@@ -177,8 +148,7 @@ class HarmonicDistortion(CLMeasurement):
             self.params['start_harmonic'] = self.start_harmonic.value
             self.params['stop_harmonic'] = self.stop_harmonic.value
             self.output_points.update_min_max()
-            self.measure()
-            self.plot()
+            self.remeasure()
 
         
         self.output_unit = CLParamDropdown('Units', self.OUTPUT_UNITS, '')
@@ -188,16 +158,14 @@ class HarmonicDistortion(CLMeasurement):
         self.output_section.addWidget(self.output_unit)
         def update_output_unit(index):
             self.params['output']['unit'] = self.OUTPUT_UNITS[index]
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_unit.update_callback = update_output_unit
         
         self.output_points = FreqPointsParams(self.params['output'])
         self.output_section.addWidget(self.output_points)
         def update_output_points():
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_points.update_callback = update_output_points
         self.output_points.calc_min_auto = self.calc_auto_min_freq
@@ -207,6 +175,9 @@ class HarmonicDistortion(CLMeasurement):
     def update_tab(self):
         self.output_points.update_min_max()
     
+    def calc_max_harmonic(self):
+        return self.params['stop_harmonic']
+
     def calc_auto_min_freq(self):
         return clp.project['start_freq']
     
@@ -219,4 +190,68 @@ class HarmonicDistortion(CLMeasurement):
 def harmonic_impulse_time(chirp_length, start_freq, stop_freq, harmonic):
     # calculates and returns the arrival time in of a harmonic impulse response, relative to the t=0 of the fundamental impulse response
     return -1 * chirp_length * (np.log(harmonic) / np.log(stop_freq/start_freq))
+
+def harmonic_fft_length():
+    # harmonic analysis uses a reference chirp that extends to Nyquist. Otherwise, only analysis of chirps that extend up to or very near Nyquist will be accurate
+    # FFT length is the length of the extended reference chirp or the response, whichever is longer
+    thd_chirp_length = chirp_freq_to_time(clp.project['start_freq'], clp.project['stop_freq'], clp.project['chirp_length'], clp.project['sample_rate']/2)
+    stimulus_length = round(clp.project['pre_sweep']*clp.project['sample_rate']) + round(thd_chirp_length*clp.project['sample_rate'])
+    return max(stimulus_length, len(clp.signals['response']))
+
+def harmonic_fr_freqs():
+    # center frequencies of the positive fft bins used for harmonic analysis
+    fr_freqs = fftfreq(harmonic_fft_length(), 1/clp.project['sample_rate'])
+    return fr_freqs[1:int(len(fr_freqs)/2)-1]
+
+def harmonic_impulse_responses():
+    # raw complex impulse response of the analysis signals relative to the extended reference chirp, one row per signal (see CLAnalysis.analysis_signals())
+    # contains the fundamental and all of the harmonic impulses. Shared by all harmonic distortion measurements in an analysis
+    fft_length = harmonic_fft_length()
+    def calc_harmonic_impulse_responses():
+        thd_chirp_length = chirp_freq_to_time(clp.project['start_freq'], clp.project['stop_freq'], clp.project['chirp_length'], clp.project['sample_rate']/2)
+        stimulus_length = round(clp.project['pre_sweep']*clp.project['sample_rate']) + round(thd_chirp_length*clp.project['sample_rate'])
+
+        # pad stimulus or response to be the same length
+        input_signal = analysis_signals()
+        input_signal = np.concatenate([input_signal, np.zeros(input_signal.shape[:-1] + (fft_length - input_signal.shape[-1],))], axis=-1)
+        def calc_stimulus_spectrum():
+            stimulus = np.concatenate([
+                np.zeros(round(clp.project['pre_sweep']*clp.project['sample_rate'])),
+                logchirp(clp.project['start_freq'], clp.project['sample_rate']/2, thd_chirp_length, clp.project['sample_rate']),
+                np.zeros(fft_length - stimulus_length)])
+            return fft(stimulus)
+        stimulus_spectrum = stimulus_artifact('thd_stimulus_fft_' + str(fft_length), calc_stimulus_spectrum) # only depends on the project, reused across measurements and input files
+
+        return ifft(fft(input_signal) / stimulus_spectrum)
+    return analysis_intermediate(('harmonic_ir', fft_length), calc_harmonic_impulse_responses)
+
+def harmonic_spectrum(harmonic, fade_in, window_start, fade_out, window_end):
+    # magnitude spectrum of a single harmonic impulse (window parameters in samples), scaled to the fundamental frequency at each bin of harmonic_fr_freqs(). One row per analysis signal
+    fft_length = harmonic_fft_length()
+    def calc_harmonic_spectrum():
+        ir = harmonic_impulse_responses()
+        fr_freqs = harmonic_fr_freqs()
+
+        # generate harmonic window
+        harmonic_time = harmonic_impulse_time(clp.project['chirp_length'], clp.project['start_freq'], clp.project['stop_freq'], harmonic)
+        harmonic_window = np.zeros(ir.shape[-1])
+        harmonic_window[:fade_in] = hann(fade_in*2)[:fade_in]
+        harmonic_window[fade_in:window_start+window_end-fade_out] = np.ones(window_start-fade_in+window_end-fade_out)
+        harmonic_window[window_start+window_end-fade_out:window_start+window_end] = hann(fade_out*2)[fade_out:]
+        harmonic_window = np.roll(harmonic_window, round(harmonic_time*clp.project['sample_rate'])-window_start)
+        
+        # apply harmonic window to IR
+        harmonic_ir = ir * harmonic_window
+        
+        # get harmonic spectrum
+        spectrum = fft(harmonic_ir)
+        spectrum = spectrum[..., 1:int(spectrum.shape[-1]/2)-1]
+
+        # take magnitude of complex spectrum
+        spectrum = np.abs(spectrum)
+
+        # apply frequncy scaling/interpolation
+        return interpolate(fr_freqs/harmonic, spectrum, fr_freqs)
+    return analysis_intermediate(('harmonic_spectrum', fft_length, harmonic, fade_in, window_start, fade_out, window_end), calc_harmonic_spectrum)
+intermediate_dependencies['harmonic_spectrum'] = lambda key: [('harmonic_ir', key[1])]
     
\ No newline at end of file
@@ -1,15 +1,10 @@
 import CLProject as clp
-from CLMeasurements import CLMeasurement
+from CLMeasurements import CLMeasurement, MeasurementResult
 from scipy.fftpack import fft, ifft
-from scipy.signal.windows import hann
-from CLGui.CLParameter import CLParamDropdown, CLParamNum
-from CLMeasurements.FrequencyResponse import WindowParamsSection, ms_to_samples, samples_to_ms
+from CLMeasurements.FrequencyResponse import ms_to_samples, samples_to_ms
 import numpy as np
-import pyqtgraph as pg
-from qtpy.QtWidgets import QCheckBox
-from qtpy.QtCore import Qt
 from pathlib import Path
-from CLAnalysis import write_audio_file, resample, find_offset
+from CLAnalysis import write_audio_file, aligned_channel, channel_offset, stimulus_spectrum, raw_impulse_response, hann
 
 class ImpulseResponse(CLMeasurement):
     measurement_type_name = 'Impulse Response'
@@ -56,47 +51,36 @@ class ImpulseResponse(CLMeasurement):
                 'bit_depth': '32 float' # options are the same as base project output format, to be used with CLAnalyis.write_audio_file().
                 } # output sample rate is the same as the project analysis sample rate
             
-    def measure(self):
-        def get_input_signal(channel, delay): # mostly the same process as CLAnalysis.read_response() # todo: consider refactoring CLAnalysis.read_response(), this, and PhaseResponse to reduce duplication
-            # get signal from raw input channel at the given delay. Ued to get reference signal and timing reference signals
-            if clp.signals['raw_response'].ndim > 1:
-                input_signal = clp.signals['raw_response'][:,channel-1]
-            else:
-                input_signal = clp.signals['raw_response']
-            if clp.project['sample_rate'] != clp.IO['input']['sample_rate']:
-                input_signal = resample(input_signal, clp.IO['input']['sample_rate'], clp.project['sample_rate'])
-
-            start_padding = max(0, -delay)
-            delay = delay + start_padding
-            end_padding = max(0, len(clp.signals['stimulus']) - (len(input_signal) - delay))
-            input_signal = np.concatenate([np.zeros(start_padding), input_signal, np.zeros(end_padding)])
-
-            return input_signal[delay:delay + len(clp.signals['stimulus'])]
-
+    def measure(self, quality='full'):
+        # additional input channels are aligned and trimmed once per input load and shared with other measurements
         if self.params['ref_channel']:
             # get signal from reference channel at same timing as input channel
-            reference = get_input_signal(self.params['ref_channel'], clp.IO['input']['delay'])
+            reference_spectrum = fft(aligned_channel(self.params['ref_channel']))
             response = clp.signals['response']
         else:
             # use stimulus signal as the reference (and potentially use a different channel as the timing reference)
-            reference = clp.signals['stimulus']
+            reference_spectrum = stimulus_spectrum()
 
             if (self.params['timing_channel']==0) or (self.params['timing_channel']==clp.project['input']['channel']):
                 # skip time alignment if input channel is referenced to itself
                 response = clp.signals['response']
             else:
-                # get the time reference aligned to main response
-                time_reference = get_input_signal(self.params['timing_channel'], clp.IO['input']['delay'])
-
                 # calculate the offset between the time reference and the stimulus
-                time_reference_offset = find_offset(time_reference, clp.signals['stimulus'])
+                time_reference_offset = channel_offset(self.params['timing_channel'])
 
                 # get the response signal trimmed to the time reference delay
-                response = get_input_signal(clp.project['input']['channel'], clp.IO['input']['delay'] + time_reference_offset)
+                response = aligned_channel(clp.project['input']['channel'], time_reference_offset)
 
 
-        # calculate raw impulse response
-        impulse_response = ifft(fft(response) / fft(reference)).real
+        # calculate raw impulse response, along with the noise IR (always referenced to the stimulus) in the same batched pass if a noise sample is available
+        if self.uses_raw_ir():
+            # response referenced to the stimulus at its own timing, same as the raw impulse response shared with other measurements
+            impulse_responses = raw_impulse_response().real
+        elif any(clp.signals['noise']):
+            impulse_responses = ifft(fft(np.vstack([response, clp.signals['noise']])) / np.vstack([reference_spectrum, stimulus_spectrum()])).real
+        else:
+            impulse_responses = ifft(fft(np.atleast_2d(response)) / reference_spectrum).real
+        impulse_response = impulse_responses[0]
         
 
         # calculate window parameters (parameters are sometimes used even when window isn't applied)
@@ -122,14 +106,15 @@ class ImpulseResponse(CLMeasurement):
             window[window_start+window_end-fade_out:window_start+window_end] = hann(fade_out*2)[fade_out:]
             window = np.roll(window, -window_start)
 
-            # apply window to impulse response
-            impulse_response *= window
+            # apply window to impulse response (and noise IR)
+            impulse_responses = impulse_responses * window
 
         # calculate offset from alignment setting
         roll_samples = self.calc_offset_samples()
 
         # apply offset
-        impulse_response = np.roll(impulse_response, roll_samples)
+        impulse_responses = np.roll(impulse_responses, roll_samples, axis=-1)
+        impulse_response = impulse_responses[0]
 
         # store measurement data
         self.out_ir = impulse_response
@@ -148,17 +133,28 @@ class ImpulseResponse(CLMeasurement):
         # generate sample timestamps for graphs
         self.out_times = samples_to_ms(np.arange(len(impulse_response)) - roll_samples)
 
-        # calculate noise IR
-        if any(clp.signals['noise']):
-            noise_ir = ifft(fft(clp.signals['noise']) / fft(clp.signals['stimulus'])).real
-            if self.params['window_mode'] != 'raw':
-                noise_ir *= window
-            self.out_noise = np.roll(noise_ir, roll_samples)
+        # noise IR was calculated and windowed along with the main impulse response
+        if len(impulse_responses) > 1:
+            self.out_noise = impulse_responses[1]
+        else:
+            self.out_noise = np.zeros(0)
 
         if self.params['window_mode']!='raw':
             # apply offset and scale window appropriately for plotting
             self.out_window = np.roll(window, roll_samples) * max(abs(self.out_ir))
 
+    def uses_raw_ir(self):
+        return not self.params['ref_channel'] and self.params['timing_channel'] in [0, clp.project['input']['channel']]
+
+    def intermediates(self):
+        if self.uses_raw_ir():
+            return [('raw_ir',)]
+        return []
+
+    def calc_max_harmonic(self):
+        # impulse response is a full bandwidth time domain output written at the analysis sample rate, and reference/timing channels are read from the raw input
+        return np.inf
+
     def calc_offset_samples(self):
         match self.params['alignment']:
             case 'window_start':
@@ -182,6 +178,10 @@ class ImpulseResponse(CLMeasurement):
         return 0
 
     def init_tab(self):
+        from CLGui.CLParameter import CLParamDropdown, CLParamNum
+        from CLGui.MeasurementWidgets import WindowParamsSection
+        from qtpy.QtWidgets import QCheckBox
+        
         super().init_tab()
 
         self.window_mode = CLParamDropdown('Windowing mode', self.WINDOW_MODES, '')
@@ -207,8 +207,7 @@ class ImpulseResponse(CLMeasurement):
                 return # alignment and/or window updates call measure() and plot()
             else:
                 self.plot_window.setEnabled(True)
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.window_mode.update_callback = update_window_mode
         
         # use the window params collapsible section from FrequencyResponse
@@ -217,8 +216,7 @@ class ImpulseResponse(CLMeasurement):
             self.window_params.setLocked(True)
         self.param_section.addWidget(self.window_params)
         def update_window_params():
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.window_params.update_callback = update_window_params
 
         # reference channel dropdown
@@ -227,8 +225,7 @@ class ImpulseResponse(CLMeasurement):
         def update_ref_channel(index):
             self.params['ref_channel'] = index
             self.timing_channel.setEnabled(index==0)
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.ref_channel.update_callback = update_ref_channel
 
         # time reference channel dropdown
@@ -237,8 +234,7 @@ class ImpulseResponse(CLMeasurement):
         self.param_section.addWidget(self.timing_channel)
         def update_timing_channel(index): # todo: check more thoroughly for corner cases
             self.params['timing_channel'] = index
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.timing_channel.update_callback = update_timing_channel
         
         def update_num_channels(num_channels):
@@ -298,8 +294,7 @@ class ImpulseResponse(CLMeasurement):
                 case 3:
                     self.params['alignment'] = 'offset'
                     self.offset.setEnabled(True)
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.alignment.update_callback = update_alignment
 
         # fixed offset spinbox
@@ -311,8 +306,7 @@ class ImpulseResponse(CLMeasurement):
                 self.params['offset'] = samples_to_ms(new_val)
             else: # ms
                 self.params['offset'] = new_val
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.offset.update_callback = update_offset
         def update_offset_unit(index):
             if index: # changing from ms to samples
@@ -351,8 +345,7 @@ class ImpulseResponse(CLMeasurement):
                 case 2:
                     self.params['output']['truncate_mode'] = 'full'
             self.truncate_length.setEnabled(index==1)
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.truncate_mode.update_callback = update_truncate_mode
 
         # fixed truncation length spinbox
@@ -374,8 +367,7 @@ class ImpulseResponse(CLMeasurement):
                 self.truncate_length.set_numtype('float')
                 self.truncate_length.set_value(self.params['output']['truncate_length'])
                 self.truncate_length.max = len(clp.signals['stimulus'])-1 - self.calc_offset_samples()
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.truncate_length.units_update_callback = update_truncate_length_units
         self.update_truncate_length_units = update_truncate_length_units
 
@@ -411,6 +403,11 @@ class ImpulseResponse(CLMeasurement):
         self.update_truncate_length_units(self.truncate_length.units.currentIndex())
         self.update_num_channels(clp.IO['input']['channels'])
 
+    def get_result(self):
+        # time domain impulse response vs time in ms. The sample range that is saved to the output wav file is included in extra
+        return MeasurementResult(self.params['name'], type(self).__name__, '', self.out_times, self.out_ir, self.out_noise, 'Time (ms)',
+                                 {'start_sample': self.out_start_sample, 'end_sample': self.out_end_sample})
+
     # ImpulseResponse doesn't support CSV export, return None
     def get_measurement_data(self, include_noise=True):
         return None
@@ -441,19 +438,27 @@ class ImpulseResponse(CLMeasurement):
         self.tab.graph.setLabel('left', 'Impulse Response')
 
     def plot(self):
-        self.tab.graph.clear()
+        import pyqtgraph as pg
+        from qtpy.QtCore import Qt
         
+        # full-length IRs can be millions of samples, so they are plotted as envelopes (see CLGui.EnvelopeCurve)
         plot_pen = pg.mkPen(color=clp.PLOT_COLORS[0], width=clp.PLOT_PEN_WIDTH)
-        self.tab.graph.plot(self.out_times, self.out_ir, name = self.measurement_type_name, pen=plot_pen) # todo: do something different when plotting a single point (pyqtgraph falls on its face otherwise)
+        self.tab.set_curve('ir', self.out_times, self.out_ir, self.trace_name(), plot_pen, envelope=True)
         
         if clp.project['plot_noise'] and any(self.out_noise):
             noise_pen = pg.mkPen(color=clp.NOISE_COLOR, width=clp.PLOT_PEN_WIDTH)
-            self.tab.graph.plot(self.out_times, self.out_noise, name='Noise Floor', pen=noise_pen)#, color='gray')
+            self.tab.set_curve('noise', self.out_times, self.out_noise, 'Noise Floor', noise_pen, envelope=True)
+        else:
+            self.tab.remove_curve('noise')
 
         # plot the window
         if self.plot_window.isChecked() and (self.params['window_mode'] != 'raw'):
             window_pen = pg.mkPen(color=clp.PLOT_COLORS[1], width=clp.PLOT_PEN_WIDTH, style=Qt.DotLine)
-            self.tab.graph.plot(self.out_times, self.out_window, name='Window', pen=window_pen)
+            self.tab.set_curve('window', self.out_times, self.out_window, 'Window', window_pen, envelope=True)
+        else:
+            self.tab.remove_curve('window')
+
+        self.plot_channels('out_times', 'out_ir', envelope=True)
         
         # set the plot range based on the truncation settings
         self.tab.graph.setXRange(self.out_times[self.out_start_sample], self.out_times[self.out_end_sample])
@@ -1,14 +1,127 @@
 import CLProject as clp
-from CLAnalysis import freq_points, interpolate, resample, find_offset
-from CLGui import CLParamDropdown, FreqPointsParams, CLParamCheckBox
+from CLAnalysis import freq_points, interpolate, aligned_channel, channel_offset, raw_impulse_response, cache_lock, hann
 from scipy.fftpack import fft, ifft, fftfreq
-from scipy.signal.windows import hann
 import numpy as np
 from CLMeasurements import CLMeasurement
-from scipy.stats import linregress
 
 # good resource about phase and group delay: http://cjs-labs.com/sitebuildercontent/sitebuilderfiles/GroupDelay.pdf
 
+# cache of unwrapped bin-resolution phase shared by PhaseResponse and GroupDelay measurements, keyed by phase calculation settings
+# only holds results for the current stimulus/response signals, cleared whenever either signal is replaced. Stored in the caches of the current analysis context
+def calc_bin_phase(mode, excess_method, ref_channel):
+    # calculate the unwrapped phase response in degrees at every positive FFT bin frequency, returns bin frequencies and phase
+    # results are reused by any PhaseResponse or GroupDelay measurement with the same settings until the stimulus or response signal changes
+    # if ref_channel is invalid in 'relative' mode the phase is -1 for all frequency points
+    if mode=='excess':
+        key = (mode, excess_method)
+    else:
+        key = (mode, ref_channel, clp.project['input']['channel'])
+    with cache_lock:
+        phase_cache = clp.caches.setdefault('phase', {'signals': (None, None)})
+        if phase_cache['signals'][0] is not clp.signals['stimulus'] or phase_cache['signals'][1] is not clp.signals['response']:
+            phase_cache.clear()
+            phase_cache['signals'] = (clp.signals['stimulus'], clp.signals['response'])
+        if key in phase_cache:
+            return phase_cache[key]
+
+    # calculate bin frequencies for the FFTs that will be used
+    freqs = fftfreq(len(clp.signals['stimulus']), 1/clp.project['sample_rate'])
+    # trim to only positive frequencies
+    freqs = freqs[1:round(len(freqs)/2)]
+
+    # find the minimum and maximum bins that cover the frequency range of the chirp, used for auto_invert, min_delay and linear_phase
+    min_bin = np.argmin(np.abs(freqs - clp.project['start_freq'])) + 1
+    max_bin = np.argmin(np.abs(freqs - clp.project['stop_freq'])) - 1
+
+    # apply an aggressive window to the impulse response. Significantly reduces noise but does not impact low frequency phase accuracy as much as magnitude. Used for excess and relative phase modes. Might be overly smooth
+    # todo: window width determined empirically, experiment with other widths or exposing as a measurement parameter. Current implementation usually resolves phase at lowest chirp freq to nearest pi
+    max_wavelength = round(clp.project['sample_rate'] / clp.project['start_freq'])
+    window = np.zeros(len(clp.signals['stimulus']))
+    window[:max_wavelength] = hann(2*max_wavelength)[:max_wavelength] # half Hann window of longest chirp wavelength
+    window[max_wavelength:3*max_wavelength] = hann(4*max_wavelength)[2*max_wavelength:] # half Hann window of double longest chirp wavelength
+    window = np.roll(window, -max_wavelength)
+
+    if mode=='excess': # estimate the minimum group delay and apply an offset to the phase
+        # get raw impulse response (shared with other measurements) and apply window
+        impulse_response = raw_impulse_response()[0] * window
+
+        # calculate phase from windowed impulse response (and trim to positive frequencies)
+        wrapped_phase_rad = np.angle(fft(impulse_response)[1:len(freqs)+1])
+
+        phase_offset_deg = 0 # no group delay correction, used in the cross_correlation case
+
+        if excess_method=='linear_phase':
+            # perform a linear regression to determine the linear phase delay over the chirp range
+            from scipy.stats import linregress # scipy.stats is slow to import, only load it when this method is used
+            result = linregress(freqs[min_bin:max_bin], np.rad2deg(np.unwrap(wrapped_phase_rad[min_bin:max_bin]))) # regression over linear frequency scale is weighted toward high frequencies, which works well for this method
+            phase_offset_deg = -freqs*result.slope
+        
+        elif excess_method=='min_delay':
+            # start with unwrapped phase in degrees
+            unwrapped_phase_deg = np.rad2deg(np.unwrap(wrapped_phase_rad))
+        
+            # calculate group delay from phase
+            delay = -(np.roll(unwrapped_phase_deg,-1)-np.roll(unwrapped_phase_deg,1))/(360*freqs[1])
+
+            # get group delay on a log frequency scale (otherwise min calculation will be overly influenced by noisy high frequencies)
+            log_freqs = freq_points(freqs[min_bin], freqs[max_bin], round(96*np.log2(clp.project['stop_freq']/clp.project['start_freq']))) # 96 points per octave
+            log_delay = interpolate(freqs, delay, log_freqs)
+
+            # get an estimate of the minimum group delay
+            min_delay = np.percentile(log_delay,10) # 10th percentile helps reject noisy spikes that are not fully smoothed by IR windowing, also still reasonably acccurate for most electrical/purely digital measurements where minimum delay is at max frequency
+
+            # calculate phase offsets
+            phase_offset_deg = min_delay * freqs * 360
+
+        # calculate phase and apply offset
+        phase = np.rad2deg(np.unwrap(wrapped_phase_rad))
+        phase += phase_offset_deg
+    
+    else: # phase relative to a loopback reference channel
+        if ref_channel > clp.IO['input']['channels'] or ref_channel == clp.project['input']['channel']:
+            # selected reference channel is not valid, return all -1
+            phase = np.ones(len(freqs)) * -1
+
+        else: # calculate phase relative to reference channel
+            # get the input channel and the reference channel, aligned and trimmed to the stimulus (shared with other measurements using the same channels)
+            if 'raw_response' not in clp.signals or not len(clp.signals['raw_response']):
+                response = np.zeros(len(clp.signals['stimulus']))
+                reference = np.zeros(len(clp.signals['stimulus']))
+                reference_delay = 0
+            else:
+                response = aligned_channel(clp.project['input']['channel'])
+                reference = aligned_channel(ref_channel)
+
+                # find and keep track of the gross offset between the signals
+                reference_delay = channel_offset(clp.project['input']['channel'], ref_channel)
+
+            # align response against reference
+            response = np.roll(response, -reference_delay)
+            # zero out any portion that wrapped around (in case of very long delays outside of expected pre/post sweep)
+            if reference_delay>0:
+                response[:reference_delay] = np.zeros(reference_delay)
+            elif reference_delay<0:
+                response[reference_delay:] = np.zeros(-reference_delay)
+
+            # calculate the impulse response between the input channel and reference channel
+            impulse_response = ifft(fft(response) / fft(reference))
+
+            # apply window to impulse response
+            impulse_response *= window
+
+            # calculate phase from windowed impulse response (and trim to positive frequencies)
+            wrapped_phase_rad = np.angle(fft(impulse_response)[1:len(freqs)+1])
+
+            # unwrap and convert to degrees
+            phase = np.rad2deg(np.unwrap(wrapped_phase_rad))
+
+            # add gross delay to phase result
+            phase -= freqs * (reference_delay / clp.project['sample_rate']) * 360
+
+    with cache_lock:
+        phase_cache[key] = (freqs, phase)
+    return freqs, phase
+
 class PhaseResponse(CLMeasurement):
     measurement_type_name = 'Phase Response'
     
@@ -45,166 +158,40 @@ class PhaseResponse(CLMeasurement):
             self.params['output']['max_freq'] = self.calc_auto_max_freq()
             
             
-    def measure(self):
-        # calculate bin frequencies for the FFTs that will be used
-        freqs = fftfreq(len(clp.signals['stimulus']), 1/clp.project['sample_rate'])
-        # trim to only positive frequencies
-        freqs = freqs[1:round(len(freqs)/2)]
+    def measure(self, quality='full'):
+        # get unwrapped phase at FFT bin resolution (shared with other phase/group delay measurements with the same settings)
+        freqs, phase = calc_bin_phase(self.params['mode'], self.params['excess_method'], self.params['ref_channel'])
+        invalid_ref_channel = self.params['mode']=='relative' and (self.params['ref_channel'] > clp.IO['input']['channels'] or self.params['ref_channel'] == clp.project['input']['channel'])
 
-        # find the minimum and maximum bins that cover the frequency range of the chirp, used for auto_invert, min_delay and linear_phase
+        # find the bin closest to the lowest chirp frequency, used for auto_invert
         min_bin = np.argmin(np.abs(freqs - clp.project['start_freq'])) + 1
-        max_bin = np.argmin(np.abs(freqs - clp.project['stop_freq'])) - 1
-
-        # apply an aggressive window to the impulse response. Significantly reduces noise but does not impact low frequency phase accuracy as much as magnitude. Used for excess and relative phase modes. Might be overly smooth
-        # todo: window width determined empirically, experiment with other widths or exposing as a measurement parameter. Current implementation usually resolves phase at lowest chirp freq to nearest pi
-        max_wavelength = round(clp.project['sample_rate'] / clp.project['start_freq'])
-        window = np.zeros(len(clp.signals['stimulus']))
-        window[:max_wavelength] = hann(2*max_wavelength)[:max_wavelength] # half Hann window of longest chirp wavelength
-        window[max_wavelength:3*max_wavelength] = hann(4*max_wavelength)[2*max_wavelength:] # half Hann window of double longest chirp wavelength
-        window = np.roll(window, -max_wavelength)
 
-        if self.params['mode']=='excess': # estimate the minimum group delay and apply an offset to the phase
-            # calculate raw impulse response
-            impulse_response = ifft(fft(clp.signals['response']) / fft(clp.signals['stimulus']))
+        if not self.params['unwrap'] and not invalid_ref_channel: # re-wrap phase to +/-180 degrees
+            phase = (phase + 180) % 360 - 180
 
-            # apply window
-            impulse_response *= window
-
-            # calculate phase from windowed impulse response (and trim to positive frequencies)
-            wrapped_phase_rad = np.angle(fft(impulse_response)[1:len(freqs)+1])
-
-            phase_offset_deg = 0 # no group delay correction, used in the cross_correlation case
-
-            if self.params['excess_method']=='linear_phase':
-                # perform a linear regression to determine the linear phase delay over the chirp range
-                result = linregress(freqs[min_bin:max_bin], np.rad2deg(np.unwrap(wrapped_phase_rad[min_bin:max_bin]))) # regression over linear frequency scale is weighted toward high frequencies, which works well for this method
-                phase_offset_deg = -freqs*result.slope
-            
-            elif self.params['excess_method']=='min_delay':
-                # start with unwrapped phase in degrees
-                unwrapped_phase_deg = np.rad2deg(np.unwrap(wrapped_phase_rad))
-            
-                # calculate group delay from phase
-                delay = -(np.roll(unwrapped_phase_deg,-1)-np.roll(unwrapped_phase_deg,1))/(360*freqs[1])
-
-                # get group delay on a log frequency scale (otherwise min calculation will be overly influenced by noisy high frequencies)
-                log_freqs = freq_points(freqs[min_bin], freqs[max_bin], round(96*np.log2(clp.project['stop_freq']/clp.project['start_freq']))) # 96 points per octave
-                log_delay = interpolate(freqs, delay, log_freqs)
-
-                # get an estimate of the minimum group delay
-                min_delay = np.percentile(log_delay,10) # 10th percentile helps reject noisy spikes that are not fully smoothed by IR windowing, also still reasonably acccurate for most electrical/purely digital measurements where minimum delay is at max frequency
-
-                # calculate phase offsets
-                phase_offset_deg = min_delay * freqs * 360
-
-            # calculate phase and apply offset
-            phase = np.rad2deg(np.unwrap(wrapped_phase_rad))
-            phase += phase_offset_deg
-            
-            if not self.params['unwrap']: # phase offset is continuous, need to re-wrap phase
-                phase = (phase + 180) % 360 - 180
-        
-        else: # phase relative to a loopback reference channel
-            if self.params['ref_channel'] > clp.IO['input']['channels'] or self.params['ref_channel'] == clp.project['input']['channel']:
-                # selected reference channel is not valid, return all -1
-                phase = np.ones(len(freqs)) * -1
-                if self.params['output']['unit']=='radians':
-                    phase = np.rad2deg(phase) # make output also return -1 radians
-
-            else: # calculate phase relative to reference channel
-                # align and trim reference channel from raw response (same process as CLAnalysis.read_response())
-                # get the input channel and the reference channel
-                if 'raw_response' not in clp.signals:
-                    response = np.zeros(len(clp.signals['stimulus']))
-                    reference = np.zeros(len(clp.signals['stimulus']))
-                else:
-                    response = clp.signals['raw_response'][:,clp.project['input']['channel']-1]
-                    reference = clp.signals['raw_response'][:,self.params['ref_channel']-1]
-
-                # resample input if necessary
-                if clp.project['sample_rate'] != clp.IO['input']['sample_rate'] and clp.IO['input']['sample_rate'] != 0:
-                    if clp.project['use_input_rate']:
-                        clp.project['sample_rate'] = clp.IO['input']['sample_rate']
-                    else:
-                        response = resample(response, clp.IO['input']['sample_rate'], clp.project['sample_rate'])
-                        reference = resample(reference, clp.IO['input']['sample_rate'], clp.project['sample_rate'])
-                    
-                # determine the position of the captured chirp in the response signal
-                response_delay = clp.IO['input']['delay']
-                
-                # pad the response if the beginning or end of the chirp is cut off or there isn't enough silence for pre/post sweep (or there is a severe mismatch between stimulus and response). Throw a warning?
-                start_padding = max(0, -response_delay) # response_delay should be negative if beginning is cut off
-                response_delay = response_delay + start_padding
-                end_padding = max(0, len(clp.signals['stimulus']) - (len(response) - response_delay))
-                response = np.concatenate([np.zeros(start_padding),
-                                        response,
-                                        np.zeros(end_padding)])
-                reference = np.concatenate([np.zeros(start_padding),
-                                        reference,
-                                        np.zeros(end_padding)])
-                
-                # trim the raw response to just the segment aligned with the stimulus
-                response = response[response_delay:response_delay + len(clp.signals['stimulus'])] # get only the part of the raw response signal where the chirp was detected
-                reference = reference[response_delay:response_delay + len(clp.signals['stimulus'])]
-
-                # find and keep track of the gross offset between the signals
-                reference_delay = find_offset(response, reference)
-
-                # align response against reference
-                response = np.roll(response, -reference_delay)
-                # zero out any portion that wrapped around (in case of very long delays outside of expected pre/post sweep)
-                if reference_delay>0:
-                    response[:reference_delay] = np.zeros(reference_delay)
-                elif reference_delay<0:
-                    response[reference_delay:] = np.zeros(-reference_delay)
-
-                # calculate the impulse response between the input channel and reference channel
-                impulse_response = ifft(fft(response) / fft(reference))
-
-                # apply window to impulse response
-                impulse_response *= window
-
-                # calculate phase from windowed impulse response (and trim to positive frequencies)
-                wrapped_phase_rad = np.angle(fft(impulse_response)[1:len(freqs)+1])
-
-                # unwrap and convert to degrees
-                if self.params['unwrap']:
-                    phase = np.rad2deg(np.unwrap(wrapped_phase_rad))
-                else:
-                    phase = np.rad2deg(wrapped_phase_rad)
-
-                # add gross delay to phase result
-                phase -= freqs * (reference_delay / clp.project['sample_rate']) * 360
-
-                # wrap phase again after adding gross delay
-                if not self.params['unwrap']:
-                    phase = (phase + 180) % - 180
-
-        if self.params['auto_invert']:
+        if self.params['auto_invert'] and not invalid_ref_channel:
             if abs(phase[min_bin] - 180) < 90:
-                phase -= 180
+                phase = phase - 180 # not in-place, phase may be a cached array shared with other measurements
             elif abs(phase[min_bin] + 180) < 90:
-                phase += 180
+                phase = phase + 180
 
             
 
         # generate array of output frequency points
-        self.out_freqs = freq_points(self.params['output']['min_freq'], 
-                                     self.params['output']['max_freq'],
-                                     self.params['output']['num_points'],
-                                     self.params['output']['spacing'],
-                                     self.params['output']['round_points'])
+        self.out_freqs = self.output_freqs(quality)
         
         # interpolate output points
         self.out_points = interpolate(freqs, phase, self.out_freqs, self.params['output']['spacing']=='linear')
         
         # convert output to desired units
-        if self.params['output']['unit'] == 'radians':
+        if self.params['output']['unit'] == 'radians' and not invalid_ref_channel: # invalid reference channel outputs -1 in any unit
             self.out_points = np.deg2rad(self.out_points)
         
         
         
     def init_tab(self):
+        from CLGui import CLParamDropdown, FreqPointsParams, CLParamCheckBox
+        
         super().init_tab()
 
         # timing mode dropdown
@@ -219,8 +206,7 @@ class PhaseResponse(CLMeasurement):
                 self.params['mode'] = 'excess'
             self.excess_method.dropdown.setEnabled(not index)
             self.ref_channel.dropdown.setEnabled(bool(index))
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.mode.update_callback = update_mode
 
         # excess phase calculation method dropdown
@@ -238,8 +224,7 @@ class PhaseResponse(CLMeasurement):
                 self.params['excess_method'] = 'linear_phase'
             if index==2:
                 self.params['excess_method'] = 'cross_correlation'
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.excess_method.update_callback = update_excess_method
 
         # relative phase reference channel dropdown
@@ -255,8 +240,7 @@ class PhaseResponse(CLMeasurement):
                 self.ref_channel.dropdown.setStyleSheet('')
 
             if self.params['mode'] == 'relative':
-                self.measure()
-                self.plot()
+                self.remeasure()
         self.ref_channel.update_callback = update_ref_channel
         def update_num_channels(num_channels):
             channel_list = [str(chan) for chan in range(1, num_channels+1)]
@@ -282,8 +266,7 @@ class PhaseResponse(CLMeasurement):
         self.param_section.addWidget(self.unwrap)
         def update_unwrap(checked):
             self.params['unwrap'] = checked
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.unwrap.update_callback = update_unwrap
 
         # auto invert checkbox
@@ -292,8 +275,7 @@ class PhaseResponse(CLMeasurement):
         self.param_section.addWidget(self.auto_invert)
         def update_auto_invert(checked):
             self.params['auto_invert'] = checked
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.auto_invert.update_callback = update_auto_invert
 
 
@@ -304,16 +286,14 @@ class PhaseResponse(CLMeasurement):
         self.output_section.addWidget(self.output_unit)
         def update_output_unit(index):
             self.params['output']['unit'] = self.OUTPUT_UNITS[index]
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_unit.update_callback = update_output_unit
         
         self.output_points = FreqPointsParams(self.params['output'])
         self.output_section.addWidget(self.output_points)
         def update_output_points():
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_points.update_callback = update_output_points
         self.output_points.calc_min_auto = self.calc_auto_min_freq
@@ -324,6 +304,18 @@ class PhaseResponse(CLMeasurement):
         self.update_num_channels(clp.IO['input']['channels'])
         self.output_points.update_min_max()
         
+    def intermediates(self):
+        # excess phase is calculated from the raw impulse response, relative phase from the aligned input channels
+        if self.params['mode'] == 'excess':
+            return [('raw_ir',)]
+        return []
+
+    def calc_max_harmonic(self):
+        # relative mode reads the reference channel directly from the raw input at the full analysis sample rate
+        if self.params['mode'] == 'relative':
+            return np.inf
+        return 1
+
     def calc_auto_min_freq(self):
         return clp.project['start_freq']
     
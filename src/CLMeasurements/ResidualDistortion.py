@@ -1,11 +1,7 @@
 import CLProject as clp
-from CLAnalysis import chirp_time_to_freq, freq_points, interpolate, FS_to_unit, fftconv, max_in_intervals
-from CLGui import CLParamNum, CLParamDropdown, FreqPointsParams
+from CLAnalysis import chirp_time_to_freq, interpolate, FS_to_unit, fftconv, max_in_intervals, raw_impulse_response, hann
 import numpy as np
 from CLMeasurements import CLMeasurement, FrequencyResponse
-import pandas as pd
-from scipy.fftpack import fft, ifft
-from scipy.signal.windows import hann
 from CLMeasurements.HarmonicDistortion import harmonic_impulse_time
 
 # method for measuring distortion in the time domain, roughly equivalent to Klippel methods https://www.klippel.de/fileadmin/klippel/Files/Know_How/Literature/Papers/Measurement_of_Rub_and_Buzz_03.pdf
@@ -57,23 +53,18 @@ class ResidualDistortion(CLMeasurement):
             self.params['output']['max_freq'] = self.calc_auto_max_freq()
 
             
-    def measure(self):
+    def measure(self, quality='full'):
         # calculate the instantaneous chirp frequency at each sample of the response
         chirp_start_sample = round(clp.project['pre_sweep']*clp.project['sample_rate']) # calculate the exact time of the first chirp sample. todo: check if this is off by 1 sample
         response_times = (np.arange(len(clp.signals['response'])) - chirp_start_sample) / clp.project['sample_rate']
         response_freqs = chirp_time_to_freq(clp.project['start_freq'], clp.project['stop_freq'], clp.project['chirp_length'], response_times)
 
         # generate array of output frequency points
-        self.out_freqs = freq_points(self.params['output']['min_freq'], 
-                                     self.params['output']['max_freq'],
-                                     self.params['output']['num_points'],
-                                     self.params['output']['spacing'],
-                                     self.params['output']['round_points'])
+        self.out_freqs = self.output_freqs(quality)
 
         # generate an idealized version of the response that includes fundamental and low-order harmonics, and subtract it from the actual response
-        def calc_residual(response):
-            # calculate raw impulse response
-            impulse_response = ifft(fft(response) / fft(clp.signals['stimulus']))
+        def calc_residual(response, impulse_response):
+            # impulse_response is the raw impulse response of the response signal
 
             # generate window for fundamental and harmonic range, drawing from FrequencyResponse and HarmonicDistortion methods
             # generate window using adaptive FrequencyResponse method for lowest frequency
@@ -119,9 +110,11 @@ class ResidualDistortion(CLMeasurement):
 
             return residual
 
-        residual = calc_residual(clp.signals['response'])
+        # raw impulse responses of the response and noise sample (shared with other measurements)
+        impulse_responses = raw_impulse_response()
+        residual = calc_residual(clp.signals['response'], impulse_responses[0])
         if any(clp.signals['noise']):
-            noise_residual = calc_residual(clp.signals['noise'])
+            noise_residual = calc_residual(clp.signals['noise'], impulse_responses[1])
 
         if self.params['mode'] != 'rms': # peak levels used for 'peak' and 'crestfactor' modes
             # instantaneous peak level of the residual distortion
@@ -138,6 +131,7 @@ class ResidualDistortion(CLMeasurement):
 
         if self.params['mode'] != 'peak': # rms levels used for 'rms' and 'crestfactor' modes
             # calculate moving RMS
+            import pandas as pd # pandas is slow to import, only load it when it's used
             residual_rms = np.sqrt(pd.DataFrame(residual*residual).rolling(rms_samples, center=True, min_periods=1).mean())
 
             # interpolate residual_level at self.out_freqs
@@ -162,13 +156,9 @@ class ResidualDistortion(CLMeasurement):
 
         # if necessary, calculate moving RMS of raw response signal
         if self.params['mode'] != 'crestfactor':
-            if self.params['output']['unit'] in ['dB', '%', '% (IEC method)']: # if peak or rms modes and output is a relative unit
-                ref_fr = FrequencyResponse('fr')
-                ref_fr.params['output'] = self.params['output'].copy()
-                ref_fr.params['output']['unit'] = 'FS'
-                ref_fr.params['output']['min_auto'] = False # shouldn't actually have any impact, but set in case of future updates
-                ref_fr.params['output']['max_auto'] = False
-                ref_fr.measure()
+            if self.uses_reference_fr(): # if peak or rms modes and output is a relative unit
+                ref_fr = self.reference_fr()
+                ref_fr.measure(quality)
                 ref_points = ref_fr.out_points
             else:
                 ref_points = None
@@ -190,6 +180,8 @@ class ResidualDistortion(CLMeasurement):
     
         
     def init_tab(self):
+        from CLGui import CLParamNum, CLParamDropdown, FreqPointsParams
+        
         super().init_tab()
 
         # dropdown to select analysis mode
@@ -228,8 +220,7 @@ class ResidualDistortion(CLMeasurement):
                     self.params['mode'] = 'peak'
                 case 2:
                     self.params['mode'] = 'crestfactor'
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.mode.update_callback = update_mode
 
         # RMS averaging time
@@ -243,8 +234,7 @@ class ResidualDistortion(CLMeasurement):
         self.param_section.addWidget(self.rms_time)
         def update_rms_time(new_val):
             self.params['rms_time'] = new_val
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.rms_time.update_callback = update_rms_time
         def update_rms_time_unit(index):
             sweep_rate = clp.project['chirp_length'] / np.log2(clp.project['stop_freq'] / clp.project['start_freq'])
@@ -277,8 +267,7 @@ class ResidualDistortion(CLMeasurement):
             self.params['max_harmonic'] = new_val
             self.output_points.update_min_max()
             self.harmonic_range.unit.setText(harmonic_suffix(new_val))
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.harmonic_range.update_callback = update_harmonic_range
 
 
@@ -293,16 +282,14 @@ class ResidualDistortion(CLMeasurement):
         self.output_section.addWidget(self.output_unit)
         def update_output_unit(index):
             self.params['output']['unit'] = self.output_unit.dropdown.currentText()
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_unit.update_callback = update_output_unit
         
         self.output_points = FreqPointsParams(self.params['output'])
         self.output_section.addWidget(self.output_points)
         def update_output_points():
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_points.update_callback = update_output_points
         self.output_points.calc_min_auto = self.calc_auto_min_freq
@@ -312,6 +299,27 @@ class ResidualDistortion(CLMeasurement):
     def update_tab(self):
         self.output_points.update_min_max()
     
+    def uses_reference_fr(self):
+        return self.params['mode'] != 'crestfactor' and self.params['output']['unit'] in ['dB', '%', '% (IEC method)']
+
+    def reference_fr(self):
+        # fundamental frequency response at the output points, used as the reference for relative output units
+        ref_fr = FrequencyResponse('fr')
+        ref_fr.params['output'] = self.params['output'].copy()
+        ref_fr.params['output']['unit'] = 'FS'
+        ref_fr.params['output']['min_auto'] = False # shouldn't actually have any impact, but set in case of future updates
+        ref_fr.params['output']['max_auto'] = False
+        return ref_fr
+
+    def intermediates(self):
+        if self.uses_reference_fr():
+            return [('raw_ir',)] + self.reference_fr().intermediates()
+        return [('raw_ir',)]
+
+    def calc_max_harmonic(self):
+        # residual includes everything above max_harmonic, up to Nyquist
+        return np.inf
+
     def calc_auto_min_freq(self):
         return clp.project['start_freq']
     
@@ -1,11 +1,8 @@
 import CLProject as clp
-from CLAnalysis import chirp_time_to_freq, freq_points, interpolate, FS_to_unit, max_in_intervals
-from CLGui import CLParamNum, CLParamDropdown, FreqPointsParams, QCollapsible, QHSeparator, undo_stack
+from CLAnalysis import chirp_time_to_freq, interpolate, FS_to_unit, max_in_intervals, analysis_intermediate
 import numpy as np
 from CLMeasurements import CLMeasurement
 from Biquad import Biquad, lowpass_coeff, highpass_coeff, bandpass_coeff, notch_coeff
-import pandas as pd
-from qtpy.QtWidgets import QFrame, QVBoxLayout, QAbstractSpinBox, QPushButton
 
 # tracking filter implementation to perform measurements roughly equivalent to Audio Precision's Rub and Buzz Peak Ratio and Crest Factor. https://www.ap.com/fileadmin-ap/technical-library/appnote-rub-buzz.pdf
 # for a Peak Ratio-style measurement, apply a highpass filter at 5-30x the fundamental and measure the 'filtered peak' signal relative to the 'fundamental RS' or 'unfiltered RMS' signal
@@ -68,69 +65,22 @@ class TrackingFilter(CLMeasurement):
             self.params['output']['max_freq'] = self.calc_auto_max_freq()
 
             
-    def measure(self):
+    def measure(self, quality='full'):
         # calculate the instantaneous chirp frequency at each sample of the response
         chirp_start_sample = round(clp.project['pre_sweep']*clp.project['sample_rate']) # calculate the exact time of the first chirp sample. todo: check if this is off by 1 sample
         response_times = (np.arange(len(clp.signals['response'])) - chirp_start_sample) / clp.project['sample_rate']
         response_freqs = chirp_time_to_freq(clp.project['start_freq'], clp.project['stop_freq'], clp.project['chirp_length'], response_times)
 
         # generate array of output frequency points
-        self.out_freqs = freq_points(self.params['output']['min_freq'], 
-                                     self.params['output']['max_freq'],
-                                     self.params['output']['num_points'],
-                                     self.params['output']['spacing'],
-                                     self.params['output']['round_points'])
-
-        def calc_tracking_filter(response, selected_signal):
-
-            def multi_filter(x, b, a):
-                # apply multiple biquad filter stages, each with coefficients that are updated for each sample of the input signal, x
-                num_filters = len(b)
-                num_samples = len(x)
-                y = x.copy()
-
-                # loop through each filter
-                for f in range(num_filters):
-                    biquad = Biquad()
-
-                    # loop through samples
-                    for n in range(num_samples):
-                        # set filter coefficients for this sample and apply filter
-                        biquad.b[0] = b[f][0][n] # there is a probably a clever slice that does this in one step, but the array outputs from Biquad.<filter>_coeff() are not in a slice-friendly shape
-                        biquad.b[1] = b[f][1][n]
-                        biquad.b[2] = b[f][2][n]
-                        biquad.a[1] = a[f][1][n]
-                        biquad.a[2] = a[f][2][n]
-                        y[n] = biquad.process(y[n])
-
-                return y
-
-            # calculate filter coefficients for each filter and sample, and filter response signals
-            if selected_signal == 'fundamental RMS':
-                fund_b = [[]]
-                fund_a = [[]]
-                fund_b[0], fund_a[0] = bandpass_coeff(response_freqs, 10, clp.project['sample_rate'])
-                response = multi_filter(response, fund_b, fund_a)
-            
-            if selected_signal=='filtered peak' or selected_signal=='filtered RMS':
-                num_filters = len(self.params['filters'])
-                filt_b = [[]] * num_filters
-                filt_a = [[]] * num_filters
-                for i in range(num_filters):
-                    filt_freqs = np.minimum(0.95 * clp.project['sample_rate'] / 2, response_freqs * self.params['filters'][i]['multiplier'])
-                    match self.params['filters'][i]['type']:
-                        case 'lowpass':
-                            filt_b[i], filt_a[i] = lowpass_coeff(filt_freqs, self.params['filters'][i]['Q'], clp.project['sample_rate'])
-                        case 'highpass':
-                            filt_b[i], filt_a[i] = highpass_coeff(filt_freqs, self.params['filters'][i]['Q'], clp.project['sample_rate'])
-                        case 'bandpass':
-                            filt_b[i], filt_a[i] = bandpass_coeff(filt_freqs, self.params['filters'][i]['Q'], clp.project['sample_rate'])
-                        case 'notch':
-                            filt_b[i], filt_a[i] = notch_coeff(filt_freqs, self.params['filters'][i]['Q'], clp.project['sample_rate'])
-                
-                response = multi_filter(response, filt_b, filt_a)
-
-            # else 'unfiltered RMS': don't apply a filter
+        self.out_freqs = self.output_freqs(quality)
+
+        def calc_tracking_filter(signal_name, selected_signal):
+            # get response signal with the filters for the selected signal applied (shared with other tracking filter measurements using the same filters)
+            filter_chain = self.filter_chain(selected_signal)
+            if filter_chain is None: # 'unfiltered RMS': don't apply a filter
+                response = clp.signals[signal_name]
+            else:
+                response = tracking_filtered_signal(signal_name, filter_chain)
 
             if selected_signal == 'filtered peak':
                 # instantaneous peak level of filtered response
@@ -145,6 +95,7 @@ class TrackingFilter(CLMeasurement):
                 rms_samples = round(rms_time * clp.project['sample_rate'])
 
                 # calculate moving RMS
+                import pandas as pd # pandas is slow to import, only load it when it's used
                 signal_level = np.sqrt(pd.DataFrame(response*response).rolling(rms_samples, center=True, min_periods=1).mean())
 
                 # interpolate signal_level at self.out_freqs
@@ -165,10 +116,10 @@ class TrackingFilter(CLMeasurement):
                 case _:
                     return FS_to_unit(fs_points, self.params['output']['unit'])
 
-        # todo: a lot of opportunity to optimize, avoid applying the same filters multiple times
-        measured_level = calc_tracking_filter(clp.signals['response'], self.params['measured_signal'])
+        # filtered signals are calculated once per analysis and shared between measured and reference signals and other measurements
+        measured_level = calc_tracking_filter('response', self.params['measured_signal'])
         if any(clp.signals['noise']):
-            measured_noise = calc_tracking_filter(clp.signals['noise'], self.params['measured_signal'])
+            measured_noise = calc_tracking_filter('noise', self.params['measured_signal'])
         
         if self.params['mode'] == 'absolute':
             self.out_points = convert_output_units(measured_level)
@@ -176,13 +127,17 @@ class TrackingFilter(CLMeasurement):
                 self.out_noise = convert_output_units(measured_noise)
             return
 
-        ref_level = calc_tracking_filter(clp.signals['response'], self.params['reference_signal'])
+        ref_level = calc_tracking_filter('response', self.params['reference_signal'])
         self.out_points = convert_output_units(measured_level, ref_level)
         if any(clp.signals['noise']):
             self.out_noise = convert_output_units(measured_noise, ref_level)
     
         
     def init_tab(self):
+        from CLGui import CLParamNum, CLParamDropdown, FreqPointsParams, QCollapsible, undo_stack
+        from CLGui.MeasurementWidgets import FilterParams
+        from qtpy.QtWidgets import QPushButton
+        
         super().init_tab()
 
         # dropdown to select measured signal
@@ -192,8 +147,7 @@ class TrackingFilter(CLMeasurement):
         self.param_section.addWidget(self.measured_signal)
         def update_measured_signal(index):
             self.params['measured_signal'] = self.SIGNALS[index]
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.measured_signal.update_callback = update_measured_signal
 
         # dropdown to select relative or absolute mode
@@ -223,8 +177,7 @@ class TrackingFilter(CLMeasurement):
         self.param_section.addWidget(self.reference_signal)
         def update_reference_signal(index):
             self.params['reference_signal'] = self.SIGNALS[index]
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.reference_signal.update_callback = update_reference_signal
 
         # RMS averaging time
@@ -238,8 +191,7 @@ class TrackingFilter(CLMeasurement):
         self.param_section.addWidget(self.rms_time)
         def update_rms_time(new_val):
             self.params['rms_time'] = new_val
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.rms_time.update_callback = update_rms_time
         def update_rms_time_unit(index):
             sweep_rate = clp.project['chirp_length'] / np.log2(clp.project['stop_freq'] / clp.project['start_freq'])
@@ -275,8 +227,7 @@ class TrackingFilter(CLMeasurement):
                 self.params['filters'].pop()
                 if len(self.params['filters']) == 1: # always leave at least one filter
                     self.filters_section.removeWidget(self.remove_filter_button)
-                self.measure()
-                self.plot()
+                self.remeasure()
         self.remove_filter_button.clicked.connect(remove_filter)
         if len(self.params['filters']) > 1:
             self.filters_section.addWidget(self.remove_filter_button)
@@ -298,8 +249,7 @@ class TrackingFilter(CLMeasurement):
             self.filters_section.addWidget(self.filters_params[-1])
             self.filters_section.addWidget(self.remove_filter_button)
             self.filters_section.addWidget(self.add_filter_button)
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.add_filter_button.clicked.connect(add_filter)
 
 
@@ -314,16 +264,14 @@ class TrackingFilter(CLMeasurement):
         self.output_section.addWidget(self.output_unit)
         def update_output_unit(index):
             self.params['output']['unit'] = self.output_unit.dropdown.currentText()
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_unit.update_callback = update_output_unit
         
         self.output_points = FreqPointsParams(self.params['output'])
         self.output_section.addWidget(self.output_points)
         def update_output_points():
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_points.update_callback = update_output_points
         self.output_points.calc_min_auto = self.calc_auto_min_freq
@@ -333,6 +281,34 @@ class TrackingFilter(CLMeasurement):
     def update_tab(self):
         self.output_points.update_min_max()
     
+    def filter_chain(self, selected_signal):
+        # filters applied to the response for the selected signal, as used by tracking_filtered_signal(). None if the signal is unfiltered
+        match selected_signal:
+            case 'fundamental RMS':
+                return 'fundamental'
+            case 'filtered peak' | 'filtered RMS':
+                return tuple((filt['type'], filt['multiplier'], filt['Q']) for filt in self.params['filters'])
+        return None
+
+    def intermediates(self):
+        selected_signals = [self.params['measured_signal']]
+        if self.params['mode'] != 'absolute':
+            selected_signals.append(self.params['reference_signal'])
+
+        filtered_signals = []
+        for selected_signal in selected_signals:
+            filter_chain = self.filter_chain(selected_signal)
+            if filter_chain is not None:
+                filtered_signals.append(('filtered_signal', 'response', filter_chain))
+        filter_chain = self.filter_chain(self.params['measured_signal']) # noise sample is only used for the measured signal
+        if filter_chain is not None and any(clp.signals['noise']):
+            filtered_signals.append(('filtered_signal', 'noise', filter_chain))
+        return filtered_signals
+
+    def calc_max_harmonic(self):
+        # unfiltered RMS and highpass filters include everything up to Nyquist
+        return np.inf
+
     def calc_auto_min_freq(self):
         return clp.project['start_freq']
     
@@ -340,42 +316,63 @@ class TrackingFilter(CLMeasurement):
         # todo: make this function smarter. Does it make sense to just divide stop_freq by max filter frequency multiplier?
         return clp.project['stop_freq']
 
-class FilterParams(QFrame):
-    # pass in the parameters dict for the filter so they can be updated, and the parent TrackingFilter to make it easy to call measure() and plot()
-    def __init__(self, params, measurement, add_separator=True):
-        super().__init__()
 
-        self.params = params
 
-        layout = QVBoxLayout(self)
+def multi_filter(x, b, a):
+    # apply multiple biquad filter stages, each with coefficients that are updated for each sample of the input signal, x
+    num_filters = len(b)
+    num_samples = len(x)
+    y = x.copy()
+
+    # loop through each filter
+    for f in range(num_filters):
+        biquad = Biquad()
 
-        if add_separator:
-            layout.addWidget(QHSeparator())
+        # loop through samples
+        for n in range(num_samples):
+            # set filter coefficients for this sample and apply filter
+            biquad.b[0] = b[f][0][n] # there is a probably a clever slice that does this in one step, but the array outputs from Biquad.<filter>_coeff() are not in a slice-friendly shape
+            biquad.b[1] = b[f][1][n]
+            biquad.b[2] = b[f][2][n]
+            biquad.a[1] = a[f][1][n]
+            biquad.a[2] = a[f][2][n]
+            y[n] = biquad.process(y[n])
+
+    return y
+
+def tracking_filtered_signal(signal_name, filter_chain):
+    # clp.signals[signal_name] ('response' or 'noise') filtered by a chain of filters that track the instantaneous chirp frequency
+    # filter_chain is 'fundamental' for a Q=10 bandpass at 1x the chirp frequency, or a tuple of (type, multiplier, Q) for each filter in the chain
+    # filtering is slow, so the result is shared by all signals and tracking filter measurements in an analysis that use the same filters
+    def calc_filtered_signal():
+        response = clp.signals[signal_name]
+
+        # calculate the instantaneous chirp frequency at each sample of the response
+        chirp_start_sample = round(clp.project['pre_sweep']*clp.project['sample_rate'])
+        response_times = (np.arange(len(response)) - chirp_start_sample) / clp.project['sample_rate']
+        response_freqs = chirp_time_to_freq(clp.project['start_freq'], clp.project['stop_freq'], clp.project['chirp_length'], response_times)
 
-        self.type = CLParamDropdown('Filter type', measurement.FILTER_TYPES)
-        type_index = self.type.dropdown.findText(self.params['type'])
-        self.type.dropdown.setCurrentIndex(type_index)
-        layout.addWidget(self.type)
-        def update_type(index):
-            self.params['type'] = measurement.FILTER_TYPES[index]
-            measurement.measure()
-            measurement.plot()
-        self.type.update_callback = update_type
+        # calculate filter coefficients for each filter and sample, and filter response signal
+        if filter_chain == 'fundamental':
+            fund_b = [[]]
+            fund_a = [[]]
+            fund_b[0], fund_a[0] = bandpass_coeff(response_freqs, 10, clp.project['sample_rate'])
+            return multi_filter(response, fund_b, fund_a)
+
+        num_filters = len(filter_chain)
+        filt_b = [[]] * num_filters
+        filt_a = [[]] * num_filters
+        for i, (filter_type, multiplier, Q) in enumerate(filter_chain):
+            filt_freqs = np.minimum(0.95 * clp.project['sample_rate'] / 2, response_freqs * multiplier)
+            match filter_type:
+                case 'lowpass':
+                    filt_b[i], filt_a[i] = lowpass_coeff(filt_freqs, Q, clp.project['sample_rate'])
+                case 'highpass':
+                    filt_b[i], filt_a[i] = highpass_coeff(filt_freqs, Q, clp.project['sample_rate'])
+                case 'bandpass':
+                    filt_b[i], filt_a[i] = bandpass_coeff(filt_freqs, Q, clp.project['sample_rate'])
+                case 'notch':
+                    filt_b[i], filt_a[i] = notch_coeff(filt_freqs, Q, clp.project['sample_rate'])
         
-        self.multiplier = CLParamNum('Frequency', self.params['multiplier'], 'x chirp fundamental', 0.01)
-        self.multiplier.spin_box.setStepType(QAbstractSpinBox.StepType.DefaultStepType)
-        layout.addWidget(self.multiplier)
-        def update_multiplier(new_val):
-            self.params['multiplier'] = new_val
-            measurement.measure()
-            measurement.plot()
-        self.multiplier.update_callback = update_multiplier
-
-        self.Q = CLParamNum('Q', self.params['Q'], '', 0.1)
-        self.Q.spin_box.setDecimals(3)
-        layout.addWidget(self.Q)
-        def update_Q(new_val):
-            self.params['Q'] = new_val
-            measurement.measure()
-            measurement.plot()
-        self.Q.update_callback = update_Q
+        return multi_filter(response, filt_b, filt_a)
+    return analysis_intermediate(('filtered_signal', signal_name, filter_chain), calc_filtered_signal)
@@ -1,18 +1,13 @@
 import CLProject as clp
-from CLAnalysis import freq_points, interpolate, FS_to_unit
-from CLGui import CLParamDropdown, QCollapsible, CLParamNum, FreqPointsParams
-from scipy.fftpack import fft, ifft, fftfreq
-from scipy.signal.windows import hann
+from CLAnalysis import interpolate, FS_to_unit, direct_dft_is_faster, spectrum_at_freqs, raw_impulse_response, hann
+from scipy.fftpack import fft, fftfreq
 import numpy as np
-from CLMeasurements import CLMeasurement
-import pandas as pd
+from CLMeasurements import CLMeasurement, MeasurementResult
 from pathlib import Path
-import pyqtgraph as pg
 #import pyqtgraph.opengl as gl
-from CLMeasurements.FrequencyResponse import WindowParamsSection
 #from vispy import scene
 #from vispy.scene import visuals
-# matplotlib stuff at the bottom
+# matplotlib canvas is in CLGui.MeasurementWidgets
 
 # much of the Waterfall measurement is a copy of FrequencyResponse. Much of the calculations and GUI elements are the same or similar, biggest difference is the custom plot() method
 
@@ -26,6 +21,7 @@ def samples_to_ms(samples):
 
 class Waterfall(CLMeasurement):
     measurement_type_name = 'Waterfall'
+    channel_overlay = False # slices from several channels would be unreadable
     
     MAX_WINDOW_START = 10 # fixed impulse response window can start up to 10ms before t0
     MAX_WINDOW_END = 1000 # IR window can end up to 1s after t0
@@ -65,82 +61,76 @@ class Waterfall(CLMeasurement):
             self.params['output']['max_freq'] = self.calc_auto_max_freq()
             
             
-    def measure(self):
+    def measure(self, quality='full'):
         # generate array of output frequency points
-        self.out_freqs = freq_points(self.params['output']['min_freq'], 
-                                     self.params['output']['max_freq'],
-                                     self.params['output']['num_points'],
-                                     self.params['output']['spacing'],
-                                     self.params['output']['round_points'])
+        self.out_freqs = self.output_freqs(quality)
         
-        # calculate raw impulse response
-        ir = ifft(fft(clp.signals['response']) / fft(clp.signals['stimulus']))
+        # get raw impulse response, along with the noise IR if a noise sample is available (shared with other measurements)
+        irs = raw_impulse_response()
+        ir = irs[0]
 
         # calculate fft frequencies
         fr_freqs = fftfreq(len(clp.signals['stimulus']), 1/clp.project['sample_rate'])
         # trim to only positive frequencies
         fr_freqs = fr_freqs[1:int(len(fr_freqs)/2)-1] # technically, removes highest point for odd-length inputs, but shouldn't be a problem
 
-        # initialize output data array
-        self.out_points = np.zeros([self.params['num_slices'], len(self.out_freqs)])
-
-        def calc_slice_fr(ir, slice_time):
-            # convert windowing times to whole samples
-            window_start = ms_to_samples(self.params['window_start'])
-            fade_in = ms_to_samples(self.params['fade_in'])
-            window_end = ms_to_samples(self.params['window_end'])
-            fade_out = ms_to_samples(self.params['fade_out'])
-            slice_offset = ms_to_samples(slice_time)
-            
-            # construct window
-            window = np.zeros(len(ir))
-            window[:fade_in] = hann(fade_in*2)[:fade_in]
-            window[fade_in:window_start+window_end-fade_out] = np.ones(window_start-fade_in+window_end-fade_out)
-            window[window_start+window_end-fade_out:window_start+window_end] = hann(fade_out*2)[fade_out:]
-            window = np.roll(window, -window_start + slice_offset)
+        # convert windowing times to whole samples
+        window_start = ms_to_samples(self.params['window_start'])
+        fade_in = ms_to_samples(self.params['fade_in'])
+        window_end = ms_to_samples(self.params['window_end'])
+        fade_out = ms_to_samples(self.params['fade_out'])
+
+        # construct window, starting window_start samples before the slice time
+        window = np.zeros(window_start+window_end)
+        window[:fade_in] = hann(fade_in*2)[:fade_in]
+        window[fade_in:window_start+window_end-fade_out] = np.ones(window_start-fade_in+window_end-fade_out)
+        window[window_start+window_end-fade_out:] = hann(fade_out*2)[fade_out:]
+
+        def calc_slice_fr(ir, slice_times):
+            # sample indices of the windowed segment of the impulse response for each time slice (one slice per row)
+            slice_offsets = np.array([ms_to_samples(slice_time) for slice_time in slice_times])
+            slice_indices = (np.arange(-window_start, window_end) + slice_offsets[:, np.newaxis]) % len(ir)
+
+            if direct_dft_is_faster(len(window), len(self.out_freqs), len(ir)):
+                # windows are short compared to the full impulse response, evaluate all slice spectrums directly at the output points in one pass
+                return np.abs(spectrum_at_freqs(ir[slice_indices] * window, self.out_freqs, clp.project['sample_rate']))
+
+            slice_points = np.zeros([len(slice_times), len(self.out_freqs)])
+            for i in range(len(slice_times)):
+                # convert windowed impusle response back to frequency response (zero padded to full length)
+                fr = fft(ir[slice_indices[i]] * window, len(ir))
             
-            # apply window to impulse response
-            ir = ir * window
-            
-            # convert windowed impusle response back to frequency response to use for data output
-            fr = fft(ir)
-        
-            # trim to positive half of spectrum for interpolation
-            fr = fr[1:int(len(fr)/2)-1]
-            
-            # take magnitude of complex frequency response
-            fr = np.abs(fr)
+                # trim to positive half of spectrum for interpolation
+                fr = fr[1:int(len(fr)/2)-1]
+                
+                # take magnitude of complex frequency response
+                fr = np.abs(fr)
+
+                # interpolate output points
+                slice_points[i,:] = interpolate(fr_freqs, fr, self.out_freqs, self.params['output']['spacing']=='linear') # todo: still may not be correct. Verify behavior for linear/log frequency scale *and* linear/log output units
 
-            return fr
+            return slice_points
 
         # generate array of time slices to analyze
         self.out_times = np.linspace(self.params['start_time'], self.params['end_time'], self.params['num_slices'])
 
-        # loop through time slices
-        for i in range(self.params['num_slices']):
-            fr = calc_slice_fr(ir, self.out_times[i])
-        
-            # interpolate output points
-            slice_points = interpolate(fr_freqs, fr, self.out_freqs, self.params['output']['spacing']=='linear') # todo: still may not be correct. Verify behavior for linear/log frequency scale *and* linear/log output units
-            
-            # convert output to desired units
-            slice_points = FS_to_unit(slice_points, self.params['output']['unit'])
-
-            # store in output array
-            self.out_points[i,:] = slice_points
+        # calculate all time slices and convert output to desired units
+        self.out_points = FS_to_unit(calc_slice_fr(ir, self.out_times), self.params['output']['unit'])
         
         
         # check for noise sample and calculate noise floor
-        if any(clp.signals['noise']):
-            noise_ir = ifft(fft(clp.signals['noise']) / fft(clp.signals['stimulus']))
-            noise_fr = calc_slice_fr(noise_ir, 0)
-            self.out_noise = interpolate(fr_freqs, noise_fr, self.out_freqs, self.params['output']['spacing']=='linear')
-            self.out_noise = FS_to_unit(self.out_noise, self.params['output']['unit'])
+        if len(irs) > 1:
+            self.out_noise = FS_to_unit(calc_slice_fr(irs[1], [0])[0], self.params['output']['unit'])
         else:
             self.out_noise = np.zeros(0)
 
 
+    def get_result(self):
+        # y is a 2D array with one row of frequency response points per slice, slice times in ms are included in extra
+        return MeasurementResult(self.params['name'], type(self).__name__, self.params['output']['unit'], self.out_freqs, self.out_points, self.out_noise, extra={'times': self.out_times})
+
     def save_measurement_data(self, out_path=''):
+        import pandas as pd # pandas is slow to import, only load it when it's used
         out_frame = pd.DataFrame(data=self.out_points.transpose(), columns=[str(slice_time)+'ms' for slice_time in self.out_times])
         out_frame.insert(0, 'Frequency (Hz)', self.out_freqs)
         if clp.project['save_noise'] and any(self.out_noise):
@@ -163,6 +153,9 @@ class Waterfall(CLMeasurement):
 
         
     def init_tab(self):
+        from CLGui import CLParamDropdown, CLParamNum, FreqPointsParams
+        from CLGui.MeasurementWidgets import WindowParamsSection, MplCanvas
+        
         super().init_tab()
 
         # plot 3D by default. Need to replace 2D plot with 3D plot
@@ -194,8 +187,7 @@ class Waterfall(CLMeasurement):
             else:
                 self.params['start_time'] = new_val
             update_slice_period()
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.start_time.update_callback = update_start_time
         def update_start_time_units(index):
             if index:
@@ -217,8 +209,7 @@ class Waterfall(CLMeasurement):
             else:
                 self.params['end_time'] = new_val
             update_slice_period()
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.end_time.update_callback = update_end_time
         def update_end_time_units(index):
             if index:
@@ -237,8 +228,7 @@ class Waterfall(CLMeasurement):
         def update_num_slices(new_val):
             self.params['num_slices'] = new_val
             update_slice_period()
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.num_slices.update_callback = update_num_slices
 
         self.slice_period = CLParamNum('Slice time interval', 0, 'ms')
@@ -251,8 +241,7 @@ class Waterfall(CLMeasurement):
         self.window_params = WindowParamsSection(self.params)
         self.param_section.addWidget(self.window_params)
         def update_window_params():
-            self.measure()
-            self.plot()
+            self.remeasure()
         self.window_params.update_callback = update_window_params
 
 
@@ -263,16 +252,14 @@ class Waterfall(CLMeasurement):
         self.output_section.addWidget(self.output_unit)
         def update_output_unit(index):
             self.params['output']['unit'] = self.OUTPUT_UNITS[index]
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_unit.update_callback = update_output_unit
         
         self.output_points = FreqPointsParams(self.params['output'])
         self.output_section.addWidget(self.output_points)
         def update_output_points():
-            self.measure()
-            self.plot()
+            self.remeasure()
             self.format_graph()
         self.output_points.update_callback = update_output_points
         self.output_points.calc_min_auto = self.calc_auto_min_freq
@@ -292,6 +279,8 @@ class Waterfall(CLMeasurement):
         return min(clp.project['stop_freq'], (clp.project['sample_rate']/2) * 0.9)
 
     def plot(self):
+        import pyqtgraph as pg
+        
         # matplotlib 3D plotting
         for artist in self.tab.graph.axes.collections:
             artist.remove()
@@ -340,6 +329,9 @@ class Waterfall(CLMeasurement):
             self.tab.graph.plot(self.out_freqs, self.out_noise, name='Noise Floor', pen=noise_pen)
             
     def format_graph(self):
+        import matplotlib.ticker as mticker
+        from CLGui.MeasurementWidgets import log_tick_formatter
+        
         # graph formatting for matplotlib 3D plot
         #self.tab.graph_toolbar = NavigationToolbar(self.tab.graph) # todo: doesn't actually work. Default mouse controls for 3D plots is mostly fine, but it would be nice to be able to pan/zoom a single axis at a time
         self.tab.graph.axes.yaxis.set_inverted(True)
@@ -381,45 +373,3 @@ def hex2float(hex_color, alpha=1.0):
     b = int(hex_color[4:6], 16) / 255
 
     return (r, g, b, alpha)
-
-
-
-import matplotlib.ticker as mticker
-from engineering_notation import EngNumber
-def log_tick_formatter(val, pos=None):
-    return EngNumber(10**val)
-
-# matplotlib stuff, mostly copied from pythonguis.com
-# this was originally in CLTab.py but removed as part of the switch from mpl to pyqtgraph. Maybe put it back in CLTab for other measurements that need a 3D plot
-# speed stuff mostly helps when plotting time series signals (like on the ChirpTab), probably doesn't make much of a difference for relatively sparse surface plots
-import matplotlib
-matplotlib.use('QtAgg') # 'Qt5Agg' is only use for backwards compatibility to force Qt5
-
-#matplotlib speed settings
-#matplotlib.style.use('default') # settings are persistent in Spyder. use('default') to reset
-# agg.path.chunksize = 0
-# path.simplify = True
-# path.simplify_threshold = 1/9
-
-#matplotlib.style.use('fast') # fast, but sometimes leaves holes in stimulus/response plots. Equivalent to:
-matplotlib.rcParams['agg.path.chunksize'] = 10000
-matplotlib.rcParams['path.simplify'] = True
-matplotlib.rcParams['path.simplify_threshold'] = 1.0
-
-matplotlib.rcParams["figure.autolayout"] = True # default to tight_layout
-
-# chunksize and simplify_threshold have some interdependency. Increasing one or the other is fine, marginally improves performance. Increasing both improves performance more but introduces artefacts.
-#matplotlib.rcParams['agg.path.chunksize'] = 100
-#matplotlib.rcParams['path.simplify'] = True
-#matplotlib.rcParams['path.simplify_threshold'] = 1.0
-
-from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg, NavigationToolbar2QT as NavigationToolbar
-from matplotlib.figure import Figure
-
-class MplCanvas(FigureCanvasQTAgg):
-
-    def __init__(self, parent=None, width=5, height=4, dpi=100): # DPI doesn't seem to make artefacts better/worse, Qt or actual display DPI might.
-        fig = Figure(figsize=(width, height), dpi=dpi)
-        self.axes = fig.add_subplot(111, projection='3d')
-        matplotlib.rcParams['axes3d.mouserotationstyle'] = 'azel'
-        super(MplCanvas, self).__init__(fig)
@@ -1,18 +1,42 @@
 # individual measurement imports at bottom of file
+# measurements are headless: measure() and the result/output methods only need numpy/scipy/pandas. GUI modules are only imported inside the tab methods (init_tab(), plot(), format_graph()), which are called by the GUI
 import CLProject as clp
 import numpy as np
-from CLGui import CLTab, QCollapsible, QHSeparator, undo_stack
-from qtpy.QtWidgets import QLineEdit
-import pyqtgraph as pg
 from pathvalidate import is_valid_filename
 from importlib import import_module
-import pandas as pd
 from pathlib import Path
+from CLAnalysis import decimated_analysis, read_only_signals, read_only_views, plan_intermediates, release_intermediates, end_intermediates, cache_lock, freq_points, get_stimulus_artifacts, get_stimulus_cache_contents, get_channel_cache, read_response
+from concurrent.futures import ThreadPoolExecutor
+import os
+import json
+import hashlib
+from copy import copy, deepcopy
 
 
+# data-only snapshot of a measurement output, with no references back to the measurement, GUI, or project, for embedding chirplab analysis in other programs
+# x is the measurement x axis (frequency points for most measurements), y is the measurement data, noise is the measurement noise floor estimate (empty if not available)
+# extra holds any additional measurement-specific outputs, e.g. slice times for Waterfall
+class MeasurementResult():
+    def __init__(self, name, measurement_type, unit, x, y, noise, x_label='Frequency (Hz)', extra=None):
+        self.name = name
+        self.measurement_type = measurement_type
+        self.unit = unit
+        self.x_label = x_label
+        self.x = x
+        self.y = y
+        self.noise = noise
+        self.extra = {} if extra is None else extra
+
+
+# output grid for preview quality analyses (see CLMeasurement.output_freqs())
+PREVIEW_POINTS_PER_OCTAVE = 6
+PREVIEW_NUM_POINTS = 64
+
 class CLMeasurement():
     measurement_type_name = 'CLMeasurement' # override with individual measurement type. e.g. 'Frequency Response'
 
+    channel_overlay = True # plot() overlays the other input channels when clp.project['plot_all_channels'] is enabled (see plot_channels())
+
     output_types = ['Output points (*.csv)'] # used for save measurement data/graph dialog. File type dropdown will be populated with output_types, 'Graph image (*.png)', and  'All files (*)'. The GUI will save a .png of the current graph, and any other type will be passed to the measurement's save_measurement_data method.
     
     def __init__(self, name, params=None):
@@ -42,20 +66,82 @@ class CLMeasurement():
         self.out_freqs = np.zeros(0) # frequency points of most recently calculated measurement
         self.out_points = np.zeros(0) # data points of most recently calculated measurement
         self.out_noise = np.zeros(0) # data points of most recently calculated measurement noise floor estimate
+
+        # GUI state. Tabs are built the first time they are shown, and measurements on hidden tabs are refreshed after the visible one (see CLGui.AnalysisWorker)
+        self.tab = None
+        self.stale = True # outputs don't match the current signals and parameters yet
+        self.channel_outputs = {} # {channel: outputs} of every input channel when the all-channels overlay is enabled, see plot_channels()
             
-    def measure(self):
+    def measure(self, quality='full'):
         # Run measurement using current signals, project settings, and measurement parameters, and update measurement data.
         # For most measurements, output frequencies stored in self.out_freq, measurement value for that frequency converted
         # to desired output unit and stored in self.out_data. If a noise sample is present and the measurement is able to 
         # estimate the measurement noise floor the noise floor estimate will be stored in self.out_noise
+        # quality is 'full' or 'preview'. Preview analyses are used by the GUI to show something quickly before the full analysis is done. The signals are already
+        # decimated and the noise sample removed by run_measurements(), measurements should also use a coarser output grid (see output_freqs()) and skip any other optional detail
         pass # override with individual measurement measure() method
+
+    def output_freqs(self, quality='full'):
+        # array of output frequency points from the output parameters. Preview quality uses at most PREVIEW_POINTS_PER_OCTAVE or PREVIEW_NUM_POINTS points
+        num_points = self.params['output']['num_points']
+        if quality == 'preview':
+            num_points = min(num_points, PREVIEW_POINTS_PER_OCTAVE if self.params['output']['spacing'] == 'octave' else PREVIEW_NUM_POINTS)
+        return freq_points(self.params['output']['min_freq'],
+                           self.params['output']['max_freq'],
+                           num_points,
+                           self.params['output']['spacing'],
+                           self.params['output']['round_points'])
+
+    def remeasure(self):
+        # re-run only this measurement after one of its parameters changed, using the same (decimated) signals as a full analysis (see run_measurements())
+        # shared intermediates that weren't affected by the change (raw impulse response, filtered signals, etc.) are reused from earlier analyses
+        # in the GUI, the measurement runs on the background analysis worker and is plotted when the new results are ready
+        if clp.gui_mode:
+            from CLGui import analysis_worker
+            analysis_worker.submit([self])
+        else:
+            run_measurements(measurements=[self])
+
+    def result_key(self):
+        # stable hash of everything measure() depends on besides the signal arrays: measurement type and parameters, project parameters, and input channel info
+        # the measurement name doesn't change the output, so renamed measurements still share results
+        params = {key: value for key, value in self.params.items() if key != 'name'}
+        project = {key: value for key, value in clp.project.items() if key != 'measurements'}
+        key_data = json.dumps([type(self).__name__, params, project, clp.IO['input']], sort_keys=True, default=str)
+        return hashlib.sha1(key_data.encode()).hexdigest()
+
+    def calc_max_harmonic(self):
+        # highest harmonic of the chirp frequency that the measurement analyzes, used to determine how far the analysis can be decimated (see CLAnalysis.decimation_factor())
+        # measurements that need the full analysis bandwidth (broadband residuals, raw input channels, time domain outputs, etc.) should return np.inf
+        return 1 # override in measurements that analyze harmonics
+
+    def calc_max_analysis_freq(self):
+        # highest frequency the measurement output depends on: the highest chirp or output frequency (including a reference frequency for relative units) times the highest harmonic analyzed
+        # analysis is never decimated below this frequency (see CLAnalysis.decimation_factor()), so output points outside the chirp range aren't aliased
+        output = self.params.get('output', {})
+        freqs = [clp.project['start_freq'], clp.project['stop_freq'], output.get('max_freq', 0), output.get('ref_freq', 0)]
+        return max(freqs) * self.calc_max_harmonic()
+
+    def intermediates(self):
+        # keys of the shared analysis intermediates used by measure() with the current parameters (see CLAnalysis.analysis_intermediate())
+        # each intermediate is calculated once per analysis and released once every measurement that declared it is finished
+        return [] # override in measurements that use shared intermediates
     
+    # get_result() customized in:
+    # - ImpulseResponse
+    # - Waterfall
+    def get_result(self):
+        # return the most recently calculated measurement output as a MeasurementResult
+        # measure() replaces the out_* arrays instead of modifying them in place, so the result is not changed by later measurements
+        return MeasurementResult(self.params['name'], type(self).__name__, self.params['output']['unit'], self.out_freqs, self.out_points, self.out_noise)
+
     # get_measurement_data() customized in:
     # - ImpulseResponse
     def get_measurement_data(self, include_noise=True):
         # return X/Y measurement data as a pandas dataframe, typically for csv outputs like save_measurement_data or multi-file/multi-channel command-line outputs
         # measurements that do not support CSV export should return None
         # assumes measurement data will be self.out_points and possibly self.out_noise along self.out_freqs
+        import pandas as pd # pandas is slow to import, only load it when it's used
         out_frame = pd.DataFrame({'Frequency (Hz)':self.out_freqs, self.params['output']['unit']:self.out_points})
         if include_noise and any(self.out_noise):
             out_frame['measurement noise floor'] = self.out_noise
@@ -85,6 +171,9 @@ class CLMeasurement():
 
 
     def init_tab(self):
+        from CLGui import CLTab, QCollapsible, QHSeparator, undo_stack # GUI modules are only imported when the GUI is used
+        from qtpy.QtWidgets import QLineEdit
+        
         self.tab = CLTab()
         
         self.name_box = QLineEdit(self.params['name'])
@@ -145,16 +234,44 @@ class CLMeasurement():
     # - ImpulseResponse
     # - Waterfall
     def plot(self):
-        # basic plot, could be much more complex for different measurement types (like waterfalls)
+        import pyqtgraph as pg
         
-        self.tab.graph.clear()
+        # basic plot, could be much more complex for different measurement types (like waterfalls)
+        # curves are updated in place (see CLTab.set_curve()) instead of clearing the graph
         
         plot_pen = pg.mkPen(color=clp.PLOT_COLORS[0], width=clp.PLOT_PEN_WIDTH)
-        self.tab.graph.plot(self.out_freqs, self.out_points, name = self.measurement_type_name, pen=plot_pen) # todo: do something different when plotting a single point (pyqtgraph falls on its face otherwise)
+        self.tab.set_curve('points', self.out_freqs, self.out_points, self.trace_name(), plot_pen) # todo: do something different when plotting a single point (pyqtgraph falls on its face otherwise)
         
         if clp.project['plot_noise'] and any(self.out_noise):
             noise_pen = pg.mkPen(color=clp.NOISE_COLOR, width=clp.PLOT_PEN_WIDTH)
-            self.tab.graph.plot(self.out_freqs, self.out_noise, name='Noise Floor', pen=noise_pen)#, color='gray')
+            self.tab.set_curve('noise', self.out_freqs, self.out_noise, 'Noise Floor', noise_pen)
+        else:
+            self.tab.remove_curve('noise')
+
+        self.plot_channels()
+
+    def trace_name(self):
+        # legend name of the main measurement trace, includes the selected input channel when the other channels are overlaid
+        if clp.project.get('plot_all_channels') and len(self.channel_outputs) > 1:
+            return self.measurement_type_name + ' (Channel ' + str(clp.project['input']['channel']) + ')'
+        return self.measurement_type_name
+
+    def plot_channels(self, x_name='out_freqs', y_name='out_points', envelope=False):
+        # overlay the outputs of the other input channels (see clp.project['plot_all_channels']), with thin pens so the selected channel stands out
+        # clicking a trace in the legend hides/shows it
+        import pyqtgraph as pg
+
+        if clp.project.get('plot_all_channels'):
+            overlay = {channel: outputs for channel, outputs in self.channel_outputs.items() if channel != clp.project['input']['channel']}
+        else:
+            overlay = {}
+        for key in list(self.tab.curves):
+            if isinstance(key, tuple) and key[0] == 'channel' and key[1] not in overlay:
+                self.tab.remove_curve(key)
+        for channel, outputs in sorted(overlay.items()):
+            channel_pen = pg.mkPen(color=clp.PLOT_COLORS[channel % len(clp.PLOT_COLORS)], width=1)
+            self.tab.set_curve(('channel', channel), outputs[x_name], outputs[y_name], 'Channel ' + str(channel), channel_pen, envelope)
+            self.tab.curves[('channel', channel)].setZValue(-1) # draw the selected channel on top
 
         
 # list of the class names of all measurement types that are available
@@ -167,6 +284,153 @@ for measurement in MEASUREMENT_TYPES:
     
 
 
+# cache of recent measurement outputs, so switching back and forth between settings (A/B comparisons, undo/redo) doesn't recalculate measurements
+# keyed by CLMeasurement.result_key() and cleared whenever the analysis signals change. Least recently used results are dropped past RESULT_CACHE_BYTES
+RESULT_CACHE_BYTES = 64e6
+
+def get_result_cache():
+    source = tuple(clp.signals.get(name) for name in ['stimulus', 'response', 'noise', 'raw_response'])
+    cache = clp.caches.setdefault('measurement_results', {'source': None, 'results': {}})
+    if cache['source'] is None or any(a is not b for a, b in zip(cache['source'], source)):
+        cache['source'] = source
+        cache['results'].clear()
+    return cache['results']
+
+def result_nbytes(outputs):
+    return sum(value.nbytes for value in outputs.values() if isinstance(value, np.ndarray))
+
+def load_cached_result(measurement, key):
+    # copy cached outputs to the measurement's out_* attributes. Returns False if there is no cached result
+    with cache_lock:
+        results = get_result_cache()
+        outputs = results.pop(key, None)
+        if outputs is None:
+            return False
+        results[key] = outputs # move to most recently used
+    for name, value in outputs.items():
+        setattr(measurement, name, value)
+    return True
+
+def cache_result(measurement, key):
+    outputs = {name: value for name, value in vars(measurement).items() if name.startswith('out_')}
+    if result_nbytes(outputs) > RESULT_CACHE_BYTES: # too big to keep
+        return
+    with cache_lock:
+        results = get_result_cache()
+        results.pop(key, None)
+        results[key] = outputs
+        while sum(result_nbytes(outputs) for outputs in results.values()) > RESULT_CACHE_BYTES:
+            results.pop(next(iter(results))) # drop least recently used result
+
+def run_measurements(context=None, threads=None, measurements=None, cancel=None, quality='full'):
+    # run all project measurements on the current stimulus/response signals (at a reduced sample rate if automatic decimation is enabled) and return a list of MeasurementResults
+    # does not touch the GUI. Used by command-line mode and the GUI, and can be used to run chirplab analysis from other programs:
+    #   clp.load_project_file(project_path); init_measurements(); generate_stimulus()
+    #   clp.signals['raw_response'] = <input samples>; clp.IO['input']['sample_rate'] = <input sample rate>; read_response()
+    #   results = run_measurements()
+    # if context is provided, the measurements are run in that clp.AnalysisContext instead of the current context
+    # measurements are independent of each other, so they are run at the same time on a pool of threads (NumPy/SciPy release the GIL for FFTs and most array math)
+    # threads overrides clp.analysis_threads. Results are always returned in project measurement order
+    # measurements can be a subset of the project measurements to run. The decimation factor is still determined from all project measurements, so results match a full analysis
+    # cancel can be a threading.Event. Once it is set, measurements that haven't started yet are skipped and return None instead of a MeasurementResult
+    # measurements whose parameters, project, and signals match a recent analysis reuse the cached outputs instead of measuring again (see get_result_cache())
+    # quality='preview' runs a fast, approximate analysis: signals are decimated as far as the measurements being run allow, the noise sample is skipped, and measurements use a coarse output grid
+    if context is not None:
+        with clp.analysis_context(context):
+            return run_measurements(threads=threads, measurements=measurements, cancel=cancel, quality=quality)
+    if quality == 'preview':
+        # preview signals, intermediates, and results are cached separately, so previews don't push the full quality intermediates out of the caches
+        # stimulus artifacts and input channels are the same for both qualities, so those caches are shared
+        preview_context = copy(clp.get_context())
+        preview_context.caches = clp.caches.setdefault('preview', {})
+        preview_context.caches['stimulus_artifacts'] = get_stimulus_artifacts()
+        preview_context.caches['stimulus_cache_contents'] = get_stimulus_cache_contents()
+        preview_context.caches['channels'] = get_channel_cache()
+        with clp.analysis_context(preview_context):
+            return measure_all(measurements, threads, cancel, quality)
+    return measure_all(measurements, threads, cancel, quality)
+
+def measure_all(measurements, threads, cancel, quality):
+    # run_measurements() in the current context
+    if measurements is None:
+        measurements = clp.measurements
+    if threads is None:
+        threads = clp.analysis_threads
+    if threads == 0:
+        threads = os.cpu_count() or 1
+    threads = min(threads, len(measurements))
+
+    context = clp.get_context() # passed explicitly to the measurement threads, see clp.AnalysisContext
+    with decimated_analysis(quality, measurements if quality == 'preview' else None), read_only_signals():
+        # plan shared intermediates (raw impulse response, gated impulse responses, etc.) once the analysis sample rate is known
+        consumers = [measurement.intermediates() for measurement in measurements]
+        plan_intermediates(consumers)
+
+        def measure(measurement, intermediates):
+            try:
+                if cancel is not None and cancel.is_set():
+                    return None
+                key = measurement.result_key()
+                if not load_cached_result(measurement, key):
+                    measurement.measure(quality)
+                    cache_result(measurement, key)
+                return measurement.get_result()
+            finally:
+                release_intermediates(intermediates)
+
+        try:
+            if threads > 1:
+                with ThreadPoolExecutor(threads) as executor:
+                    # each measurement runs in the calling thread's clp.AnalysisContext, passed explicitly to the worker threads
+                    futures = [executor.submit(clp.run_in_context, context, measure, measurement, intermediates) for measurement, intermediates in zip(measurements, consumers)]
+                    results = [future.result() for future in futures] # re-raise the first measurement error (in measurement order)
+            else:
+                results = [measure(measurement, intermediates) for measurement, intermediates in zip(measurements, consumers)]
+        finally:
+            end_intermediates()
+    return results
+
+def channel_context(channel, caches=None):
+    # copy of the current analysis context that analyzes a different channel of clp.signals['raw_response'], with its own copies of the measurements
+    # caches can be a dict that is kept between analyses of the same channel. Stimulus artifacts don't depend on the input channel, so those caches are shared with the current context
+    # input channel caches are not shared, since the detected chirp position (and with it the aligned channels) is different for each channel
+    # signal arrays are shared with the current context as read-only views, so channels analyzed at the same time don't touch the writeable flags of the caller's arrays
+    context = copy(clp.get_context())
+    context.project = deepcopy(clp.project)
+    context.project['input']['channel'] = channel
+    context.IO = deepcopy(clp.IO)
+    context.caches = {} if caches is None else caches
+    context.signals = read_only_views(clp.signals, context.caches.setdefault('signal_views', {}))
+    context.caches['stimulus_artifacts'] = get_stimulus_artifacts()
+    context.caches['stimulus_cache_contents'] = get_stimulus_cache_contents()
+    measurements = clp.measurements # clp.measurements refers to the new context's measurement list inside analysis_context()
+    with clp.analysis_context(context):
+        context.measurements = [type(measurement)(measurement.params['name'], deepcopy(measurement.params)) for measurement in measurements]
+        read_response()
+    return context
+
+def run_channel_measurements(contexts, threads=None, measurements=None, cancel=None):
+    # run measurements on several input channels in one batch and return {channel: [MeasurementResult, ...]}. Used for the GUI all-channels overlay, e.g.:
+    #   contexts = {channel: channel_context(channel) for channel in range(1, clp.IO['input']['channels']+1)}
+    #   results = run_channel_measurements(contexts)
+    # contexts is a dict of {channel: channel_context(channel)}. The channels are run at the same time on one pool of threads, one channel per thread
+    # measurements can be a list of indexes into the project measurement list to run a subset of the measurements on each channel
+    # threads and cancel work the same as in run_measurements()
+    if threads is None:
+        threads = clp.analysis_threads
+    if threads == 0:
+        threads = os.cpu_count() or 1
+    threads = max(min(threads, len(contexts)), 1)
+
+    def measure_channel():
+        # runs in the channel's context
+        channel_measurements = None if measurements is None else [clp.measurements[index] for index in measurements]
+        return run_measurements(threads=1, measurements=channel_measurements, cancel=cancel)
+
+    with ThreadPoolExecutor(threads) as executor:
+        futures = {channel: executor.submit(clp.run_in_context, context, measure_channel) for channel, context in contexts.items()}
+        return {channel: future.result() for channel, future in futures.items()}
+
 def init_measurements():
     # builds (or rebuilds) a new set of measurement objects from current clp.project
     clp.measurements = []
@@ -1,33 +1,95 @@
 # module for sharing globals throughout chirplab
 
 from pathlib import Path
+from contextvars import ContextVar
+from contextlib import contextmanager
+from types import ModuleType
 
 import sys
 IS_BUNDLED = (getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS')) # true if Chirplab is being run via pyinstaller bundle
 
-# project dictionary containing parameters of log chirp used for signal generation and analysis, signal input and output, etc
-project = {}
+def new_IO():
+    # information to keep track of input and output file or device.
+    return {'input':{'length_samples':0,
+                     'sample_rate':0,
+                     'channels':0,
+                     'numtype':'',
+                     'delay': 0}, # detected chirp time offset in samples from the start of the signal (at the most recently calculated project analysis sample rate, *not* the raw input sample rate)
+            'output':{'channels': 0}} # hardware and file output both use project settings, except for num channels
+
+# all of the state for a single analysis. Everything in chirplab reads and writes the state of the current context through clp.project, clp.signals, etc.
+# the module-level default context is used unless another context is activated with analysis_context(), so separate analyses can run in separate threads (or one after another in the same thread) without sharing any state
+# the current context is a context variable, which new threads do *not* inherit. A thread started without its context silently reads and writes the default context instead
+# any thread that runs chirplab code has to be started with run_in_context() as its target, passing the context explicitly:
+#   Thread(target=clp.run_in_context, args=(context, function, ...)).start()
+#   executor.submit(clp.run_in_context, context, function, ...)
+# callbacks from threads chirplab doesn't start (e.g. audio device callbacks) only see the default context, which is the GUI's context
+class AnalysisContext():
+    def __init__(self, project=None, project_file=''):
+        # project dictionary containing parameters of log chirp used for signal generation and analysis, signal input and output, etc
+        self.project = {} if project is None else project
+        self.project_file = project_file # full path to the project file
+
+        # signals updated from chirp tab and used for analysis in measurements. Stimulus, response, impulse response, etc.
+        self.signals = {}
+
+        self.IO = new_IO()
+
+        # list of measurement objects (to be defined and instantiated based on measurement parameters in project dict)
+        self.measurements = []
+
+        # intermediate results cached by CLAnalysis and measurements (aligned input channels, stimulus spectrum, etc.), only valid for this context
+        self.caches = {}
+
+# attributes of CLProject that are read from and written to the current context
+CONTEXT_ATTRIBUTES = ['project', 'project_file', 'signals', 'IO', 'measurements', 'caches']
+
+default_context = AnalysisContext()
+current_context = ContextVar('current_context', default=default_context)
+
+def get_context():
+    return current_context.get()
+
+@contextmanager
+def analysis_context(context):
+    # make context the current context for the calling thread while inside the with block
+    # usage:
+    #   with analysis_context(AnalysisContext(project)):
+    #       generate_stimulus() ...
+    token = current_context.set(context)
+    try:
+        yield context
+    finally:
+        current_context.reset(token)
+
+def run_in_context(context, function, *args, **kwargs):
+    # call function(*args, **kwargs) with context as the current context. Target for every thread that runs chirplab code (see AnalysisContext)
+    with analysis_context(context):
+        return function(*args, **kwargs)
+
+class CLProjectModule(ModuleType):
+    # redirect clp.project, clp.signals, etc. to the current context. Reading or assigning them works the same as when they were plain module globals
+    def __getattr__(self, name):
+        if name in CONTEXT_ATTRIBUTES:
+            return getattr(get_context(), name)
+        raise AttributeError("module 'CLProject' has no attribute '" + name + "'")
+
+    def __setattr__(self, name, value):
+        if name in CONTEXT_ATTRIBUTES:
+            setattr(get_context(), name, value)
+        else:
+            super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = CLProjectModule
 
-project_file = '' # full path to the project file
 working_directory = '.' # directory to start any browse dialogs in, updated based on last GUI browse result
 
-# signals updated from chirp tab and used for analysis in measurements. Stimulus, response, impulse response, etc.
-signals = {}
-
-# information to keep track of input and output file or device.
-IO = {'input':{'length_samples':0,
-               'sample_rate':0,
-               'channels':0,
-               'numtype':'',
-               'delay': 0}, # detected chirp time offset in samples from the start of the signal (at the most recently calculated project analysis sample rate, *not* the raw input sample rate)
-      'output':{'channels': 0}} # hardware and file output both use project settings, except for num channels
-
-# list of measurement objects (to be defined and instantiated based on measurement parameters in project dict)
-measurements = []
-
 # global variable to check if Chirplab is running in CLI mode or GUI mode
 gui_mode = False
 
+# number of threads used to run the measurements of an analysis at the same time. 1 runs measurements one after another, 0 uses up to one thread per CPU
+analysis_threads = 0
+
 # external references
 # should probably be loaded from global config file, handled differently in compiled exe
 bin_dir = str(Path(__file__).parent) + '/bin/' # external binaries called at runtime
@@ -49,6 +111,8 @@ MIN_SAMPLE_RATE = 1000
 MAX_SAMPLE_RATE = 768000
 OUTPUT_BIT_DEPTHS = ['16 int', '24 int', '32 int', '32 float']
 MAX_OUTPUT_CHANNELS = 16
+PREVIEW_MIN_SAMPLES = 500000 # GUI analyses of longer stimulus signals plot a quick preview quality result before the full quality result is ready
+ANALYSIS_DEBOUNCE_MS = 150 # delay before rerunning measurements after a spinbox change, so scrolling or holding an arrow key only runs one analysis at the end
 
 
 # GUI style parameters
@@ -64,6 +128,7 @@ PLOT_COLORS = [ # default color order used by MATLAB
     '#A2142F'] # red
 NOISE_COLOR = '#808080'
 PLOT_PEN_WIDTH = 3 # some high density plots ignore this and force the pen width to 1, which is much faster
+THIN_PEN_POINTS = 5000 # curves with more points than this are drawn with 1 pixel pens, wide pens get very slow with many points
 
 
 # default project parameters
@@ -73,14 +138,13 @@ else:
     newproj_response_dir = '../examples/'
 
 def new_project():
-    global project_file
-    project_file = 'New Project'
+    context = get_context()
+    context.project_file = 'New Project'
 
     global working_directory
     working_directory = str(Path(__file__).parent)
     
-    global project
-    project = {
+    context.project = {
         'chirplab_version': CHIRPLAB_VERSION,
         
         # chirp parameters
@@ -93,6 +157,7 @@ def new_project():
         'post_sweep': 0.05,
         'sample_rate': 48000, # sample rate in Hz used for all analysis
         'use_input_rate': True, # get the sample rate of the input file or device and update sample_rate before performing and calculations
+        'auto_decimate': False, # run measurements at a reduced sample rate when the chirp and measurement output frequencies (and highest analyzed harmonic) only cover a small portion of the analysis bandwidth. Output frequency points are not affected
         
         # calibration parameters
         'FS_per_Pa': 1.0, # acoustic input level in Full Scale units per Pascal. e.g. for a 94dBSPL sensitivity of -37dBFS, FS_per_Pa = 0.0141
@@ -103,6 +168,8 @@ def new_project():
         'plot_noise': True, # plot the measurement noise floor in the GUI
         'save_noise': True, # output the measurement noise floor when saving measurement data from the GUI or the command line
 
+        'plot_all_channels': False, # overlay the measurements of every input channel in the GUI, the selected channel is highlighted
+
         # parameters of stimulus file or audio output device
         'output': {
             'mode': 'file', # 'file' or 'device'
@@ -115,7 +182,7 @@ def new_project():
             'post_sweep': 0.5,
             'include_silence': True, # preprend output signal with silence of length pre_sweep + chirp_length + post_sweep for measurement noise floor estimation
             'device': '', # output sound card device name. If blank or otherwise not found, will change to the default output device for the target host API
-            'api': 'MME', # sound card host API to target. If blank or otherwise not found, will default to the first element in the DeviceIO.HOST_APIS list (i.e. MME on Windows)
+            'api': 'MME', # sound card host API to target. If blank or otherwise not found, will default to the first element in the DeviceIO.get_host_apis() list (i.e. MME on Windows)
             },
         
         # parameters of input file containing recording of chirp response or audio input device to record response
@@ -150,32 +217,21 @@ import yaml
 from pathlib import Path
 
 def load_project_file(load_path):
-    global project
+    context = get_context()
     with open(load_path) as in_file:
         # todo: add some sort of project format validation
-        project = yaml.safe_load(in_file)
+        context.project = yaml.safe_load(in_file)
     
-    # todo: resetting globals is just duplicated from top of file, refactor this to some sort of start-from-scratch function
-    global signals
-    signals = {}
-
-    global IO
-    IO = {'input':{'length_samples':0,
-                   'sample_rate':0,
-                   'channels':0,
-                   'numtype':'',
-                   'delay': 0},
-      'output':{}}
-
-    global project_file
-    project_file = load_path
+    context.signals = {}
+    context.IO = new_IO()
+    context.caches = {}
+    context.project_file = load_path
     
     global working_directory
     working_directory = str(Path(load_path).parent)
 
 def save_project_file(save_path):
-    global project
     with open(save_path, 'w') as out_file:
-        out_file.write(yaml.dump(project))
+        out_file.write(yaml.dump(get_context().project))
 
 
@@ -3,36 +3,56 @@ import CLProject as clp
 import numpy as np
 import sys
 
-pa = pyaudio.PyAudio()
+# PortAudio is initialized on first device use, so importing DeviceIO (or file-only analysis) never scans audio hardware
+# host API and device info tables are read once and cached, call restart_pyaudio() to re-scan devices (e.g. after plugging in a new interface)
+pa = None
+device_tables = {'apis': None, 'devices': None}
+
+def get_pyaudio():
+    global pa
+    if pa is None:
+        pa = pyaudio.PyAudio()
+    return pa
+
+def get_api_infos():
+    if device_tables['apis'] is None:
+        device_tables['apis'] = [get_pyaudio().get_host_api_info_by_index(i) for i in range(get_pyaudio().get_host_api_count())]
+    return device_tables['apis']
+
+def get_device_infos():
+    if device_tables['devices'] is None:
+        device_tables['devices'] = [get_pyaudio().get_device_info_by_index(i) for i in range(get_pyaudio().get_device_count())]
+    return device_tables['devices']
 
 def get_api_names():
-    num_apis = pa.get_host_api_count()
-    api_names = []
-    for i in range(num_apis):
-        api = pa.get_host_api_info_by_index(i)
-        api_names.append(api['name'])
-    return api_names
-
-# List of host APIs that are supported. By default only make use of MME and WASAPI
-if sys.platform == 'win32':
-    # MME is the highest-level Windows audio API, the one used by most programs that don't need to know or care about the actual hardware being used. Limited to 2 channels, worst-case latency, automatic resampling, volume control can't be bypassed, etc.
-    # WASAPI is the base audio API on Windows. All audio on Windows goes through WASAPI (except for stuff like ASIO that specifically bypasses WASAPI). Channels, sammple rates, and formats are RAW, no resampling. Latency can be competitive with ASIO (but it depends on a lot of factors)
-    # DirectSound and WDM are older APIs. DirectSound provides high level resampling and other convenience features, primarily for DirectX games. I believe it still has unique use-cases for games and media apps, but none which are particularly relevant to audio measurements. WDM used to provide direct access to devices for low latency. Now they DirectSound and WDM go through WASAPI for backwards compatibility with older software targeting those APIs
-    HOST_APIS = ['MME', 'Windows WASAPI']
-elif 'linux' in sys.platform:
-    # ALSA is the base auio API for most Linux distros, similar to WASAPI but with feature bloat over the years. Instead use JACK if at all possible
-    # JACK is an audio processing server in the traditional Linux modular server-client model. It started as a compatibility layer to overcome some of the limitations of ALSA and has grown to be the de facto standard audio interface for serious audio in Linux. PipeAudio is theoretically backwards compatible with JACK, but documentation and examples are hard to find
-    HOST_APIS = ['ALSA']
-    if 'JACK Audio Connection Kit' in get_api_names(): # todo: actually test this on a machine with Jack installed
-        HOST_APIS += ['JACK Audio Connection Kit']
-else:
-    # Core Audio is the Mac audio API. Thinner and more expensive than other APIs. Incompatible with headphone jacks.
-    HOST_APIS = ['Core Audio']
+    return [api['name'] for api in get_api_infos()]
+
+def get_host_apis():
+    # List of host APIs that are supported. By default only make use of MME and WASAPI
+    if sys.platform == 'win32':
+        # MME is the highest-level Windows audio API, the one used by most programs that don't need to know or care about the actual hardware being used. Limited to 2 channels, worst-case latency, automatic resampling, volume control can't be bypassed, etc.
+        # WASAPI is the base audio API on Windows. All audio on Windows goes through WASAPI (except for stuff like ASIO that specifically bypasses WASAPI). Channels, sammple rates, and formats are RAW, no resampling. Latency can be competitive with ASIO (but it depends on a lot of factors)
+        # DirectSound and WDM are older APIs. DirectSound provides high level resampling and other convenience features, primarily for DirectX games. I believe it still has unique use-cases for games and media apps, but none which are particularly relevant to audio measurements. WDM used to provide direct access to devices for low latency. Now they DirectSound and WDM go through WASAPI for backwards compatibility with older software targeting those APIs
+        return ['MME', 'Windows WASAPI']
+    elif 'linux' in sys.platform:
+        # ALSA is the base auio API for most Linux distros, similar to WASAPI but with feature bloat over the years. Instead use JACK if at all possible
+        # JACK is an audio processing server in the traditional Linux modular server-client model. It started as a compatibility layer to overcome some of the limitations of ALSA and has grown to be the de facto standard audio interface for serious audio in Linux. PipeAudio is theoretically backwards compatible with JACK, but documentation and examples are hard to find
+        host_apis = ['ALSA']
+        if 'JACK Audio Connection Kit' in get_api_names(): # todo: actually test this on a machine with Jack installed
+            host_apis += ['JACK Audio Connection Kit']
+        return host_apis
+    else:
+        # Core Audio is the Mac audio API. Thinner and more expensive than other APIs. Incompatible with headphone jacks.
+        return ['Core Audio']
 
 def restart_pyaudio():
+    # re-initialize PortAudio and re-scan host APIs and devices on next use
     global pa
-    pa.terminate()
-    pa = pyaudio.PyAudio()
+    if pa is not None:
+        pa.terminate()
+        pa = None
+    device_tables['apis'] = None
+    device_tables['devices'] = None
 
 def win2utf8(win_str):
     # convert mangled text incorrectly decoded as Windows-1252 to utf-8
@@ -46,10 +66,8 @@ def api_name_to_index(name):
 
 def get_device_names(input_or_output='', api=''):
     apis = get_api_names()
-    num_devices = pa.get_device_count()
     devices = []
-    for i in range(num_devices):
-        device = pa.get_device_info_by_index(i)
+    for device in get_device_infos():
         if api and api != apis[device['hostApi']]:
             continue # skip device if API is specified and device uses a different API
         if input_or_output=='input' and not device['maxInputChannels']:
@@ -61,40 +79,38 @@ def get_device_names(input_or_output='', api=''):
 
 def device_name_to_index(device_name, api_name=''): # API needs to be specified because it is very likely for a device to have the same name for multiple APIs
     if not api_name:
-        api_name = HOST_APIS[0]
+        api_name = get_host_apis()[0]
     api_index = api_name_to_index(api_name)
 
-    num_devices = pa.get_device_count()
-    for i in range(num_devices):
-        device = pa.get_device_info_by_index(i)
+    for i, device in enumerate(get_device_infos()):
         if device['hostApi']==api_index and win2utf8(device['name'])==device_name:
             return i
         
 def get_default_input_device(api_name=''):
     if not api_name:
-        return(win2utf8(pa.get_default_input_device_info()['name']))
-    device_index = pa.get_host_api_info_by_index(api_name_to_index(api_name))['defaultInputDevice']
-    return(win2utf8(pa.get_device_info_by_index(device_index)['name']))
+        return(win2utf8(get_pyaudio().get_default_input_device_info()['name']))
+    device_index = get_api_infos()[api_name_to_index(api_name)]['defaultInputDevice']
+    return(win2utf8(get_device_infos()[device_index]['name']))
 
 def get_default_output_device(api_name=''):
     if not api_name:
-        return(win2utf8(pa.get_default_output_device_info()['name']))
-    device_index = pa.get_host_api_info_by_index(api_name_to_index(api_name))['defaultOutputDevice']
-    return(win2utf8(pa.get_device_info_by_index(device_index)['name']))
+        return(win2utf8(get_pyaudio().get_default_output_device_info()['name']))
+    device_index = get_api_infos()[api_name_to_index(api_name)]['defaultOutputDevice']
+    return(win2utf8(get_device_infos()[device_index]['name']))
 
 def is_sample_rate_valid(sample_rate, device_name, api_name):
     device_index = device_name_to_index(device_name, api_name)
-    device = pa.get_device_info_by_index(device_index)
+    device = get_device_infos()[device_index]
     if device['maxInputChannels'] > device['maxOutputChannels']: # theoretically, devices with both input and output channels support the same sample rates for input and output
         # input device
         try:
-            return pa.is_format_supported(rate=sample_rate, input_device=device_index, input_channels=device['maxInputChannels'], input_format=pyaudio.paFloat32)
+            return get_pyaudio().is_format_supported(rate=sample_rate, input_device=device_index, input_channels=device['maxInputChannels'], input_format=pyaudio.paFloat32)
         except ValueError:
             return False
     else:
         # output device
         try:
-            return pa.is_format_supported(rate=sample_rate, output_device=device_index, output_channels=device['maxOutputChannels'], output_format=pyaudio.paFloat32)
+            return get_pyaudio().is_format_supported(rate=sample_rate, output_device=device_index, output_channels=device['maxOutputChannels'], output_format=pyaudio.paFloat32)
         except ValueError:
             return False
 
@@ -107,12 +123,12 @@ def get_valid_standard_sample_rates(device_name, api_name):
 
 def get_num_input_channels(device_name, api_name):
     device_index = device_name_to_index(device_name, api_name)
-    device = pa.get_device_info_by_index(device_index)
+    device = get_device_infos()[device_index]
     return device['maxInputChannels']
 
 def get_num_output_channels(device_name, api_name):
     device_index = device_name_to_index(device_name, api_name)
-    device = pa.get_device_info_by_index(device_index)
+    device = get_device_infos()[device_index]
     return device['maxOutputChannels']
 
 def play(out_signal, sample_rate, device_name, api_name, active_callback=None, finished_callback=None):
@@ -146,11 +162,11 @@ def play(out_signal, sample_rate, device_name, api_name, active_callback=None, f
 
         return (data, pyaudio.paContinue)
 
-    stream = pa.open(rate=sample_rate, channels=num_channels, format=pyaudio.paFloat32, output=True, output_device_index=device_index, stream_callback=play_callback)
+    stream = get_pyaudio().open(rate=sample_rate, channels=num_channels, format=pyaudio.paFloat32, output=True, output_device_index=device_index, stream_callback=play_callback)
 
 def record(record_length_samples, sample_rate, device_name, api_name, active_callback=None, finished_callback=None):
     device_index = device_name_to_index(device_name, api_name)
-    num_channels = pa.get_device_info_by_index(device_index)['maxInputChannels']
+    num_channels = get_device_infos()[device_index]['maxInputChannels']
     
     record_frames = []
 
@@ -168,11 +184,11 @@ def record(record_length_samples, sample_rate, device_name, api_name, active_cal
                 finished_callback(np.hstack(record_frames).reshape(-1 , num_channels)) # is there a more direct way to asynchronously output data? Returning record_frames ends the recording early and waiting for the recording to finish blocks GUI thread
             return (None, pyaudio.paComplete)
 
-    stream = pa.open(rate=sample_rate, channels=num_channels, format=pyaudio.paFloat32, input=True, input_device_index=device_index, stream_callback=record_callback)
+    stream = get_pyaudio().open(rate=sample_rate, channels=num_channels, format=pyaudio.paFloat32, input=True, input_device_index=device_index, stream_callback=record_callback)
 
 def stream_input(sample_rate, device_name, api_name, stream_callback, samples_per_chunk=None):
     device_index = device_name_to_index(device_name, api_name)
-    num_channels = pa.get_device_info_by_index(device_index)['maxInputChannels']
+    num_channels = get_device_infos()[device_index]['maxInputChannels']
 
     def callback(in_data, frame_count, time_info, status):
         stream_callback(np.frombuffer(in_data, dtype=np.float32).reshape(-1, num_channels))
@@ -180,20 +196,17 @@ def stream_input(sample_rate, device_name, api_name, stream_callback, samples_pe
 
     # return handle to stream object. Will continue streaming to callback indefinitely until <stream>.close_stream() is called
     if samples_per_chunk is None:
-        return pa.open(rate=sample_rate, channels=num_channels, format=pyaudio.paFloat32, input=True, input_device_index=device_index, stream_callback=callback)
+        return get_pyaudio().open(rate=sample_rate, channels=num_channels, format=pyaudio.paFloat32, input=True, input_device_index=device_index, stream_callback=callback)
     else:
-        return pa.open(rate=sample_rate, channels=num_channels, format=pyaudio.paFloat32, input=True, input_device_index=device_index, stream_callback=callback, frames_per_buffer=samples_per_chunk)
+        return get_pyaudio().open(rate=sample_rate, channels=num_channels, format=pyaudio.paFloat32, input=True, input_device_index=device_index, stream_callback=callback, frames_per_buffer=samples_per_chunk)
 
 
 # run directly to print out APIs and devices for debugging purposes
 if __name__ == '__main__':
-    num_apis = pa.get_host_api_count()
-    api_names = []
-    for i in range(num_apis):
-        print(pa.get_host_api_info_by_index(i))
+    for api in get_api_infos():
+        print(api)
 
     print('')
 
-    num_devices = pa.get_device_count()
-    for i in range(num_devices):
-        print(pa.get_device_info_by_index(i))
+    for device in get_device_infos():
+        print(device)
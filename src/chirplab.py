@@ -1,14 +1,11 @@
 import CLProject as clp
-from pyqtgraph.Qt import mkQApp
-from qtpy.QtCore import Qt
 import sys
 from pathlib import Path
 from glob import glob
-from CLGui import MainWindow
-from CLAnalysis import check_sox, read_audio_file, audio_file_info, generate_stimulus, read_response, FormatNotSupportedError, generate_stimulus_file, channel_list_str2int
+from CLAnalysis import check_sox, read_audio_file, audio_file_info, generate_stimulus, read_response, FormatNotSupportedError, generate_stimulus_file, channel_list_str2int, load_stimulus_cache, save_stimulus_cache
 import argparse
 import numpy as np
-from CLMeasurements import init_measurements
+from CLMeasurements import init_measurements, run_measurements
 
 def main():
     parser = argparse.ArgumentParser()
@@ -18,8 +15,13 @@ def main():
     parser.add_argument('-i', '--input', nargs='+', help='override input file. When running in command-line mode, multiple input files can be analyzed by providing a space-separated list or using wildcards (*)')
     parser.add_argument('--channel', help='override which channel from input file is analyzed. When running in command-line mode, multiple input channels can be analyzed with "all" or with a comma-separated list of channels, with ranges indicated by hyphens. e.g. 1,3,5-7 --> channels 1, 3, 5, 6, and 7')
     parser.add_argument('-o', '--output', help='override measurement data output directory')
+    parser.add_argument('--cache', action='store_true', help='in command-line mode, save the generated stimulus and related data to a <project file>.cache file next to the project file, and reuse it on later runs if the chirp parameters have not changed. Speeds up repeated processing with the same project')
+    parser.add_argument('--threads', type=int, help='number of threads used to run measurements at the same time. 1 runs measurements one after another. Defaults to one thread per CPU')
     args = parser.parse_args() # todo: clean up help print formatting
 
+    if args.threads is not None:
+        clp.analysis_threads = max(args.threads, 0)
+
     if args.c or args.stimulus:
         if not args.project:
             print('please specify ChirpLab project file for command-line processing')
@@ -42,6 +44,9 @@ def main():
                 hWnd = win32gui.GetForegroundWindow()
                 win32gui.ShowWindow(hWnd, 0) # hide the console window
         
+        # GUI modules are only imported in GUI mode, so command-line processing doesn't need to load Qt, pyqtgraph, or matplotlib
+        from pyqtgraph.Qt import mkQApp
+        from qtpy.QtCore import Qt
         app = mkQApp() # same as a regular QApplication, but first sets up some environment stuff to handle DPI scaling across multiple monitors
         if hasattr(Qt.ApplicationAttribute,'AA_DisableWindowContextHelpButton'): #PyQt5 adds a help question mark to all dialog boxes. Doesn't exist in PySide6
             app.setAttribute(Qt.ApplicationAttribute.AA_DisableWindowContextHelpButton)
@@ -91,7 +96,12 @@ def main():
         
         # initialize measurements from project
         init_measurements()
-        generate_stimulus()
+        if args.cache:
+            cache_file = Path(str(args.project) + '.cache')
+            if not load_stimulus_cache(cache_file):
+                generate_stimulus()
+        else:
+            generate_stimulus()
 
         # get input file(s) and loop through them
         if len(input_files) < 1:
@@ -124,8 +134,14 @@ def main():
                 clp.project['input']['channel'] = input_channel
                 read_response()
 
+                # run measurements (at a reduced sample rate if automatic decimation is enabled)
+                run_measurements()
+
+                # update the stimulus cache once measurements have calculated everything they derive from the stimulus (only written if anything new was calculated)
+                if args.cache:
+                    save_stimulus_cache(cache_file)
+
                 for i in range(len(clp.measurements)):
-                    clp.measurements[i].measure()
                     if len(input_files) == 1 and len(input_channels) == 1: # single input file and single input channel. Output standard measurement data
                         clp.measurements[i].save_measurement_data(out_dir)
                         # todo: throw a warning that some output files will be overwritten if multiple measurements have the same name
@@ -177,6 +193,7 @@ def main():
             
     
     # not CLI mode, launch GUI
+    from CLGui import MainWindow
     window = MainWindow()
     window.show()
     
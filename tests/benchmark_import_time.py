@@ -0,0 +1,39 @@
+import sys
+import subprocess
+import time
+from pathlib import Path
+import numpy as np
+
+# benchmark of the chirplab command-line startup time: fresh interpreters importing the same modules as chirplab.py, before any project is loaded
+# usage:
+#   python tests/benchmark_import_time.py [runs] [project file]
+# if a project file is given, the full `chirplab.py -c <project file>` run is timed as well
+
+SRC_PATH = Path(__file__).parent.parent / 'src'
+IMPORT_CODE = 'import CLProject, CLAnalysis, CLMeasurements'
+TARGET_SECONDS = 0.5 # "a few hundred ms" for the command-line startup, on top of the interpreter and numpy, which every run needs anyway
+
+def time_command(command, runs):
+    # median wall time of running command in a fresh interpreter (including interpreter startup)
+    times = []
+    for run in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=SRC_PATH, check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    baseline = time_command([sys.executable, '-c', 'import numpy'], runs)
+    startup = time_command([sys.executable, '-c', IMPORT_CODE], runs)
+    print('interpreter + numpy: {:.0f}ms'.format(baseline*1000))
+    print('chirplab imports: {:.0f}ms ({:.0f}ms over numpy)'.format(startup*1000, (startup-baseline)*1000))
+    if len(sys.argv) > 2:
+        cli = time_command([sys.executable, 'chirplab.py', str(Path(sys.argv[2]).resolve()), '-c'], runs)
+        print('chirplab -c {}: {:.0f}ms'.format(sys.argv[2], cli*1000))
+    if startup - baseline > TARGET_SECONDS:
+        print('startup is over the {:.0f}ms target'.format(TARGET_SECONDS*1000))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
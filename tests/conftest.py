@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# chirplab modules are imported from src/, the same as running chirplab.py
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
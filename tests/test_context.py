@@ -0,0 +1,27 @@
+import CLProject as clp
+import CLAnalysis
+from threading import Thread
+
+def test_threads_use_their_own_context():
+    # analyses started with clp.run_in_context() use their own project and signals, without touching the default context
+    clp.new_project()
+    default_project = clp.project
+    default_stimulus = clp.signals.get('stimulus')
+    stimulus_lengths = {}
+    def generate(chirp_length):
+        clp.project['chirp_length'] = chirp_length
+        CLAnalysis.generate_stimulus()
+        stimulus_lengths[chirp_length] = len(clp.signals['stimulus'])
+
+    threads = []
+    for chirp_length in [0.5, 2.0]:
+        context = clp.AnalysisContext(dict(default_project))
+        threads.append(Thread(target=clp.run_in_context, args=(context, generate, chirp_length)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stimulus_lengths[2.0] - stimulus_lengths[0.5] == round(1.5 * default_project['sample_rate'])
+    assert clp.project is default_project
+    assert clp.signals.get('stimulus') is default_stimulus
@@ -0,0 +1,20 @@
+import CLProject as clp
+import CLAnalysis
+
+def test_decimation_keeps_output_points():
+    # auto decimation must not drop the analysis bandwidth below the output frequency range, even if the chirp covers a much smaller range
+    from CLMeasurements import FrequencyResponse
+    clp.new_project()
+    clp.project['start_freq'] = 20
+    clp.project['stop_freq'] = 2000
+    clp.project['auto_decimate'] = True
+    measurement = FrequencyResponse('Frequency Response')
+    clp.measurements = [measurement]
+
+    measurement.params['output']['max_freq'] = 20000
+    assert CLAnalysis.decimation_factor() == 1
+
+    measurement.params['output']['max_freq'] = 2000
+    factor = CLAnalysis.decimation_factor()
+    assert factor > 1
+    assert 2000 < (clp.project['sample_rate']/2) * 0.8 / factor
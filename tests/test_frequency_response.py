@@ -0,0 +1,50 @@
+import CLProject as clp
+import numpy as np
+from pathlib import Path
+from scipy.io import wavfile
+from scipy.fftpack import fft
+from scipy.signal.windows import hann
+import CLAnalysis
+
+EXAMPLE_RESPONSE = Path(__file__).parent.parent / 'examples' / 'new-project_response.wav'
+
+def load_example_response():
+    # default project analyzing the example response. The wav file is read directly so the test doesn't need sox
+    clp.new_project()
+    CLAnalysis.generate_stimulus()
+    sample_rate, samples = wavfile.read(EXAMPLE_RESPONSE)
+    clp.signals['raw_response'] = samples / 2.0**31
+    clp.IO['input']['sample_rate'] = sample_rate
+    clp.IO['input']['channels'] = 1
+    CLAnalysis.read_response()
+
+def per_point_fft_fr(ir, out_freqs):
+    # reference adaptive windowed frequency response: full-length FFT of the windowed impulse response for each output point, interpolated at the point
+    sample_rate = clp.project['sample_rate']
+    fft_freqs = np.arange(len(ir)) * sample_rate / len(ir)
+    out_fr = []
+    for freq in out_freqs:
+        wavelength_ms = max(1.0, 1000/freq)
+        window_start = round(wavelength_ms / 1000 * sample_rate) # fade in over the whole window start
+        window_end = round(2*wavelength_ms / 1000 * sample_rate)
+        fade_out = window_start
+        window = np.zeros(len(ir))
+        window[:window_start] = hann(2*window_start)[:window_start]
+        window[window_start:window_end] = 1
+        window[window_start+window_end-fade_out:window_start+window_end] = hann(2*fade_out)[fade_out:]
+        fr = np.abs(fft(ir * np.roll(window, -window_start)))
+        out_fr.append(np.interp(freq, fft_freqs[1:len(ir)//2-1], fr[1:len(ir)//2-1]))
+    return np.array(out_fr)
+
+def test_adaptive_fr_matches_per_point_fft():
+    from CLMeasurements import FrequencyResponse
+    from CLMeasurements.FrequencyResponse import calc_adaptive_fr
+    load_example_response()
+    measurement = FrequencyResponse('Frequency Response')
+    out_freqs = measurement.output_freqs()
+    irs = CLAnalysis.raw_impulse_response().real # response and noise impulse responses
+
+    out_fr = calc_adaptive_fr(irs, out_freqs)
+    for ir, fr in zip(irs, out_fr):
+        error_dB = 20*np.log10(fr / per_point_fft_fr(ir, out_freqs))
+        assert np.max(np.abs(error_dB)) < 0.1 # the reference interpolates between FFT bins, which is off by a few hundredths of a dB on the rough noise spectrum
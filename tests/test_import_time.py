@@ -0,0 +1,15 @@
+import sys
+import subprocess
+from pathlib import Path
+
+SRC_PATH = Path(__file__).parent.parent / 'src'
+
+# modules that take a large part of a second to import and are only needed by some measurements, file outputs, or the GUI
+SLOW_MODULES = ['scipy.signal', 'scipy.stats', 'pandas', 'qtpy', 'pyqtgraph', 'matplotlib', 'requests']
+
+def test_command_line_imports_skip_slow_modules():
+    # command-line startup imports the analysis and measurement modules (see chirplab.py), slow modules should only be loaded where they are used
+    # run in a fresh interpreter, since other tests may have already imported them. See benchmark_import_time.py for the actual startup time
+    code = 'import sys, CLProject, CLAnalysis, CLMeasurements; print(",".join(m for m in {} if m in sys.modules))'.format(SLOW_MODULES)
+    result = subprocess.run([sys.executable, '-c', code], cwd=SRC_PATH, check=True, capture_output=True, text=True)
+    assert result.stdout.strip() == ''